@@ -0,0 +1,134 @@
+import atexit
+import csv
+import datetime
+import os
+import queue
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from db_pool import get_pool
+
+CSV_HEADER = ['Timestamp', 'Username', 'System Name', 'IP Address']
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class AccessLogWriter:
+    """
+    Background writer for user access logs.
+
+    log() only puts the entry on an in-process queue. A single writer thread
+    drains the queue, batch-inserts into user_access_logs with execute_values
+    every flush_interval seconds (or as soon as batch_size rows are waiting)
+    and appends the same rows to the CSV mirror. Having one writer thread means
+    CSV lines are never interleaved. close() (also registered with atexit)
+    flushes whatever is still queued.
+    """
+
+    def __init__(self, db_config, csv_file, batch_size=100, flush_interval=0.5, max_queue=10000):
+        self.db_config = db_config
+        self.csv_file = csv_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, username, system_name, ip_address, access_time=None):
+        """Queues one access entry; never blocks the caller."""
+        entry = (access_time or datetime.datetime.now(), username, system_name, ip_address)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            print(f"[Warning] Access log queue full. Dropped entry for: {username}")
+
+    # --- Writer thread ---
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _next_batch(self):
+        """Waits up to flush_interval for the first entry, then drains up to batch_size."""
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # Take whatever is immediately available, then flush
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        # 1. Write to DB
+        try:
+            with get_pool(self.db_config).connection() as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        execute_values(cur, """
+                            INSERT INTO user_access_logs (access_time, username, system_name, ip_address)
+                            VALUES %s
+                        """, batch)
+        except Exception as e:
+            print(f"[DB Log Error] Failed to log {len(batch)} access entries: {e}")
+
+        # 2. Try to append to CSV (Best Effort)
+        try:
+            file_exists = os.path.isfile(self.csv_file)
+            with open(self.csv_file, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if not file_exists:
+                    writer.writerow(CSV_HEADER)
+                writer.writerows(
+                    [ts.strftime("%Y-%m-%d %H:%M:%S"), username, system_name, ip_address]
+                    for ts, username, system_name, ip_address in batch
+                )
+        except PermissionError:
+            print(f"[Warning] CSV Locked. Logged {len(batch)} access entries to DB only.")
+        except Exception as e:
+            print(f"[Error] CSV Write Failed: {e}")
+
+    def close(self, timeout=10):
+        """Stops the writer after flushing all queued entries."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+def get_access_log_writer(db_config, csv_file):
+    """Returns the process-wide writer for (db_config, csv_file), starting it on first use."""
+    key = (tuple(sorted((k, str(v)) for k, v in db_config.items())), csv_file)
+    writer = _writers.get(key)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(key)
+            if writer is None:
+                writer = AccessLogWriter(db_config, csv_file)
+                _writers[key] = writer
+    return writer
+
+
+@atexit.register
+def close_access_log_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -1,22 +1,30 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, Response
 import socket
 import csv
 from io import StringIO, BytesIO
 from ops import DbOperations
+from db_pool import configure_pool
+from host_resolver import HostnameResolver
+from report_xlsx import XLSX_MIMETYPE, write_report_xlsx
+from payloads import FORMATS as COMPACT_FORMATS, compress_response, json_response, to_columnar
 import json
 import getpass
 import psycopg2
 import os
+import tempfile
 from datetime import datetime, timedelta, date
 import uuid
 from psycopg2.extras import RealDictCursor
 # Placeholder import for your existing PPT logic
 try:
-    from ppt_generator import generate_presentation, fetch_data, prepare_data_dictionary
+    from ppt_batch import fetch_batch_data, render_batch, batch_filename
+    from ppt_jobs import DeckJobQueue, QueueFull
 except ImportError:
-    generate_presentation = None
-    fetch_data = None
-    prepare_data_dictionary = None
+    fetch_batch_data = None
+    render_batch = None
+    batch_filename = None
+    DeckJobQueue = None
+    QueueFull = None
 
 app = Flask(__name__)
 app.secret_key = 'internal_secret_key'
@@ -30,11 +38,32 @@ DB_CONFIG = {
     'port': '5432'
 }
 
+# Shared connection pool (see db_pool.py for all options)
+DB_POOL_CONFIG = {
+    'minconn': 1,
+    'maxconn': 10,
+}
+configure_pool(DB_CONFIG, **DB_POOL_CONFIG)
+
+# Background PPT generation (see ppt_jobs.py): concurrent renders, max queued+running
+# jobs before submissions are refused, seconds a finished deck stays downloadable
+PPT_JOB_CONFIG = {
+    'workers': 2,
+    'max_pending': 20,
+    'keep_finished': 900,
+}
+ppt_jobs = DeckJobQueue(DB_CONFIG, **PPT_JOB_CONFIG) if DeckJobQueue else None
+# Seconds /generate_ppt waits for a deck before answering 202 with the job's URLs
+PPT_SYNC_WAIT = 10
+
+# Reverse-DNS cache for client system names (lookups run in the background)
+hostname_resolver = HostnameResolver(ttl=3600, negative_ttl=300, max_size=1024)
+
 def get_user_identity():
     """
     Determines user identity.
     1. Checks Flask Session (persists across tabs).
-    2. Fallback: Uses nslookup on client IP to get system name.
+    2. Fallback: Reverse DNS on client IP to get system name (cached, non-blocking).
     """
     
     # 1. Retrieve from session
@@ -46,14 +75,19 @@ def get_user_identity():
     else:
         ip = request.remote_addr
  
-    system_name = "Unknown-System"
-    try:
+    # System name is resolved once per login and kept in the session;
+    # until the background lookup finishes the IP placeholder is shown.
+    system_name = session.get('system_name') if session.get('system_ip') == ip else None
+    if not system_name:
         if ip == '127.0.0.1':
             system_name = socket.gethostname()
         else:
-            system_name = socket.gethostbyaddr(ip)[0]
-    except:
-        system_name = f"IP-{ip}"
+            system_name = hostname_resolver.lookup(ip)
+        if system_name:
+            session['system_name'] = system_name
+            session['system_ip'] = ip
+        else:
+            system_name = f"IP-{ip}"
  
     display_name = f"Hi, {username}" if username else f"System: {system_name}"
    
@@ -77,6 +111,7 @@ def index():
         form_username = request.form.get('username')
         if form_username:
             session['username'] = form_username
+            session.pop('system_name', None)  # re-resolve once for this login
             return redirect(url_for('index'))
             
     user = get_user_identity()
@@ -92,33 +127,58 @@ def reporting():
     user = get_user_identity()
     return render_template('reporting.html', user=user)
 
+def csv_download(chunks, filename):
+    """Chunked (streaming) CSV attachment response."""
+    return Response(
+        chunks,
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @app.route('/download_access_logs')
 def download_access_logs():
     db = DbOperations(DB_CONFIG)
-    cols, rows = db.get_access_logs()
-    
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(cols)
-    cw.writerows(rows)
-    output = BytesIO()
-    output.write(si.getvalue().encode('utf-8'))
-    output.seek(0)
-    
-    return send_file(output, mimetype='text/csv', download_name='user_access_logs.csv', as_attachment=True)
+    return csv_download(db.stream_access_logs_csv(), 'user_access_logs.csv')
 
 # --- API: Dropdowns ---
+def conditional_json(data):
+    """JSON response with an ETag; answers 304 Not Modified if the client copy matches."""
+    resp = jsonify(data)
+    resp.add_etag()
+    resp.headers['Cache-Control'] = 'no-cache'  # always revalidate, reuse body on 304
+    return resp.make_conditional(request)
+
 @app.route('/api/customers')
 def api_customers():
     db = DbOperations(DB_CONFIG)
-    return jsonify(db.get_customers())
+    return conditional_json(db.get_customers())
 
 @app.route('/api/months/<path:short_code>')
 def api_months(short_code):
     db = DbOperations(DB_CONFIG)
-    return jsonify(db.get_months(short_code))
+    return conditional_json(db.get_months(short_code))
 
 # --- API: Load Data ---
+def data_response(payload, row_keys=()):
+    """
+    JSON response for the data endpoints. With format=columnar or format=columns
+    the payload entries named in row_keys (a row dict or a list of them) are
+    sent in that compact layout and encoded by payloads.dumps; otherwise the
+    usual jsonify body. Either way the body is gzip/brotli-compressed when the
+    client accepts it.
+    """
+    accept_encoding = request.headers.get('Accept-Encoding')
+    fmt = request.values.get('format')
+    if fmt not in COMPACT_FORMATS:
+        return compress_response(jsonify(payload), accept_encoding)
+
+    for key in row_keys:
+        rows = payload.get(key)
+        if rows is not None:
+            payload[key] = to_columnar(rows if isinstance(rows, list) else [rows], fmt)
+    payload['format'] = fmt
+    return json_response(payload, accept_encoding)
+
 @app.route('/load_metrics', methods=['POST'])
 def load_metrics():
     short_code = request.form.get('short_code')
@@ -133,11 +193,59 @@ def load_metrics():
     if not data:
         return jsonify({'success': False, 'message': 'No data found for selection'})
 
-    return jsonify({
+    return data_response({
         'success': True,
-        'data': data,   # Rows from final_computed_table
+        'data': data,   # Row from final_metrics (targets/limits in effect for the month)
         'config': config # Rows from customer_mapping_table
-    })
+    }, row_keys=('data', 'config'))
+
+# Closed months never change: clients may keep the snapshot for a year
+SNAPSHOT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@app.route('/snapshots/<month>/<path:short_code>')
+def month_snapshot(month, short_code):
+    """
+    The /load_metrics payload of a closed month, read from its snapshot.
+    The strong ETag identifies the exact body (snapshot, format, encoding),
+    so revalidation answers 304 without a body. The ETag is computed from the
+    snapshot, which is read from the database once per process and cached.
+    """
+    try:
+        month = date.fromisoformat(month)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid month'}), 404
+    db = DbOperations(DB_CONFIG)
+    snapshot = db.load_snapshot(short_code, month)
+    if snapshot is None:
+        return jsonify({'success': False, 'message': 'This month is not closed'}), 404
+
+    resp = data_response({
+        'success': True,
+        'closed': True,
+        'data': snapshot['data'],
+        'config': snapshot['config']
+    }, row_keys=('data', 'config'))
+    variant = [snapshot['etag'], request.args.get('format'), resp.headers.get('Content-Encoding')]
+    resp.set_etag('.'.join(v for v in variant if v))
+    resp.headers['Cache-Control'] = SNAPSHOT_CACHE_CONTROL
+    return resp.make_conditional(request)
+
+@app.route('/close_month', methods=['POST'])
+def close_month():
+    """
+    Freezes a past month into immutable snapshots: form/JSON 'month'
+    (YYYY-MM-DD) and optionally 'short_code' (default: all customers).
+    """
+    try:
+        params = request.get_json(silent=True) or request.form
+        month = params.get('month')
+        if not month:
+            return jsonify({'success': False, 'message': 'Missing month'}), 400
+        db = DbOperations(DB_CONFIG)
+        closed = db.close_month(month, params.get('short_code') or None, get_user_identity()['username'])
+        return jsonify({'success': True, 'closed': closed})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
 
 # --- API: Updates ---
 def build_audit_info(req):
@@ -230,11 +338,53 @@ def save_config():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/bulk_update_metrics', methods=['POST'])
+def bulk_update_metrics():
+    """
+    Applies many customer-month metric rows in one go.
+    Accepts a CSV upload ('file'), a text/csv body, or JSON: either a list of
+    rows or {'rows': [...], 'comment': '...'}. Columns/keys: short_code, month
+    plus any of the /save_availability, /save_users, /save_storage and
+    /save_tickets field names.
+    """
+    try:
+        audit_info = build_audit_info(request)
+        upload = request.files.get('file')
+        if upload:
+            rows = list(csv.DictReader(StringIO(upload.read().decode('utf-8-sig'))))
+        elif request.mimetype == 'text/csv':
+            rows = list(csv.DictReader(StringIO(request.get_data(as_text=True))))
+        else:
+            payload = request.get_json(silent=True) or {}
+            if isinstance(payload, dict):
+                rows = payload.get('rows') or []
+                audit_info['comments'] = audit_info.get('comments') or payload.get('comment')
+            else:
+                rows = payload
+
+        if not rows:
+            return jsonify({'success': False, 'message': 'No rows supplied'}), 400
+        if not audit_info.get('comments'):
+            audit_info['comments'] = "Bulk metrics update"
+
+        db = DbOperations(DB_CONFIG)
+        results = db.bulk_update_metrics(rows, audit_info)
+        failed = sum(1 for r in results if not r['success'])
+        return jsonify({
+            'success': failed == 0,
+            'total': len(results),
+            'updated': len(results) - failed,
+            'failed': failed,
+            'results': results
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 # --- API: Reporting Page ---
 @app.route('/api/reporting/csm_list')
 def api_csm_list():
     db = DbOperations(DB_CONFIG)
-    return jsonify(db.get_csm_list())
+    return conditional_json(db.get_csm_list())
 
 @app.route('/api/reporting/months')
 def api_reporting_months():
@@ -242,7 +392,7 @@ def api_reporting_months():
     sc = request.args.get('short_code')
     csm = request.args.get('csm')
     db = DbOperations(DB_CONFIG)
-    return jsonify(db.get_reporting_months(short_code=sc, csm=csm))
+    return conditional_json(db.get_reporting_months(short_code=sc, csm=csm))
 
 @app.route('/load_report_data', methods=['POST'])
 def load_report_data():
@@ -252,8 +402,23 @@ def load_report_data():
     range_val = request.form.get('range', 6)
     
     db = DbOperations(DB_CONFIG)
+    if request.form.get('page_size'):
+        # Paged: keyset cursor ('after'), sort directions and a customer filter
+        try:
+            page = db.load_report_page(
+                short_code=sc, csm=csm, month_year=month, no_of_months=range_val,
+                after=request.form.get('after') or None,
+                page_size=request.form.get('page_size'),
+                customer_sort=request.form.get('customer_sort', 'asc'),
+                month_sort=request.form.get('month_sort', 'desc'),
+                customer_filter=request.form.get('customer_filter') or None,
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return data_response({'success': True, **page}, row_keys=('data',))
+
     data = db.load_report(short_code=sc, csm=csm, month_year=month, no_of_months=range_val)
-    return jsonify({'success': True, 'data': data})
+    return data_response({'success': True, 'data': data}, row_keys=('data',))
 
 @app.route('/download_report_csv', methods=['POST'])
 def download_report_csv():
@@ -282,6 +447,24 @@ def download_report_csv():
     filename = f"Report_{sc or csm}_{month}.csv"
     return send_file(output, mimetype='text/csv', download_name=filename, as_attachment=True)
 
+@app.route('/download_report_xlsx', methods=['POST'])
+def download_report_xlsx():
+    sc = request.form.get('short_code')
+    csm = request.form.get('csm')
+    month = request.form.get('month')
+    range_val = request.form.get('range', 6)
+
+    db = DbOperations(DB_CONFIG)
+    rows = db.stream_report_source(short_code=sc, csm=csm, month_year=month, no_of_months=range_val)
+
+    # Built in an anonymous temp file (removed when closed), not in memory
+    output = tempfile.TemporaryFile()
+    write_report_xlsx(rows, output)
+    output.seek(0)
+
+    filename = f"Report_{sc or csm}_{month}.xlsx"
+    return send_file(output, mimetype=XLSX_MIMETYPE, download_name=filename, as_attachment=True)
+
 @app.route('/add_customer', methods=['POST'])
 def add_customer():
     try:
@@ -312,59 +495,111 @@ def api_audits():
 @app.route('/download_audits')
 def download_audits():
     db = DbOperations(DB_CONFIG)
-    cols, rows = db.get_audit_csv_data()
-    
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(cols)
-    cw.writerows(rows)
-    output = BytesIO()
-    output.write(si.getvalue().encode('utf-8'))
-    output.seek(0)
-    
-    return send_file(output, mimetype='text/csv', download_name='audit_logs.csv', as_attachment=True)
+    return csv_download(db.stream_audit_csv(), 'audit_logs.csv')
+
+PPTX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+def submit_ppt_job(customer, month):
+    """Submits a deck job; returns (job, None) or (None, error response)."""
+    if not customer or not month:
+        return None, (jsonify({'success': False, 'message': 'Missing customer or month'}), 400)
+    try:
+        return ppt_jobs.submit(customer, month), None
+    except QueueFull as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': '5'})
+
+def ppt_job_result(job):
+    """Response for a finished job: the deck, or the error as JSON."""
+    if job.status == 'done':
+        return send_file(
+            BytesIO(job.content),
+            mimetype=PPTX_MIMETYPE,
+            as_attachment=True,
+            download_name=job.filename
+        )
+    if isinstance(job.error, LookupError):
+        return jsonify({'success': False, 'message': str(job.error)}), 404
+    return jsonify({'success': False, 'message': f"Server Error: {job.error}"}), 500
 
 @app.route('/generate_ppt', methods=['POST'])
 def generate_ppt_route():
+    """
+    Download when the deck is ready within PPT_SYNC_WAIT seconds (e.g. cached);
+    otherwise 202 with the job's status and download URLs to poll, so a slow
+    render does not hold a request thread.
+    """
+    try:
+        job, error = submit_ppt_job(request.form.get('customer'), request.form.get('month'))
+        if error:
+            return error
+        if not job.wait(timeout=PPT_SYNC_WAIT):
+            status_url = url_for('ppt_job_status', job_id=job.id)
+            return jsonify({
+                'success': False,
+                'message': 'Generation is taking longer than expected',
+                'job': job.to_dict(),
+                'status_url': status_url,
+                'download_url': url_for('ppt_job_download', job_id=job.id),
+            }), 202, {'Location': status_url}
+        return ppt_job_result(job)
+
+    except Exception as e:
+        print(f"PPT Error: {str(e)}") 
+        return jsonify({'success': False, 'message': f"Server Error: {str(e)}"}), 500
+
+# --- PPT Jobs (submit, poll, download) ---
+@app.route('/ppt_jobs', methods=['POST'])
+def submit_ppt_job_route():
+    job, error = submit_ppt_job(request.form.get('customer'), request.form.get('month'))
+    if error:
+        return error
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+
+@app.route('/ppt_jobs/<job_id>')
+def ppt_job_status(job_id):
+    job = ppt_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown or expired job'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/ppt_jobs/<job_id>/download')
+def ppt_job_download(job_id):
+    job = ppt_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown or expired job'}), 404
+    if not job.finished:
+        return jsonify({'success': False, 'message': 'Deck is not ready yet', 'job': job.to_dict()}), 409
+    return ppt_job_result(job)
+
+@app.route('/generate_ppt_batch', methods=['POST'])
+def generate_ppt_batch_route():
+    """All decks for a month (optionally only one CSM's customers) as one zip."""
     try:
-        customer = request.form.get('customer')
         month = request.form.get('month')
-        
-        if not customer or not month:
-            return jsonify({'success': False, 'message': 'Missing customer or month'}), 400
+        csm = request.form.get('csm') or None
 
-        conn = psycopg2.connect(**DB_CONFIG)
-        
-        try:
-            # 1. Fetch Data
-            customer_mapping_df, final_computed_df = fetch_data(conn, customer, month)
-            
-            if customer_mapping_df.empty or final_computed_df.empty:
-                return jsonify({'success': False, 'message': 'No data found for this selection'}), 404
+        if not month:
+            return jsonify({'success': False, 'message': 'Missing month'}), 400
 
-            # 2. Prepare Data Dictionary
-            data_dict = prepare_data_dictionary(customer_mapping_df, final_computed_df, month)
-            
-            # 3. Generate PPT
-            dt_obj = datetime.strptime(month, '%Y-%m-%d')
-            year_str = dt_obj.strftime('%Y')
-            month_str = dt_obj.strftime('%b')
-            output_filename = f"{customer}-{year_str}-{month_str}.pptx"
-            generate_presentation(data_dict, output_filename)
-            
-            # 4. Send File
-            return_data = send_file(output_filename, as_attachment=True, download_name=output_filename)
-            return return_data
-            
-        finally:
-            conn.close()
-            if 'output_filename' in locals() and os.path.exists(output_filename):
-                pass 
+        db = DbOperations(DB_CONFIG)
+        with db.connection() as conn:
+            batch = fetch_batch_data(conn, month, csm)
+
+        if not batch:
+            return jsonify({'success': False, 'message': 'No data found for this selection'}), 404
+
+        zip_buffer, results = render_batch(batch, month)
+        return send_file(
+            zip_buffer,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=batch_filename(month, csm)
+        )
 
     except Exception as e:
-        print(f"PPT Error: {str(e)}") 
+        print(f"PPT Batch Error: {str(e)}")
         return jsonify({'success': False, 'message': f"Server Error: {str(e)}"}), 500
-        
+
 @app.route('/daily_tracker')
 def daily_tracker():
     user = get_user_identity()
@@ -376,19 +611,8 @@ def daily_tracker():
     } for c in customers]
 
     # tasks_list
-    conn = db.get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT DISTINCT new_subtasks
-                FROM task_details
-                WHERE COALESCE(new_subtasks,'') <> ''
-                ORDER BY new_subtasks
-            """)
-            tasks_list = [r[0] for r in cur.fetchall()]
-    finally:
-        conn.close()
-        
+    tasks_list = db.dt_task_list()
+
     today = date.today()
     min_entry_date = (today - timedelta(days=365)).isoformat()
     max_entry_date = today.isoformat()
@@ -438,8 +662,9 @@ def daily_tracker_delete():
 @app.route('/daily_tracker/copy', methods=['POST'])
 def daily_tracker_copy():
     payload = request.get_json() or {}
+    user = get_user_identity()
     db = DbOperations(DB_CONFIG)
-    return jsonify(db.dt_copy(payload))
+    return jsonify(db.dt_copy(payload, user.get('username')))
 
 @app.route('/daily_tracker/download_csv')
 def daily_tracker_download_csv():
@@ -452,4 +677,8 @@ def daily_tracker_download_csv():
     return db.dt_download_csv(args, username)
 
 if __name__ == '__main__':
+    # Report pending migrations / missing or unused indexes once (not again in the reloader child)
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        from migrations import log_schema_report
+        log_schema_report(DB_CONFIG)
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,113 @@
+"""
+Micro-benchmarks for PPT generation.
+
+Usage:
+    python bench_ppt.py [--iterations N]
+
+Needs ppt_template.pptx next to ppt_generator.py (no database required).
+"""
+import argparse
+import subprocess
+import sys
+import time
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from pptx import Presentation
+
+import ppt_generator
+
+
+def timed(label, func, iterations):
+    func()  # warm-up (fills caches, imports)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - start) / iterations
+    print(f"{label:<45} {per_call * 1000:8.2f} ms/deck")
+    return per_call
+
+
+def sample_window(months=12, envs=3, end=date(2025, 6, 1)):
+    """Synthetic (CustomerConfig, [MonthMetrics]) window, shaped like fetch_data()."""
+    rules = {"Color1": 99.5, "Color2": 99.0, "Color3": 90.0}
+    colors = {k: (0, 128, 0) for k in ("Color1", "Color2", "Color3", "Invalid")}
+    config = ppt_generator.CustomerConfig(
+        short_code="BENCH", customer_name="Benchmark Customer", csm_primary="CSM",
+        no_of_environments=envs, no_of_months=months,
+        indicator_color_code_rules=colors, circle_color_code_rules=colors,
+        color_map_thresholds_availability=rules, color_map_thresholds_users=rules,
+        color_map_thresholds_storage=rules,
+        notes_availability=None, notes_users=None, notes_storage=None,
+    )
+    rows = []
+    for i in range(months):
+        values = [0.995, 0.99, 500, 100, 50, 400 + i, 80, 20, 900.0 + i, 300.0, 100.0,
+                  1000.0, 500.0, 200.0, 10 + i, 8 + i, 20]
+        rows.append(ppt_generator.MonthMetrics(end - relativedelta(months=months - 1 - i), *values))
+    return config, rows
+
+
+def bench_import(iterations):
+    print("Module import (fresh interpreter)")
+    times = []
+    for _ in range(max(3, iterations // 5)):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import ppt_generator"], check=True)
+        times.append(time.perf_counter() - start)
+    label = "  import ppt_generator (best of runs)"
+    print(f"{label:<45} {min(times) * 1000:8.2f} ms")
+
+
+def bench_prepare(iterations):
+    print("prepare_data_dictionary")
+    config, rows = sample_window()
+    timed("  12-month window, 3 environments", lambda: ppt_generator.prepare_data_dictionary(config, rows, "2025-06-01"), iterations)
+
+
+def bench_template_loading(iterations):
+    print("Template loading")
+    before = timed(
+        "  locate + Presentation(path) (old)",
+        lambda: Presentation(ppt_generator.locate_ppt_template()),
+        iterations
+    )
+    after = timed("  load_ppt_template() (cached clone)", ppt_generator.load_ppt_template, iterations)
+    print(f"  speed-up: {before / after:.1f}x")
+
+
+def bench_render(iterations):
+    print("generate_presentation (template bindings)")
+    config, rows = sample_window()
+    data = ppt_generator.prepare_data_dictionary(config, rows, "2025-06-01")
+    timed("  full deck, 3 environments", lambda: ppt_generator.generate_presentation(data), iterations)
+
+    # Charts bound to the same series share one workbook blob
+    written = []
+    original = ppt_generator.SharedChartData.xlsx_blob.fget
+
+    def counting(chart_data):
+        if chart_data._xlsx_blob is None:
+            written.append(chart_data)
+        return original(chart_data)
+
+    ppt_generator.SharedChartData.xlsx_blob = property(counting)
+    try:
+        ppt_generator.generate_presentation(data)
+    finally:
+        ppt_generator.SharedChartData.xlsx_blob = property(original)
+    print(f"  chart workbooks written per deck: {len(written)} (7 charts)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    bench_import(args.iterations)
+    bench_prepare(args.iterations)
+    bench_template_loading(args.iterations)
+    bench_render(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import functools
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache with per-entry TTL and LRU eviction.
+
+    Keys are tuples; invalidate() drops every key that starts with one of the
+    given prefixes, e.g. invalidate(('months', 'ABC')) or invalidate(('customers',)).
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, ttl=300, max_size=512):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *prefixes):
+        with self._lock:
+            stale = [k for k in self._data if any(k[:len(p)] == p for p in prefixes)]
+            for k in stale:
+                del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def cached(self, name):
+        """
+        Decorator for methods: caches the result under (name, *args, *sorted kwargs).
+        'self' is not part of the key, so all instances share entries.
+        """
+        _missing = object()
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(obj, *args, **kwargs):
+                key = (name,) + args + tuple(sorted(kwargs.items()))
+                value = self.get(key, _missing)
+                if value is _missing:
+                    value = func(obj, *args, **kwargs)
+                    self.set(key, value)
+                return value
+            return wrapper
+        return decorator
+
+
+class DiskLRUCache:
+    """
+    Blob cache on local disk, bounded by total size.
+
+    Entries live at <directory>/<namespace>/<key><suffix>. A hit touches the
+    file's mtime, and set() evicts the least recently used files until the
+    cache fits in max_bytes again. Files are written to a temp name and
+    renamed, so concurrent readers (threads or worker processes) never see a
+    partial entry. invalidate(namespace) drops every entry of a namespace.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+    def _namespace_dir(self, namespace):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', str(namespace)))
+
+    def _path(self, namespace, key):
+        return os.path.join(self._namespace_dir(namespace), key + self.suffix)
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return blob
+
+    def set(self, namespace, key, blob):
+        folder = self._namespace_dir(namespace)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, self._path(namespace, key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._evict()
+
+    def _entries(self):
+        """[(mtime, size, path)] for every cached file."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith('.tmp'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            folder = self._namespace_dir(namespace)
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.scandir(folder):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for folder in os.scandir(self.directory):
+                if folder.is_dir():
+                    self.invalidate(folder.name)
+
+
+# Dropdown lists (customers, months, CSMs) - invalidated by DbOperations writes
+dropdown_cache = TTLCache(ttl=300, max_size=512)
+
+# Generated decks, keyed by a hash of their inputs - see ppt_generator.render_deck
+deck_cache = DiskLRUCache(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deck_cache'),
+    max_bytes=512 * 1024 * 1024,
+    suffix='.pptx',
+)
+
+# Closed-month snapshots (DbOperations.load_snapshot) are immutable: entries never
+# expire and are only evicted when the cache is full. Open months are cached with
+# a short TTL and dropped by close_month.
+snapshot_cache = TTLCache(ttl=float('inf'), max_size=4096)
@@ -0,0 +1,170 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+# Defaults used when a pool is created lazily (i.e. configure_pool was never called)
+DEFAULT_POOL_OPTIONS = {
+    'minconn': 1,
+    'maxconn': 10,
+    'checkout_timeout': 30,      # seconds to wait for a free connection
+    'health_check_after': 30,    # ping connections idle for longer than this (seconds)
+    'max_lifetime': 1800,        # recycle connections older than this (seconds)
+}
+
+_pools = {}
+_pool_options = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_config):
+    return tuple(sorted((k, str(v)) for k, v in db_config.items()))
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool shared by the whole process.
+
+    Wraps psycopg2's ThreadedConnectionPool and adds:
+      * blocking checkout (with timeout) instead of PoolError when exhausted
+      * a 'SELECT 1' health check on connections that sat idle for a while
+      * recycling of connections that are too old or broken (e.g. after a DB restart)
+    """
+
+    def __init__(self, db_config, minconn=1, maxconn=10, checkout_timeout=30,
+                 health_check_after=30, max_lifetime=1800):
+        self.db_config = dict(db_config)
+        self.minconn = int(minconn)
+        self.maxconn = int(maxconn)
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+
+        self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_config)
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        self._created = {}    # id(conn) -> creation timestamp
+        self._last_used = {}  # id(conn) -> last checkin timestamp
+
+    # --- Internal helpers ---
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            created = self._created.setdefault(id(conn), now)
+            last_used = self._last_used.get(id(conn), created)
+        if self.max_lifetime and now - created > self.max_lifetime:
+            return False
+        if now - last_used > self.health_check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                return False
+        return True
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+            self._last_used.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    # --- Public API ---
+    def getconn(self):
+        """Checks out a healthy connection. Blocks up to checkout_timeout seconds."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolError(
+                f"No database connection available within {self.checkout_timeout}s "
+                f"(maxconn={self.maxconn})"
+            )
+        try:
+            # A stale connection is replaced by a fresh one; after a DB restart every
+            # pooled connection may be dead, so keep going until one passes.
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+            raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, dropping it if it is no longer usable."""
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            try:
+                # Never hand out a connection in the middle of a transaction
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._discard(conn)
+                return
+            with self._lock:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager: 'with pool.connection() as conn:' returns conn on exit."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._lock:
+            self._created.clear()
+            self._last_used.clear()
+        self._pool.closeall()
+
+
+def configure_pool(db_config, **options):
+    """
+    Sets the pool options for db_config (overrides DEFAULT_POOL_OPTIONS).
+    Call once at startup; the pool itself is opened lazily on first use so the
+    app can start while the database is still unreachable.
+    """
+    settings = dict(DEFAULT_POOL_OPTIONS)
+    settings.update(options)
+    key = _pool_key(db_config)
+    with _pools_lock:
+        _pool_options[key] = settings
+        old = _pools.pop(key, None)
+    if old is not None:
+        old.closeall()
+
+
+def get_pool(db_config):
+    """Returns the shared pool for db_config, creating it on first use."""
+    key = _pool_key(db_config)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                settings = _pool_options.get(key, DEFAULT_POOL_OPTIONS)
+                pool = ConnectionPool(db_config, **settings)
+                _pools[key] = pool
+    return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.closeall()
@@ -0,0 +1,60 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HostnameResolver:
+    """
+    Reverse-DNS cache for client IPs.
+
+    lookup() never blocks: it returns the cached host name (or None when the
+    name is unknown / still being resolved) and schedules a gethostbyaddr in a
+    small background thread pool. Results are cached per IP with a TTL, failed
+    lookups are cached too (shorter TTL) so IPs without a PTR record are not
+    retried on every request, and the cache is bounded (LRU).
+    """
+
+    def __init__(self, ttl=3600, negative_ttl=300, max_size=1024, workers=4):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()  # ip -> (host name or None, expires_at)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rdns')
+
+    def lookup(self, ip):
+        """Returns the cached host name for ip, or None if unknown/pending."""
+        if not ip:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(ip)
+            if entry and entry[1] > now:
+                self._cache.move_to_end(ip)
+                return entry[0]
+            if ip not in self._pending:
+                self._pending.add(ip)
+                self._executor.submit(self._resolve, ip)
+            # Serve a stale name while it is being refreshed
+            return entry[0] if entry else None
+
+    def _resolve(self, ip):
+        try:
+            name = socket.gethostbyaddr(ip)[0]
+            ttl = self.ttl
+        except (OSError, UnicodeError):
+            name = None
+            ttl = self.negative_ttl
+        with self._lock:
+            self._pending.discard(ip)
+            self._cache[ip] = (name, time.monotonic() + ttl)
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,67 @@
+"""
+Materializer for final_computed_table.
+
+final_computed_table is derived from availability_table, users_table,
+storage_table and tickets_computed_table (ops.FINAL_SOURCES). Triggers on those
+tables (migration 4) record the (short_code, month_year) keys every write
+touches in final_dirty_keys; a refresh recomputes only those final rows with
+one set-based statement. Metric saves refresh their customer in the same
+transaction, so this CLI is for writes made outside the app.
+
+Usage:
+    python materializer.py [refresh] [--customer ABC]   # recompute dirty keys
+    python materializer.py rebuild                      # recompute every key of the source tables
+    python materializer.py check [--limit 50] [--fix]   # report (and repair) drift; report unrecorded target changes
+"""
+import argparse
+import sys
+
+from ops import DbOperations
+
+
+def _print_result(result):
+    print(f"{result['keys']} key(s) refreshed: {result['updated']} row(s) updated, "
+          f"{result['inserted']} inserted, {len(result['customers'])} customer(s) changed.")
+
+
+def main():
+    from app import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='refresh', choices=['refresh', 'rebuild', 'check'])
+    parser.add_argument('--customer', action='append', help="refresh only this short code (repeatable)")
+    parser.add_argument('--limit', type=int, default=50, help="drift rows to list (check)")
+    parser.add_argument('--fix', action='store_true', help="refresh the drifted keys (check)")
+    args = parser.parse_args()
+
+    db = DbOperations(DB_CONFIG)
+    if args.command == 'refresh':
+        _print_result(db.refresh_final(args.customer))
+
+    elif args.command == 'rebuild':
+        _print_result(db.rebuild_final())
+
+    else:
+        total, rows = db.check_final(args.limit)
+        for source, short_code, month_year, missing, columns in rows:
+            detail = "missing in final_computed_table" if missing else ", ".join(columns)
+            print(f"{source:<24} {short_code:<12} {month_year}  {detail}")
+        if total > len(rows):
+            print(f"... {total - len(rows)} more")
+        print(f"{total} drifted row(s).")
+        if total and args.fix:
+            _print_result(db.fix_final_drift())
+            total = db.check_final(1)[0]
+
+        # Not fixed automatically: whether the stored value or the record is right needs a person
+        hidden, rows = db.check_terms(args.limit)
+        for terms, short_code, month_year, columns in rows:
+            print(f"{terms:<24} {short_code:<12} {month_year}  {', '.join(columns)} not recorded")
+        if hidden > len(rows):
+            print(f"... {hidden - len(rows)} more")
+        print(f"{hidden} unrecorded target/limit change(s).")
+        sys.exit(1 if total or hidden else 0)
+
+
+if __name__ == '__main__':
+    main()
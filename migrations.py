@@ -0,0 +1,534 @@
+"""
+Versioned schema migrations, index verification and query-plan checks.
+
+Usage:
+    python migrations.py [migrate]    # apply pending migrations
+    python migrations.py status       # applied / pending versions
+    python migrations.py verify       # required indexes present? unused indexes?
+    python migrations.py check-plans  # EXPLAIN the hot queries, fail if they do not use their index
+
+MIGRATIONS is an ordered list of (version, description, step), where step is
+SQL or a function taking a cursor. Applied versions are recorded in
+schema_migrations; each pending migration runs in its own transaction. Steps
+are idempotent (IF NOT EXISTS, or skipped when an equivalent index already
+exists), so a database where a DBA created some of the objects is fine.
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+from psycopg2.extras import RealDictCursor
+
+from ops import (DT_AGGREGATES_SQL, DT_ENTRIES_SQL, DT_EXPORT_SQL, DT_TASK_TYPE_SQL, FINAL_SOURCES,
+                 MONTH_CLOSED_SQLSTATE, REPORT_STORE_DDL, TERM_GROUPS, DbOperations)
+
+# An index the application's queries rely on. columns are the leading key
+# columns; any existing index starting with them satisfies the spec (e.g. the
+# table's primary key). Expression indexes use columns=None and match by name.
+IndexSpec = namedtuple("IndexSpec", "table columns name ddl")
+
+
+def _index(table, columns, name, ddl=None):
+    return IndexSpec(table, columns, name,
+                     ddl or f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+# Indexes per migration. Each list is frozen once its migration has shipped:
+# a new index gets a new list and a new migration, never an entry here.
+DAILY_TRACKER_INDEXES = (
+    # Daily tracker (migration 1)
+    _index("task_entries", ("userid", "log_date"), "task_entries_user_log_date_idx",
+           "CREATE INDEX IF NOT EXISTS task_entries_user_log_date_idx "
+           "ON task_entries (userid, log_date) INCLUDE (task_type, time_in_min)"),
+    _index("task_details", None, "task_details_subtask_norm_idx",
+           "CREATE INDEX IF NOT EXISTS task_details_subtask_norm_idx "
+           "ON task_details ((TRIM(LOWER(new_subtasks))))"),
+)
+
+HOT_PATH_INDEXES = (
+    # Metric lookups/updates by customer-month (load_metrics, update_*, reports, PPT)
+    _index("final_computed_table", ("short_code", "month_year"), "final_computed_table_sc_month_idx"),
+    _index("availability_table", ("short_code", "month_year"), "availability_table_sc_month_idx"),
+    _index("users_table", ("short_code", "month_year"), "users_table_sc_month_idx"),
+    _index("storage_table", ("short_code", "month_year"), "storage_table_sc_month_idx"),
+    _index("tickets_computed_table", ("short_code", "month_year"), "tickets_computed_table_sc_month_idx"),
+    # csm_primary = %s OR csm_lead = %s: one index per column, combined with a BitmapOr
+    _index("customer_mapping_table", ("csm_primary",), "customer_mapping_csm_primary_idx"),
+    _index("customer_mapping_table", ("csm_lead",), "customer_mapping_csm_lead_idx"),
+    # Newest-first listings (audit panel, access log export)
+    _index("audit_logs", ("changed_at",), "audit_logs_changed_at_idx"),
+    _index("user_access_logs", ("access_time",), "user_access_logs_access_time_idx"),
+)
+
+# Every index the application relies on (verify, schema report)
+REQUIRED_INDEXES = DAILY_TRACKER_INDEXES + HOT_PATH_INDEXES
+
+
+def _existing_indexes(cur, table):
+    """{index name: [key column or expression, ...]} for table (None if the table does not exist)."""
+    cur.execute("SELECT to_regclass(%s)", (table,))
+    if cur.fetchone()[0] is None:
+        return None
+    cur.execute("""
+        SELECT i.relname,
+            ARRAY(
+                SELECT pg_get_indexdef(x.indexrelid, k, true)
+                FROM generate_series(1, x.indnkeyatts) AS k
+                ORDER BY k
+            )
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = to_regclass(%s)
+    """, (table,))
+    return dict(cur.fetchall())
+
+
+def find_index(cur, spec):
+    """
+    Name of an index satisfying spec, or None. Returns False when the
+    table does not exist (nothing to index).
+    """
+    existing = _existing_indexes(cur, spec.table)
+    if existing is None:
+        return False
+    if spec.name in existing:
+        return spec.name
+    if spec.columns:
+        for name, keys in existing.items():
+            if tuple(k.strip('"') for k in keys[:len(spec.columns)]) == tuple(spec.columns):
+                return name
+    return None
+
+
+def ensure_indexes(specs):
+    """Migration step: creates each spec's index unless an equivalent one exists."""
+    def step(cur):
+        for spec in specs:
+            if find_index(cur, spec) is None:
+                cur.execute(spec.ddl)
+    return step
+
+
+def _column_types(cur, table, columns):
+    """{column: SQL type} of table's columns, e.g. {'updated_target': 'numeric(5,4)'}."""
+    cur.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    """, (table,))
+    types = dict(cur.fetchall())
+    return {c: types[c] for c in columns} if columns else types
+
+
+def create_term_tables(cur):
+    """
+    Effective-dated targets/limits (ops.TERM_GROUPS): one table per group with
+    the column types of final_computed_table, seeded with one record per
+    customer wherever the month's values differ from the previous month's.
+    """
+    for group in TERM_GROUPS.values():
+        table, cols = group['terms_table'], group['terms']
+        types = _column_types(cur, "final_computed_table", ["short_code", "month_year"] + cols)
+        col_list = ", ".join(cols)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                short_code {types['short_code']} NOT NULL,
+                valid_from {types['month_year']} NOT NULL,
+                {", ".join(f"{c} {types[c]}" for c in cols)},
+                PRIMARY KEY (short_code, valid_from)
+            )
+        """)
+        changed = " OR ".join(f"{c} IS DISTINCT FROM LAG({c}) OVER w" for c in cols)
+        cur.execute(f"""
+            INSERT INTO {table} (short_code, valid_from, {col_list})
+            SELECT short_code, month_year, {col_list}
+            FROM (
+                SELECT short_code, month_year, {col_list},
+                    LAG(month_year) OVER w IS NULL OR {changed} AS changed
+                FROM final_computed_table
+                WINDOW w AS (PARTITION BY short_code ORDER BY month_year)
+            ) x
+            WHERE changed
+            ON CONFLICT (short_code, valid_from) DO NOTHING
+        """)
+
+
+def create_final_metrics_view(cur):
+    """
+    final_metrics: final_computed_table with each target/limit taken from the
+    term record in effect for the month (the latest valid_from <= month_year,
+    one primary-key probe per terms table). The terms tables are the only
+    source of these values: the stored copies are read only for months before
+    a customer's first record. Re-run after adding columns to
+    final_computed_table, since the view's column list is fixed when created.
+    """
+    resolved = {c: group['terms_table'] for group in TERM_GROUPS.values() for c in group['terms']}
+    select = [
+        f"CASE WHEN {resolved[c]}.valid_from IS NULL THEN f.{c} ELSE {resolved[c]}.{c} END AS {c}"
+        if c in resolved else f"f.{c}"
+        for c in _column_types(cur, "final_computed_table", None)
+    ]
+    joins = [
+        f"""LEFT JOIN LATERAL (
+            SELECT valid_from, {", ".join(group['terms'])} FROM {group['terms_table']} e
+            WHERE e.short_code = f.short_code AND e.valid_from <= f.month_year
+            ORDER BY e.valid_from DESC
+            LIMIT 1
+        ) {group['terms_table']} ON true"""
+        for group in TERM_GROUPS.values()
+    ]
+    cur.execute(f"""
+        CREATE OR REPLACE VIEW final_metrics AS
+        SELECT {", ".join(select)}
+        FROM final_computed_table f
+        {" ".join(joins)}
+    """)
+
+
+def effective_dated_terms(cur):
+    create_term_tables(cur)
+    create_final_metrics_view(cur)
+
+
+FINAL_DIRTY_KEYS_DDL = """
+    CREATE TABLE IF NOT EXISTS final_dirty_keys (
+        short_code TEXT NOT NULL,
+        month_year DATE NOT NULL,
+        marked_at  TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (short_code, month_year)
+    );
+    -- Statement-level: one set-based INSERT per statement, whatever the row count
+    CREATE OR REPLACE FUNCTION mark_final_dirty() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO final_dirty_keys (short_code, month_year)
+            SELECT DISTINCT short_code, month_year FROM new_rows
+            ON CONFLICT DO NOTHING;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO final_dirty_keys (short_code, month_year)
+            SELECT DISTINCT short_code, month_year FROM old_rows
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+# Transition tables need one trigger per event
+_DIRTY_TRIGGER_EVENTS = (
+    ("INSERT", "NEW TABLE AS new_rows"),
+    ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ("DELETE", "OLD TABLE AS old_rows"),
+)
+
+
+def create_dirty_key_triggers(cur):
+    """final_dirty_keys plus triggers recording the keys written to each ops.FINAL_SOURCES table."""
+    cur.execute(FINAL_DIRTY_KEYS_DDL)
+    for table in FINAL_SOURCES:
+        cur.execute("SELECT to_regclass(%s)", (table,))
+        if cur.fetchone()[0] is None:
+            continue
+        for event, transition in _DIRTY_TRIGGER_EVENTS:
+            name = f"{table}_final_dirty_{event.lower()}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            cur.execute(f"""
+                CREATE TRIGGER {name} AFTER {event} ON {table}
+                REFERENCING {transition}
+                FOR EACH STATEMENT EXECUTE PROCEDURE mark_final_dirty()
+            """)
+
+
+SNAPSHOT_IMMUTABLE_DDL = """
+    CREATE OR REPLACE FUNCTION reject_snapshot_change() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        RAISE EXCEPTION 'month_snapshots is append-only: closed months cannot be changed (%)', TG_OP;
+    END
+    $$;
+    DROP TRIGGER IF EXISTS month_snapshots_immutable ON month_snapshots;
+    CREATE TRIGGER month_snapshots_immutable BEFORE UPDATE OR DELETE ON month_snapshots
+        FOR EACH ROW EXECUTE PROCEDURE reject_snapshot_change();
+    DROP TRIGGER IF EXISTS month_snapshots_no_truncate ON month_snapshots;
+    CREATE TRIGGER month_snapshots_no_truncate BEFORE TRUNCATE ON month_snapshots
+        FOR EACH STATEMENT EXECUTE PROCEDURE reject_snapshot_change();
+"""
+
+
+def create_snapshot_store(cur):
+    """
+    month_snapshots: one append-only row per closed customer-month, holding the
+    final_metrics and customer_mapping_table rows as JSON (written by
+    DbOperations.close_month).
+    """
+    types = _column_types(cur, "final_computed_table", ["short_code", "month_year"])
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS month_snapshots (
+            short_code {types['short_code']} NOT NULL,
+            month_year {types['month_year']} NOT NULL,
+            metrics    JSON NOT NULL,
+            config     JSON NOT NULL,
+            etag       TEXT NOT NULL,
+            closed_at  TIMESTAMP NOT NULL DEFAULT now(),
+            closed_by  TEXT,
+            PRIMARY KEY (short_code, month_year)
+        )
+    """)
+    cur.execute(SNAPSHOT_IMMUTABLE_DDL)
+
+
+def create_metric_history_view(cur):
+    """
+    metric_history: final_metrics rows, with every closed customer-month taken
+    from its snapshot instead. The key columns come from month_snapshots itself,
+    so a lookup by (short_code, month_year) stays a primary-key probe on both
+    sides. Re-run after create_final_metrics_view adds columns.
+    """
+    select = [
+        f"s.{c}" if c in ("short_code", "month_year") else f"r.{c}"
+        for c in _column_types(cur, "final_metrics", None)
+    ]
+    cur.execute(f"""
+        CREATE OR REPLACE VIEW metric_history AS
+        SELECT {", ".join(select)}
+        FROM month_snapshots s, json_populate_record(NULL::final_metrics, s.metrics) r
+        UNION ALL
+        SELECT f.*
+        FROM final_metrics f
+        WHERE NOT EXISTS (
+            SELECT 1 FROM month_snapshots s
+            WHERE s.short_code = f.short_code AND s.month_year = f.month_year
+        )
+    """)
+
+
+def month_close_snapshots(cur):
+    create_snapshot_store(cur)
+    create_metric_history_view(cur)
+
+
+# Saves call ensure_month_open() first in their transaction. The shared lock
+# conflicts only with close_month's exclusive lock on the same month, so a
+# month cannot be closed between the check and the save's commit.
+MONTH_OPEN_GUARD_DDL = f"""
+    CREATE OR REPLACE FUNCTION ensure_month_open(p_short_code TEXT, p_month DATE) RETURNS void
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock_shared(hashtext('month_close:' || p_month));
+        IF EXISTS (SELECT 1 FROM month_snapshots WHERE short_code = p_short_code AND month_year = p_month) THEN
+            RAISE EXCEPTION '% % is closed and can no longer be edited.', p_short_code, p_month
+                USING ERRCODE = '{MONTH_CLOSED_SQLSTATE}';
+        END IF;
+    END
+    $$;
+"""
+
+
+def create_report_store(cur):
+    """
+    report_rows (ops.REPORT_STORE_DDL), filled with every customer-month from
+    metric_history (migration 5). Running it again rebuilds the store.
+    """
+    cur.execute(REPORT_STORE_DDL)
+    with cur.connection.cursor(cursor_factory=RealDictCursor) as dict_cur:
+        DbOperations(None).fill_report_store(dict_cur)
+
+
+MIGRATIONS = [
+    (1, "Daily tracker: covering (userid, log_date) index, normalized sub-task index", """
+        CREATE INDEX IF NOT EXISTS task_entries_user_log_date_idx
+            ON task_entries (userid, log_date) INCLUDE (task_type, time_in_min);
+        CREATE INDEX IF NOT EXISTS task_details_subtask_norm_idx
+            ON task_details ((TRIM(LOWER(new_subtasks))));
+    """),
+    (2, "Hot-path indexes: (short_code, month_year), CSM lookups, audit/access log order",
+     ensure_indexes(HOT_PATH_INDEXES)),
+    (3, "Effective-dated targets, limits and storage contracts; final_metrics view",
+     effective_dated_terms),
+    (4, "Dirty-key tracking for the final_computed_table materializer", create_dirty_key_triggers),
+    (5, "Month-close snapshot store; metric_history view", month_close_snapshots),
+    (6, "final_metrics: term records are the only source of targets/limits", create_final_metrics_view),
+    (7, "ensure_month_open(): closed-month check inside the save transaction", MONTH_OPEN_GUARD_DDL),
+    (8, "Reporting store report_rows, filled from metric_history", create_report_store),
+]
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at  TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+
+def applied_versions(conn):
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(SCHEMA_MIGRATIONS_DDL)
+            cur.execute("SELECT version FROM schema_migrations")
+            return {r[0] for r in cur.fetchall()}
+
+
+def apply_migrations(conn):
+    """Applies every migration not yet recorded. Returns the versions applied."""
+    done = applied_versions(conn)
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version in done:
+            continue
+        with conn:
+            with conn.cursor() as cur:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+        applied.append(version)
+    return applied
+
+
+def pending_migrations(conn):
+    done = applied_versions(conn)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in done]
+
+
+# --- Verification ---
+
+def missing_indexes(conn):
+    """REQUIRED_INDEXES specs with no satisfying index (tables that do not exist are skipped)."""
+    with conn:
+        with conn.cursor() as cur:
+            return [spec for spec in REQUIRED_INDEXES if find_index(cur, spec) is None]
+
+
+def unused_indexes(conn):
+    """
+    [(table, index, size)] of non-unique indexes on the application's tables
+    that have not been scanned since statistics were last reset.
+    """
+    tables = sorted({spec.table for spec in REQUIRED_INDEXES})
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.relname, s.indexrelname, pg_size_pretty(pg_relation_size(s.indexrelid))
+                FROM pg_stat_user_indexes s
+                JOIN pg_index x ON x.indexrelid = s.indexrelid
+                WHERE s.relname = ANY(%s)
+                AND s.idx_scan = 0
+                AND NOT x.indisunique
+                ORDER BY s.relname, s.indexrelname
+            """, (tables,))
+            return cur.fetchall()
+
+
+def schema_report(conn):
+    """Lines describing pending migrations, missing and unused indexes (empty if all is well)."""
+    lines = []
+    for version, description in pending_migrations(conn):
+        lines.append(f"Pending migration {version}: {description}")
+    for spec in missing_indexes(conn):
+        lines.append(f"Missing index on {spec.table} ({', '.join(spec.columns or [spec.name])})")
+    for table, index, size in unused_indexes(conn):
+        lines.append(f"Unused index {index} on {table} ({size})")
+    return lines
+
+
+def log_schema_report(db_config):
+    """Startup check: prints schema_report(); never stops the application."""
+    from db_pool import get_pool
+    try:
+        with get_pool(db_config).connection() as conn:
+            lines = schema_report(conn)
+    except Exception as e:
+        print(f"[Warning] Schema check skipped: {e}")
+        return
+    for line in lines:
+        print(f"[Schema] {line}")
+    if any(not line.startswith("Unused") for line in lines):
+        print("[Schema] Run 'python migrations.py' to apply pending migrations / create missing indexes.")
+
+
+# --- Plan checks ---
+# (name, query, sample params, index the query must be able to use)
+PLAN_CHECKS = [
+    ("dt_fetch_entries", DT_ENTRIES_SQL, ("user", "2025-01-01", "2025-01-01"), "task_entries_user_log_date_idx"),
+    ("dt_aggregates", DT_AGGREGATES_SQL, ("user", "2025-01-01", "2025-01-01"), "task_entries_user_log_date_idx"),
+    ("dt_download_csv", DT_EXPORT_SQL, ("user", "2025-01-01", "2025-02-01"), "task_entries_user_log_date_idx"),
+    ("dt_add_entry task type", DT_TASK_TYPE_SQL, ("Some Task",), "task_details_subtask_norm_idx"),
+    ("load_metrics_data targets", "SELECT * FROM final_metrics WHERE short_code = %s AND month_year = %s",
+     ("ABC", "2025-01-01"), "availability_targets_pkey"),
+]
+
+
+def _plan_indexes(node, found):
+    if "Index Name" in node:
+        found.add(node["Index Name"])
+    for child in node.get("Plans", ()):
+        _plan_indexes(child, found)
+    return found
+
+
+def explain_indexes(conn, query, params):
+    """
+    Index names in the plan of query. Sequential scans are disabled for the
+    EXPLAIN, so on a small or empty table this still shows whether the
+    predicates can use an index at all (i.e. are sargable).
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+    finally:
+        conn.rollback()
+    return _plan_indexes(plan[0]["Plan"], set())
+
+
+def check_plans(conn):
+    """[(name, index, ok)] for every PLAN_CHECKS entry."""
+    return [
+        (name, index, index in explain_indexes(conn, query, params))
+        for name, query, params, index in PLAN_CHECKS
+    ]
+
+
+def main():
+    from app import DB_CONFIG
+    from db_pool import get_pool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='migrate',
+                        choices=['migrate', 'status', 'verify', 'check-plans'])
+    args = parser.parse_args()
+
+    with get_pool(DB_CONFIG).connection() as conn:
+        if args.command == 'migrate':
+            applied = apply_migrations(conn)
+            print(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Schema is up to date.")
+
+        elif args.command == 'status':
+            pending = {v for v, _ in pending_migrations(conn)}
+            for version, description, _ in MIGRATIONS:
+                print(f"{'pending' if version in pending else 'applied'}  {version:>3}  {description}")
+
+        elif args.command == 'verify':
+            lines = schema_report(conn)
+            for line in lines:
+                print(line)
+            if not lines:
+                print("All required indexes present, no unused indexes.")
+            sys.exit(1 if any(not line.startswith("Unused") for line in lines) else 0)
+
+        else:
+            results = check_plans(conn)
+            for name, index, ok in results:
+                print(f"{'OK  ' if ok else 'FAIL'} {name}: {index}")
+            sys.exit(0 if all(ok for _, _, ok in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
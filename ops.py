@@ -1,19 +1,457 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import json
-import socket
 import datetime
+import math
 import uuid
-import os
 import csv
+from io import StringIO
+from db_pool import get_pool
+from access_log import get_access_log_writer
+from cache import dropdown_cache, deck_cache, snapshot_cache
+
+# Bulk metric updates: input field -> column, per metric group.
+# Field names match the single-save routes (/save_availability, /save_users, ...).
+# 'terms' lists the group's targets/limits, which are effective-dated: a record
+# in 'terms_table' holds from its valid_from month until the customer's next
+# record. The final_metrics view (migration 3) resolves them per month with one
+# primary-key probe per terms table. The terms tables are the only source of
+# these values: the per-month copies in the metric tables are read only for
+# months before a customer's first record. A loaded change reaches the records
+# through the materializer: a refresh that changes a stored target records it.
+BULK_METRIC_GROUPS = {
+    'availability': {
+        'table': 'availability_table',
+        'columns': {
+            'availability': 'updated_availability',
+            'target': 'updated_target',
+        },
+        'terms_table': 'availability_targets',
+        'terms': ['updated_target'],
+    },
+    'users': {
+        'table': 'users_table',
+        'columns': {
+            'prod_limit': 'updated_prod_limit',
+            'test_limit': 'updated_test_limit',
+            'dev_limit': 'updated_dev_limit',
+            'prod_used': 'updated_prod_used',
+            'test_used': 'updated_test_used',
+            'dev_used': 'updated_dev_used',
+        },
+        'terms_table': 'user_limits',
+        'terms': ['updated_prod_limit', 'updated_test_limit', 'updated_dev_limit'],
+    },
+    'storage': {
+        'table': 'storage_table',
+        'columns': {
+            'prod_target': 'updated_prod_target_storage_gb',
+            'test_target': 'updated_test_target_storage_gb',
+            'dev_target': 'updated_dev_target_storage_gb',
+            'prod_actual': 'updated_prod_storage_gb',
+            'test_actual': 'updated_test_storage_gb',
+            'dev_actual': 'updated_dev_storage_gb',
+        },
+        'terms_table': 'storage_contracts',
+        'terms': [
+            'updated_prod_target_storage_gb',
+            'updated_test_target_storage_gb',
+            'updated_dev_target_storage_gb',
+        ],
+    },
+    'tickets': {
+        'table': 'tickets_computed_table',
+        'columns': {
+            'opened': 'updated_tickets_opened',
+            'closed': 'updated_tickets_closed',
+            'current_backlog': 'updated_tickets_current_backlog',
+            'overall_backlog': 'updated_tickets_overall_backlog',
+        },
+        'terms_table': None,
+        'terms': [],
+    },
+}
+
+# Availability and target are entered as percentages (like the dashboard form)
+BULK_PERCENT_FIELDS = ('availability', 'target')
+
+TERM_GROUPS = {name: group for name, group in BULK_METRIC_GROUPS.items() if group['terms']}
+
+# final_computed_table is materialized from the source tables: source table ->
+# the final columns it feeds. Statement-level triggers on the source tables
+# (migration 4) record every (short_code, month_year) they write in
+# final_dirty_keys, and FINAL_REFRESH_SQL recomputes just those final rows.
+FINAL_SOURCES = {group['table']: list(group['columns'].values()) for group in BULK_METRIC_GROUPS.values()}
+
+# Audit context of materializer runs outside a web request (CLI refresh/rebuild)
+MATERIALIZER_AUDIT_INFO = {'username': 'system', 'system_name': 'materializer', 'comments': 'final_computed_table refresh'}
+
+# SQLSTATE raised by ensure_month_open() (migration 7) for a closed customer-month
+MONTH_CLOSED_SQLSTATE = 'MC001'
+
+# snapshot_cache entry of an open customer-month. Other processes only see a
+# close after OPEN_MONTH_TTL; saves check in the database (ensure_month_open).
+OPEN_MONTH = 'open'
+OPEN_MONTH_TTL = 300
+
+
+def _term_changes_cte(group, a):
+    """
+    CTE of _final_refresh_sql: records a group's loaded target/limit changes.
+    A refreshed month whose values change (against its final row, or for a new
+    month against the previous month) and differ from the record in effect
+    gets a record from that month, so final_metrics shows the loaded values.
+    Untouched per-month copies that an earlier save left behind never change
+    on refresh, so they never become records.
+    """
+    table, cols = group['terms_table'], group['terms']
+    changed_from_prev = " OR ".join(f"v.{c} IS DISTINCT FROM LAG(v.{c}) OVER w" for c in cols)
+    return f"""terms_{table} AS (
+            INSERT INTO {table} (short_code, valid_from, {", ".join(cols)})
+            SELECT v.short_code, v.month_year, {", ".join(f"v.{c}" for c in cols)}
+            FROM (
+                SELECT v.*, LAG(v.month_year) OVER w IS NULL OR {changed_from_prev} AS changed_from_prev
+                FROM (
+                    SELECT s.short_code, s.month_year, true AS refreshed, f.short_code IS NOT NULL AS had_final,
+                        {", ".join(f"s.{c}" for c in cols)}, {", ".join(f"f.{c} AS old_{c}" for c in cols)}
+                    FROM src s
+                    LEFT JOIN final_computed_table f ON f.short_code = s.short_code AND f.month_year = s.month_year
+                    WHERE s.has_{a}
+                    UNION ALL
+                    SELECT f.short_code, f.month_year, false, true,
+                        {", ".join(f"f.{c}" for c in cols)}, {", ".join(f"f.{c}" for c in cols)}
+                    FROM final_computed_table f
+                    WHERE f.short_code IN (SELECT short_code FROM src WHERE has_{a})
+                    AND NOT EXISTS (
+                        SELECT 1 FROM src s
+                        WHERE s.has_{a} AND s.short_code = f.short_code AND s.month_year = f.month_year
+                    )
+                ) v
+                WINDOW w AS (PARTITION BY v.short_code ORDER BY v.month_year)
+            ) v
+            LEFT JOIN LATERAL (
+                SELECT {", ".join(cols)} FROM {table} e
+                WHERE e.short_code = v.short_code AND e.valid_from <= v.month_year
+                ORDER BY e.valid_from DESC
+                LIMIT 1
+            ) e ON true
+            WHERE v.refreshed
+            AND CASE WHEN v.had_final
+                THEN ({", ".join(f"v.{c}" for c in cols)}) IS DISTINCT FROM ({", ".join(f"v.old_{c}" for c in cols)})
+                ELSE v.changed_from_prev END
+            AND ({", ".join(f"v.{c}" for c in cols)}) IS DISTINCT FROM ({", ".join(f"e.{c}" for c in cols)})
+            ON CONFLICT (short_code, valid_from) DO UPDATE SET
+                {", ".join(f"{c} = EXCLUDED.{c}" for c in cols)}
+        ),"""
+
+
+def _final_refresh_sql():
+    """
+    One statement: claims the dirty keys of %(short_codes)s (NULL: all), updates
+    the final rows whose values differ from their source rows and inserts the
+    final rows that are missing. A group without a source row for the key keeps
+    its final values. Loaded target/limit changes get a term record
+    (_term_changes_cte). Returns one row: (keys, updated, inserted, [short_codes changed]).
+    """
+    alias = {table: f"s{i}" for i, table in enumerate(FINAL_SOURCES)}
+    term_changes = [_term_changes_cte(group, alias[group['table']]) for group in TERM_GROUPS.values()]
+    src_cols, joins, new_vals, final_cols = [], [], [], []
+    for table, cols in FINAL_SOURCES.items():
+        a = alias[table]
+        src_cols.append(f"{a}.short_code IS NOT NULL AS has_{a}")
+        src_cols += [f"{a}.{c}" for c in cols]
+        joins.append(f"LEFT JOIN {table} {a} ON {a}.short_code = k.short_code AND {a}.month_year = k.month_year")
+        new_vals += [f"CASE WHEN s.has_{a} THEN s.{c} ELSE f.{c} END" for c in cols]
+        final_cols += cols
+    return f"""
+        WITH keys AS (
+            DELETE FROM final_dirty_keys
+            WHERE %(short_codes)s::text[] IS NULL OR short_code = ANY(%(short_codes)s::text[])
+            RETURNING short_code, month_year
+        ),
+        src AS (
+            SELECT k.short_code, k.month_year, {", ".join(src_cols)}
+            FROM (SELECT DISTINCT short_code, month_year FROM keys) k
+            {" ".join(joins)}
+        ),
+        {" ".join(term_changes)}
+        updated AS (
+            UPDATE final_computed_table f SET
+                {", ".join(f"{c} = {v}" for c, v in zip(final_cols, new_vals))}
+            FROM src s
+            WHERE f.short_code = s.short_code AND f.month_year = s.month_year
+            AND ({", ".join(f"f.{c}" for c in final_cols)}) IS DISTINCT FROM ({", ".join(new_vals)})
+            RETURNING f.short_code
+        ),
+        inserted AS (
+            INSERT INTO final_computed_table (short_code, month_year, {", ".join(final_cols)})
+            SELECT s.short_code, s.month_year, {", ".join(f"s.{c}" for c in final_cols)}
+            FROM src s
+            WHERE ({" OR ".join(f"s.has_{a}" for a in alias.values())})
+            AND NOT EXISTS (
+                SELECT 1 FROM final_computed_table f
+                WHERE f.short_code = s.short_code AND f.month_year = s.month_year
+            )
+            RETURNING short_code
+        )
+        SELECT
+            (SELECT count(*) FROM keys),
+            (SELECT count(*) FROM updated),
+            (SELECT count(*) FROM inserted),
+            ARRAY(SELECT short_code FROM updated UNION SELECT short_code FROM inserted)
+    """
+
+
+def _final_drift_sql():
+    """
+    Source rows whose final row is missing or differs, as
+    (source table, short_code, month_year, final row missing, [differing columns]).
+    """
+    parts = []
+    for table, cols in FINAL_SOURCES.items():
+        differs = ", ".join(f"CASE WHEN s.{c} IS DISTINCT FROM f.{c} THEN '{c}' END" for c in cols)
+        parts.append(f"""
+            SELECT '{table}' AS source, s.short_code, s.month_year,
+                f.short_code IS NULL AS missing,
+                ARRAY_REMOVE(ARRAY[{differs}], NULL) AS columns
+            FROM {table} s
+            LEFT JOIN final_computed_table f
+                ON f.short_code = s.short_code AND f.month_year = s.month_year
+            WHERE f.short_code IS NULL
+            OR ({", ".join(f"s.{c}" for c in cols)}) IS DISTINCT FROM ({", ".join(f"f.{c}" for c in cols)})
+        """)
+    return " UNION ALL ".join(parts)
+
+
+def _term_drift_sql():
+    """
+    Stored target/limit changes that final_metrics does not show and no record
+    covers, as (terms table, short_code, month_year, [differing columns]).
+    A change next to a record (the month after a save) is the save's old value
+    left in later months, not a lost change, so it is not reported.
+    """
+    parts = []
+    for group in TERM_GROUPS.values():
+        table, cols = group['terms_table'], group['terms']
+        changed = " OR ".join(f"{c} IS DISTINCT FROM LAG({c}) OVER w" for c in cols)
+        differs = ", ".join(f"CASE WHEN f.{c} IS DISTINCT FROM m.{c} THEN '{c}' END" for c in cols)
+        parts.append(f"""
+            SELECT '{table}' AS terms, f.short_code, f.month_year,
+                ARRAY_REMOVE(ARRAY[{differs}], NULL) AS columns
+            FROM (
+                SELECT short_code, month_year, {", ".join(cols)},
+                    LAG(month_year) OVER w AS prev_month,
+                    LAG(month_year) OVER w IS NOT NULL AND ({changed}) AS changed
+                FROM final_computed_table
+                WINDOW w AS (PARTITION BY short_code ORDER BY month_year)
+            ) f
+            JOIN final_metrics m ON m.short_code = f.short_code AND m.month_year = f.month_year
+            WHERE f.changed
+            AND ({", ".join(f"f.{c}" for c in cols)}) IS DISTINCT FROM ({", ".join(f"m.{c}" for c in cols)})
+            AND NOT EXISTS (
+                SELECT 1 FROM {table} e
+                WHERE e.short_code = f.short_code AND e.valid_from IN (f.month_year, f.prev_month)
+            )
+        """)
+    return " UNION ALL ".join(parts)
+
+
+FINAL_REFRESH_SQL = _final_refresh_sql()
+FINAL_DRIFT_SQL = _final_drift_sql()
+TERM_DRIFT_SQL = _term_drift_sql()
+
+# Reporting store: final_computed_table joined with customer_mapping_table and
+# formatted for the Reporting page, one row per customer-month and lookup key
+# ('sc:<short_code>', 'csm:<csm_primary>', 'csm:<csm_lead>'). row_data is json,
+# not jsonb, so the column order of the formatted row is kept.
+REPORT_STORE_DDL = """
+    CREATE TABLE IF NOT EXISTS report_rows (
+        lookup       TEXT NOT NULL,
+        short_code   TEXT NOT NULL,
+        month_year   DATE NOT NULL,
+        row_data     JSON NOT NULL,
+        refreshed_at TIMESTAMP NOT NULL DEFAULT now()
+    );
+    -- load_report: one index scan, already in (short_code ASC, month_year DESC) order
+    CREATE UNIQUE INDEX IF NOT EXISTS report_rows_lookup_idx
+        ON report_rows (lookup, short_code, month_year DESC);
+    -- incremental refresh by customer(-month)
+    CREATE INDEX IF NOT EXISTS report_rows_short_code_idx
+        ON report_rows (short_code, month_year);
+"""
+
+# Daily tracker copy: what to do with copies identical to an existing entry
+DT_COPY_DUPLICATE_MODES = ('allow', 'skip', 'fail')
+DT_COPY_MAX_DAYS = 31
+
+
+def _payload_date(value):
+    """A 'YYYY-MM-DD' JSON value as a date; ValueError for anything else (numbers, lists, null)."""
+    if not isinstance(value, str):
+        raise ValueError(f"Not a date: {value!r}")
+    return datetime.date.fromisoformat(value)
+
+# Daily tracker queries. Dates are matched as half-open ranges on the raw
+# log_date column (no ::date cast), so the (userid, log_date) index from
+# migration 1 serves them; migrations.check_plans() EXPLAINs these texts.
+DT_ENTRIES_SQL = """
+    SELECT id, userid, taskname, customername, task_type,
+        time_in_min, comments,
+        TO_CHAR(log_date,'YYYY-MM-DD') AS log_date
+    FROM task_entries
+    WHERE userid = %s
+    AND log_date >= %s::date AND log_date < %s::date + 1
+    ORDER BY id
+"""
+
+DT_AGGREGATES_SQL = """
+    SELECT 
+        COALESCE(te.task_type,'Unknown') AS task_type,
+        SUM(te.time_in_min) AS total_minutes,
+        STRING_AGG(
+            COALESCE(cm.customer_name, te.customername) || ' - ' ||
+            te.taskname || ' - ' ||
+            te.comments || ' - ' ||
+            COALESCE(te.task_type,'') || ':' ||
+            te.time_in_min::text,
+            '; '
+            ORDER BY te.id
+        ) AS concat
+    FROM task_entries te
+    LEFT JOIN customer_mapping_table cm
+        ON cm.short_code = te.customername
+    WHERE te.userid = %s
+    AND te.log_date >= %s::date AND te.log_date < %s::date + 1
+    GROUP BY te.task_type
+    ORDER BY task_type
+"""
+
+# Matches the expression index on task_details from migration 1
+DT_TASK_TYPE_SQL = """
+    SELECT cp_task_type
+    FROM task_details
+    WHERE TRIM(LOWER(new_subtasks)) = TRIM(LOWER(%s))
+    LIMIT 1
+"""
+
+DT_EXPORT_SQL = """
+    SELECT id, userid, taskname, customername, task_type,
+        time_in_min, comments,
+        TO_CHAR(log_date,'YYYY-MM-DD HH24:MI:SS') AS log_date
+    FROM task_entries
+    WHERE userid = %s
+    AND log_date >= %s AND log_date < %s
+    ORDER BY id
+"""
+
+# Upper bound for load_report_page, whatever the client asks for
+REPORT_MAX_PAGE_SIZE = 500
+
+REPORT_SOURCE_SQL = """
+    SELECT f.*, m.no_of_environments, m.customer_name,
+        m.csm_primary, m.csm_lead
+    FROM metric_history f
+    JOIN customer_mapping_table m
+    ON f.short_code = m.short_code
+"""
+
+
+class MetricUnitOfWork:
+    """
+    Queues the statements of one metric save and sends them together.
+
+    All statements run under the caller's audit context. Everything is
+    rendered client-side and executed as one multi-statement query, i.e. one
+    transaction and one round trip; if any statement fails nothing is applied.
+    """
+
+    def __init__(self, db, audit_info):
+        self.db = db
+        self.audit_info = audit_info
+        self.statements = []
+
+    def update(self, query, params):
+        """Queues an audited statement."""
+        self.statements.append((query, params))
+
+    def ensure_open(self, short_code, month_year):
+        """
+        Queues the closed-month check (ensure_month_open). Queue it first: it
+        holds off close_month for the month until this unit of work commits.
+        """
+        self.update("SELECT ensure_month_open(%s, %s)", (short_code, month_year))
+
+    def materialize(self, group, short_code, month_year, values):
+        """
+        Queues the refresh of the customer's dirty final_computed_table rows
+        (FINAL_REFRESH_SQL), after a group's source table was updated with values
+        (in BULK_METRIC_GROUPS[group]['columns'] order). A month that exists only
+        in final_computed_table, like the first month insert_new_customer
+        creates, has no source row to materialize from and is written directly.
+        """
+        table, cols = BULK_METRIC_GROUPS[group]['table'], list(BULK_METRIC_GROUPS[group]['columns'].values())
+        self.update(f"""
+            UPDATE final_computed_table f SET {', '.join(f"{c} = %s" for c in cols)}
+            WHERE f.short_code = %s AND f.month_year = %s
+            AND NOT EXISTS (
+                SELECT 1 FROM {table} s
+                WHERE s.short_code = f.short_code AND s.month_year = f.month_year
+            )
+        """, tuple(values) + (short_code, month_year))
+        self.update(FINAL_REFRESH_SQL, {'short_codes': [short_code]})
+
+    def set_terms(self, group, short_code, month_year, values):
+        """
+        Queues an effective-dated change of a group's targets/limits (values in
+        BULK_METRIC_GROUPS[group]['terms'] order): one record valid from
+        month_year. Later records are dropped, so the change holds for every
+        following month as before, without rewriting those months.
+        """
+        table, cols = BULK_METRIC_GROUPS[group]['terms_table'], BULK_METRIC_GROUPS[group]['terms']
+        self.update(f"""
+            INSERT INTO {table} (short_code, valid_from, {', '.join(cols)})
+            VALUES (%s, %s, {', '.join(['%s'] * len(cols))})
+            ON CONFLICT (short_code, valid_from) DO UPDATE SET
+                {', '.join(f"{c} = EXCLUDED.{c}" for c in cols)}
+        """, (short_code, month_year) + tuple(values))
+        self.update(f"DELETE FROM {table} WHERE short_code = %s AND valid_from > %s", (short_code, month_year))
+
+    def commit(self):
+        if not self.statements:
+            return
+        statements = self.db._audit_statements(self.audit_info) + self.statements
+        with self.db.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    batch = b";\n".join(cur.mogrify(q, p) for q, p in statements)
+                    try:
+                        cur.execute(batch)
+                    except psycopg2.Error as e:
+                        if e.pgcode == MONTH_CLOSED_SQLSTATE:
+                            raise ValueError(e.diag.message_primary)
+                        raise
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
 
 class DbOperations:
     def __init__(self, db_config):
         self.db_config = db_config
         self.csv_file = 'user_access_logs.csv'
 
-    def get_connection(self):
-        return psycopg2.connect(**self.db_config)
+    def connection(self):
+        """
+        Borrows a connection from the process-wide pool.
+        Usage: 'with self.connection() as conn:' (returned to the pool on exit).
+        """
+        return get_pool(self.db_config).connection()
 
     # --- Helper to format numbers (remove trailing zeros) ---
     @staticmethod
@@ -27,28 +465,69 @@ class DbOperations:
         except:
             return str(val)
         
+    @staticmethod
+    def _audit_statements(audit_info):
+        """SET LOCAL statements read by the Audit Trigger, as (query, params) pairs."""
+        return [
+            ("SET LOCAL audit.source = 'webapp'", None),
+            ("SET LOCAL audit.username = %s", (audit_info.get('username') or 'Unknown',)),
+            ("SET LOCAL audit.system_name = %s", (audit_info.get('system_name') or 'Unknown',)),
+            ("SET LOCAL audit.comment = %s", (audit_info.get('comments') or '',)),
+        ]
+
     def _set_audit_context(self, cur, audit_info):
         """Sets session variables for the Audit Trigger."""
-        cur.execute("SET LOCAL audit.source = 'webapp'")
-        cur.execute("SET LOCAL audit.username = %s", (audit_info.get('username') or 'Unknown',))
-        cur.execute("SET LOCAL audit.system_name = %s", (audit_info.get('system_name') or 'Unknown',))
-        cur.execute("SET LOCAL audit.comment = %s", (audit_info.get('comments') or '',))
+        for query, params in self._audit_statements(audit_info):
+            cur.execute(query, params)
 
     def _exec_update(self, query, params, audit_info):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn:
                 with conn.cursor() as cur:
                     self._set_audit_context(cur, audit_info)
                     cur.execute(query, params)
-        finally:
-            conn.close()
+
+    def stream_csv(self, query, params=None, itersize=2000):
+        """
+        Generator yielding CSV text (header first, then itersize rows per chunk).
+        Rows come from a server-side (named) cursor, so memory stays flat no
+        matter how large the table is. The pooled connection is held until the
+        generator is exhausted or closed (e.g. the client aborts the download).
+        The query runs and the first batch is fetched before this returns, so
+        SQL and connection errors raise here, while the caller can still answer
+        with an error instead of a truncated 200.
+        """
+        chunks = self._csv_chunks(query, params, itersize)
+        next(chunks)
+        return chunks
+
+    def _csv_chunks(self, query, params, itersize):
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(name=f"csv_export_{uuid.uuid4().hex}") as cur:
+                    cur.itersize = itersize
+                    cur.execute(query, params)
+                    # Named cursors only expose the description after the first fetch
+                    rows = cur.fetchmany(itersize)
+                    yield  # stream_csv stops here: the query has succeeded
+
+                    buf = StringIO()
+                    writer = csv.writer(buf)
+                    writer.writerow([d[0] for d in cur.description])
+                    while True:
+                        writer.writerows(rows)
+                        yield buf.getvalue()
+                        buf.seek(0)
+                        buf.truncate(0)
+                        if len(rows) < itersize:
+                            break
+                        rows = cur.fetchmany(itersize)
 
     # --- Dropdowns ---
+    @dropdown_cache.cached('customers')
     def get_customers(self):
         """Returns customers formatted as 'ShortCode - Name'."""
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("SELECT short_code, customer_name FROM customer_mapping_table ORDER BY short_code ASC")
                 rows = cur.fetchall()
@@ -57,42 +536,44 @@ class DbOperations:
                     display = f"{r['short_code']} - {r['customer_name']}"
                     result.append({"short_code": r['short_code'], "display": display})
                 return result
-        finally:
-            conn.close()
 
+    @dropdown_cache.cached('months')
     def get_months(self, short_code):
         """
         Returns months for UI.
         Returns a list of dicts: { 'value': '2025-06-01', 'display': 'June 2025' }
         """
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor() as cur:
                 # Fetch distinct months, ordered by date descending
                 # raw_date is for DB queries, display_date is for the UI dropdown
                 cur.execute("""
                     SELECT DISTINCT 
-                        to_char(month_year, 'YYYY-MM-DD') as raw_date,
-                        to_char(month_year, 'FMMonth YYYY') as display_date
-                    FROM final_computed_table 
-                    WHERE short_code = %s 
+                        to_char(f.month_year, 'YYYY-MM-DD') as raw_date,
+                        to_char(f.month_year, 'FMMonth YYYY') as display_date,
+                        s.short_code IS NOT NULL as closed
+                    FROM final_computed_table f
+                    LEFT JOIN month_snapshots s
+                        ON s.short_code = f.short_code AND s.month_year = f.month_year
+                    WHERE f.short_code = %s 
                     ORDER BY 1 DESC
                 """, (short_code,))
                 
                 rows = cur.fetchall()
-                # Return list of objects
-                return [{"value": r[0], "display": r[1]} for r in rows]
-        finally:
-            conn.close()
+                # Return list of objects (closed months are served from their snapshot)
+                return [{"value": r[0], "display": r[1], "closed": r[2]} for r in rows]
 
     # --- Load Dashboard Data ---
     def load_metrics_data(self, short_code, month_year):
-        conn = self.get_connection()
-        try:
+        snapshot = self.load_snapshot(short_code, month_year)
+        if snapshot is not None:
+            return snapshot['data'], snapshot['config']
+
+        with self.connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Fetch metrics from final_computed_table
+                # Fetch metrics, with the targets/limits in effect for the month
                 cur.execute("""
-                    SELECT * FROM final_computed_table 
+                    SELECT * FROM final_metrics
                     WHERE short_code = %s AND month_year = %s
                 """, (short_code, month_year))
                 data = cur.fetchone()
@@ -105,198 +586,413 @@ class DbOperations:
                 config = cur.fetchone()
                 
                 return data, config
-        finally:
-            conn.close()
 
-    # --- Update Functions with Audit Context ---
-    def _exec_update(self, query, params, audit_info):
-        conn = self.get_connection()
-        try:
+    # --- Month close ---
+    def close_month(self, month_year, short_code=None, closed_by=None):
+        """
+        Freezes month_year (for one customer, or all customers with a row for it)
+        into month_snapshots: the final_metrics row and the customer_mapping_table
+        row as they are now. Snapshots are immutable, so closing an already
+        closed customer-month changes nothing. The current month cannot be
+        closed. Waits for saves of the month that are in flight
+        (ensure_month_open). Returns the short codes that were closed.
+        """
+        month = datetime.datetime.strptime(month_year, '%Y-%m-%d').date()
+        if month >= datetime.date.today().replace(day=1):
+            raise ValueError("Only past months can be closed.")
+        where, params = "f.month_year = %s", [month]
+        if short_code:
+            where += " AND f.short_code = %s"
+            params.append(short_code)
+        with self.connection() as conn:
             with conn:
                 with conn.cursor() as cur:
-                    # Set Audit Session Variables
-                    cur.execute("SET LOCAL audit.source = 'webapp'")
-                    cur.execute("SET LOCAL audit.username = %s", (audit_info.get('username'),))
-                    cur.execute("SET LOCAL audit.system_name = %s", (audit_info.get('system_name'),))
-                    cur.execute("SET LOCAL audit.comment = %s", (audit_info.get('comments'),))
-                    
-                    cur.execute(query, params)
-        finally:
-            conn.close()
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext('month_close:' || %s::date))", (month,))
+                    cur.execute(f"""
+                        INSERT INTO month_snapshots (short_code, month_year, metrics, config, etag, closed_by)
+                        SELECT f.short_code, f.month_year, row_to_json(f), row_to_json(m),
+                            md5(row_to_json(f)::text || row_to_json(m)::text), %s
+                        FROM final_metrics f
+                        JOIN customer_mapping_table m ON m.short_code = f.short_code
+                        WHERE {where}
+                        ON CONFLICT (short_code, month_year) DO NOTHING
+                        RETURNING short_code
+                    """, [closed_by] + params)
+                    closed = [r[0] for r in cur.fetchall()]
+        for sc in closed:
+            dropdown_cache.invalidate(('months', sc))
+            snapshot_cache.invalidate((sc, str(month)))
+        return closed
+
+    def load_snapshot(self, short_code, month_year):
+        """
+        {'data', 'config', 'etag', 'closed_at'} of a closed customer-month, or None
+        if the month is open. data and config are typed like the live rows of
+        load_metrics_data. Snapshots never change, so they are cached for good.
+        Open months are cached too (as OPEN_MONTH, for OPEN_MONTH_TTL seconds),
+        so reads of an open month do not look up month_snapshots every time;
+        close_month drops the entry in this process.
+        """
+        key = (short_code, str(month_year))
+        snapshot = snapshot_cache.get(key)
+        if snapshot is OPEN_MONTH:
+            return None
+        if snapshot is not None:
+            return snapshot
+        with self.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT m.*
+                    FROM month_snapshots s, json_populate_record(NULL::final_metrics, s.metrics) m
+                    WHERE s.short_code = %s AND s.month_year = %s
+                """, (short_code, month_year))
+                data = cur.fetchone()
+                if data is None:
+                    snapshot_cache.set(key, OPEN_MONTH, ttl=OPEN_MONTH_TTL)
+                    return None
+                cur.execute("""
+                    SELECT s.etag, s.closed_at, c.*
+                    FROM month_snapshots s, json_populate_record(NULL::customer_mapping_table, s.config) c
+                    WHERE s.short_code = %s AND s.month_year = %s
+                """, (short_code, month_year))
+                config = cur.fetchone()
+        snapshot = {
+            'data': data,
+            'etag': config.pop('etag'),
+            'closed_at': config.pop('closed_at'),
+            'config': config,
+        }
+        snapshot_cache.set(key, snapshot)
+        return snapshot
 
-    def _update_future_months(
-        self,
-        table_name,
-        set_clause,
-        params,
-        short_code,
-        month_year
-    ):
+    # --- Update Functions with Audit Context ---
+    def _on_customer_changed(self, short_code, month=None, config=False):
         """
-        Updates future months WITHOUT audit logging.
+        Called after a successful write for short_code (month=None: all months).
+        config=True when customer_mapping_table changed (name, CSMs, new customer).
+        Drops the cached data that the write made stale and refreshes the
+        customer's rows in the reporting store.
         """
-        conn = self.get_connection()
+        dropdown_cache.invalidate(('months', short_code), ('reporting_months',))
+        # Cached decks are content-addressed, so stale ones would never be hit again;
+        # dropping them just frees the space early
+        deck_cache.invalidate(short_code)
+        if config:
+            dropdown_cache.invalidate(('customers',), ('csm_list',))
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    # 🔴 IMPORTANT: suppress audit
-                    cur.execute("SET LOCAL audit.source = 'devs'")
-                    cur.execute("SET LOCAL audit.username = 'system'")
-                    cur.execute("SET LOCAL audit.system_name = 'system'")
-                    cur.execute("SET LOCAL audit.comment = ''")
-
-                    query = f"""
-                        UPDATE {table_name}
-                        SET {set_clause}
-                        WHERE short_code = %s
-                        AND month_year > %s
-                    """
-                    cur.execute(query, params + (short_code, month_year))
-        finally:
-            conn.close()
+            # A config change can move the customer between CSMs: rebuild all its months
+            self.refresh_report_store(short_code, None if config else month)
+        except psycopg2.Error as e:
+            print(f"[Warning] Report store refresh failed for {short_code}: {e}")
+
+    def unit_of_work(self, audit_info):
+        """
+        Starts a MetricUnitOfWork. Statements queued on it are sent in a single
+        transaction and a single round trip when it is committed:
+
+            with db.unit_of_work(audit_info) as uow:
+                uow.update(query, params)
+                uow.materialize(group, sc, month, values)
+                uow.set_terms(group, sc, month, values)
+        """
+        return MetricUnitOfWork(self, audit_info)
 
     def update_availability(self, short_code, month, avail, target, audit_info):
-        # Update both availability_table and final_computed_table
-        # 1. Update source
-        q1 = """
-            UPDATE availability_table SET 
-                updated_availability = %s, updated_target = %s
-            WHERE short_code = %s AND month_year = %s
-        """
-        self._exec_update(q1, (avail, target, short_code, month), audit_info)
-        
-        # 2. Update final
-        q2 = """
-            UPDATE final_computed_table SET 
-                updated_availability = %s, updated_target = %s
-            WHERE short_code = %s AND month_year = %s
-        """
-        self._exec_update(q2, (avail, target, short_code, month), audit_info)
-
-        # --- Apply TARGET to future months (NO AUDIT) ---
-        self._update_future_months(
-            table_name="availability_table",
-            set_clause="updated_target = %s",
-            params=(target,),
-            short_code=short_code,
-            month_year=month
-        )
+        # Update availability_table; final_computed_table is materialized from it
+        params = (avail, target, short_code, month)
+        with self.unit_of_work(audit_info) as uow:
+            uow.ensure_open(short_code, month)
+            # 1. Update source
+            uow.update("""
+                UPDATE availability_table SET 
+                    updated_availability = %s, updated_target = %s
+                WHERE short_code = %s AND month_year = %s
+            """, params)
 
-        self._update_future_months(
-            table_name="final_computed_table",
-            set_clause="updated_target = %s",
-            params=(target,),
-            short_code=short_code,
-            month_year=month
-        )
+            # 2. Final follows from the source row
+            uow.materialize('availability', short_code, month, (avail, target))
 
+            # --- TARGET holds from this month on ---
+            uow.set_terms('availability', short_code, month, (target,))
+        self._on_customer_changed(short_code, month)
 
-    def update_users(self, sc, month, p_lim, t_lim, d_lim, p_used, t_used, d_used, audit_info):
-        # Update users_table and final
-        params = (p_lim, t_lim, d_lim, p_used, t_used, d_used, sc, month)
-        q1 = """
-            UPDATE users_table SET 
-                updated_prod_limit=%s, updated_test_limit=%s, updated_dev_limit=%s,
-                updated_prod_used=%s, updated_test_used=%s, updated_dev_used=%s
-            WHERE short_code=%s AND month_year=%s
-        """
-        self._exec_update(q1, params, audit_info)
-
-        q2 = """
-            UPDATE final_computed_table SET 
-                updated_prod_limit=%s, updated_test_limit=%s, updated_dev_limit=%s,
-                updated_prod_used=%s, updated_test_used=%s, updated_dev_used=%s
-            WHERE short_code=%s AND month_year=%s
-        """
-        self._exec_update(q2, params, audit_info)
-
-        # --- Apply limits to future months (NO AUDIT) ---
-        self._update_future_months(
-            table_name="users_table",
-            set_clause="""
-                updated_prod_limit = %s,
-                updated_test_limit = %s,
-                updated_dev_limit  = %s
-            """,
-            params=(p_lim, t_lim, d_lim),
-            short_code=sc,
-            month_year=month
-        )
 
-        self._update_future_months(
-            table_name="final_computed_table",
-            set_clause="""
-                updated_prod_limit = %s,
-                updated_test_limit = %s,
-                updated_dev_limit  = %s
-            """,
-            params=(p_lim, t_lim, d_lim),
-            short_code=sc,
-            month_year=month
-        )
+    def update_users(self, sc, month, p_lim, t_lim, d_lim, p_used, t_used, d_used, audit_info):
+        # Update users_table; final_computed_table is materialized from it
+        values = (p_lim, t_lim, d_lim, p_used, t_used, d_used)
+        with self.unit_of_work(audit_info) as uow:
+            uow.ensure_open(sc, month)
+            uow.update("""
+                UPDATE users_table SET 
+                    updated_prod_limit=%s, updated_test_limit=%s, updated_dev_limit=%s,
+                    updated_prod_used=%s, updated_test_used=%s, updated_dev_used=%s
+                WHERE short_code=%s AND month_year=%s
+            """, values + (sc, month))
+            uow.materialize('users', sc, month, values)
+
+            # --- Limits hold from this month on ---
+            uow.set_terms('users', sc, month, (p_lim, t_lim, d_lim))
+        self._on_customer_changed(sc, month)
 
 
     def update_storage(self, sc, month, pt, tt, dt, pa, ta, da, audit_info):
-        params = (pt, tt, dt, pa, ta, da, sc, month)
-        q1 = """
-            UPDATE storage_table SET 
-                updated_prod_target_storage_gb=%s, updated_test_target_storage_gb=%s, updated_dev_target_storage_gb=%s,
-                updated_prod_storage_gb=%s, updated_test_storage_gb=%s, updated_dev_storage_gb=%s
-            WHERE short_code=%s AND month_year=%s
-        """
-        self._exec_update(q1, params, audit_info)
-
-        q2 = """
-            UPDATE final_computed_table SET 
-                updated_prod_target_storage_gb=%s, updated_test_target_storage_gb=%s, updated_dev_target_storage_gb=%s,
-                updated_prod_storage_gb=%s, updated_test_storage_gb=%s, updated_dev_storage_gb=%s
-            WHERE short_code=%s AND month_year=%s
-        """
-        self._exec_update(q2, params, audit_info)
-
-        # --- Apply storage targets to future months (NO AUDIT) ---
-        self._update_future_months(
-            table_name="storage_table",
-            set_clause="""
-                updated_prod_target_storage_gb = %s,
-                updated_test_target_storage_gb = %s,
-                updated_dev_target_storage_gb  = %s
-            """,
-            params=(pt, tt, dt),
-            short_code=sc,
-            month_year=month
-        )
-
-        self._update_future_months(
-            table_name="final_computed_table",
-            set_clause="""
-                updated_prod_target_storage_gb = %s,
-                updated_test_target_storage_gb = %s,
-                updated_dev_target_storage_gb  = %s
-            """,
-            params=(pt, tt, dt),
-            short_code=sc,
-            month_year=month
-        )
+        values = (pt, tt, dt, pa, ta, da)
+        with self.unit_of_work(audit_info) as uow:
+            uow.ensure_open(sc, month)
+            uow.update("""
+                UPDATE storage_table SET 
+                    updated_prod_target_storage_gb=%s, updated_test_target_storage_gb=%s, updated_dev_target_storage_gb=%s,
+                    updated_prod_storage_gb=%s, updated_test_storage_gb=%s, updated_dev_storage_gb=%s
+                WHERE short_code=%s AND month_year=%s
+            """, values + (sc, month))
+            uow.materialize('storage', sc, month, values)
+
+            # --- Storage targets hold from this month on ---
+            uow.set_terms('storage', sc, month, (pt, tt, dt))
+        self._on_customer_changed(sc, month)
 
 
     def update_tickets(self, sc, month, opened, closed, backlog, overall, audit_info):
-        params = (opened, closed, backlog, overall, sc, month)
-        q1 = """
-            UPDATE tickets_computed_table SET 
-                updated_tickets_opened=%s, updated_tickets_closed=%s, 
-                updated_tickets_current_backlog=%s, updated_tickets_overall_backlog=%s
-            WHERE short_code=%s AND month_year=%s
+        values = (opened, closed, backlog, overall)
+        with self.unit_of_work(audit_info) as uow:
+            uow.ensure_open(sc, month)
+            uow.update("""
+                UPDATE tickets_computed_table SET 
+                    updated_tickets_opened=%s, updated_tickets_closed=%s, 
+                    updated_tickets_current_backlog=%s, updated_tickets_overall_backlog=%s
+                WHERE short_code=%s AND month_year=%s
+            """, values + (sc, month))
+            uow.materialize('tickets', sc, month, values)
+        self._on_customer_changed(sc, month)
+
+    def _validate_bulk_rows(self, rows):
+        """
+        Validates and normalizes bulk rows.
+        Returns (staged, results): staged rows are tuples in staging-table column
+        order; results has one entry per input row (errors already filled in).
+        """
+        fields = [f for g in BULK_METRIC_GROUPS.values() for f in g['columns']]
+        results = []
+        staged = []
+        seen = {}
+
+        for idx, raw in enumerate(rows):
+            raw = raw or {}
+            if not isinstance(raw, dict):
+                results.append({'row': idx, 'short_code': '', 'month': '', 'success': False, 'updated': [],
+                                'message': 'Row must be an object'})
+                continue
+            sc = raw.get('short_code') or ''
+            month = raw.get('month') or raw.get('month_year') or ''
+            result = {'row': idx, 'short_code': sc, 'month': month, 'success': False, 'updated': []}
+            results.append(result)
+
+            if not isinstance(month, str):
+                result['message'] = 'Missing or invalid month (expected YYYY-MM-DD)'
+                continue
+            if not isinstance(sc, str):
+                result['message'] = 'short_code must be a string'
+                continue
+            sc, month = sc.strip(), month.strip()
+            result.update(short_code=sc, month=month)
+
+            try:
+                month_date = datetime.datetime.strptime(month, '%Y-%m-%d').date()
+            except ValueError:
+                result['message'] = 'Missing or invalid month (expected YYYY-MM-DD)'
+                continue
+            if not sc:
+                result['message'] = 'Missing short_code'
+                continue
+            if (sc, month_date) in seen:
+                result['message'] = f"Duplicate of row {seen[(sc, month_date)]}"
+                continue
+
+            values = {}
+            try:
+                for f in fields:
+                    v = raw.get(f)
+                    if v is None or (isinstance(v, str) and not v.strip()):
+                        continue
+                    if isinstance(v, bool):
+                        raise TypeError(f)
+                    v = float(v)
+                    # float() accepts 'nan' and 'inf', which the NUMERIC columns must not get
+                    if not math.isfinite(v):
+                        raise ValueError(f)
+                    values[f] = v / 100.0 if f in BULK_PERCENT_FIELDS else v
+            except (TypeError, ValueError):
+                result['message'] = f"Non-numeric value for '{f}'"
+                continue
+            if not values:
+                result['message'] = 'No metric values supplied'
+                continue
+
+            seen[(sc, month_date)] = idx
+            staged.append((idx, sc, month_date) + tuple(values.get(f) for f in fields))
+
+        return staged, results
+
+    def _drop_closed_rows(self, cur, staged, results):
+        """
+        Removes staged rows of closed customer-months (their result gets an
+        error). Like ensure_month_open, takes the months' shared close locks
+        first, so none of them can be closed before the caller's transaction ends.
+        """
+        months = sorted({r[2] for r in staged})
+        cur.execute("""
+            SELECT pg_advisory_xact_lock_shared(hashtext('month_close:' || m))
+            FROM unnest(%s::date[]) m
+        """, (months,))
+        cur.execute("""
+            SELECT short_code, month_year FROM month_snapshots
+            WHERE (short_code, month_year) IN (
+                SELECT * FROM unnest(%s::text[], %s::date[])
+            )
+        """, ([r[1] for r in staged], [r[2] for r in staged]))
+        closed = set(cur.fetchall())
+        kept = []
+        for row in staged:
+            if (row[1], row[2]) in closed:
+                results[row[0]]['message'] = 'Month is closed and can no longer be edited'
+            else:
+                kept.append(row)
+        return kept
+
+    def bulk_update_metrics(self, rows, audit_info):
         """
-        self._exec_update(q1, params, audit_info)
+        Applies a batch of metric rows across customers, months and metric groups.
+
+        Each row is a dict with 'short_code', 'month' (YYYY-MM-DD) and any of the
+        fields in BULK_METRIC_GROUPS. Missing fields leave the stored value as is.
+        The batch is loaded into a temp staging table with execute_values and
+        applied with one set-based UPDATE ... FROM per source table, all in one
+        transaction; final_computed_table is then refreshed from the source rows
+        and the Audit Trigger writes the audit rows under a single audit
+        context. Supplied targets/limits then get an effective-dated record at
+        the row's month, applied per customer in month order, i.e. as if the
+        rows had been saved one by one. Rows for closed months are rejected.
+
+        Returns a list of per-row results:
+            {'row', 'short_code', 'month', 'success', 'updated': [groups], 'message'?}
+        """
+        staged, results = self._validate_bulk_rows(rows)
+        if not staged:
+            return results
+
+        group_fields = {name: list(g['columns']) for name, g in BULK_METRIC_GROUPS.items()}
+        fields = [f for names in group_fields.values() for f in names]
+        columns = {f: col for g in BULK_METRIC_GROUPS.values() for f, col in g['columns'].items()}
 
-        q2 = """
-            UPDATE final_computed_table SET 
-                updated_tickets_opened=%s, updated_tickets_closed=%s, 
-                updated_tickets_current_backlog=%s, updated_tickets_overall_backlog=%s
-            WHERE short_code=%s AND month_year=%s
+        try:
+            with self.connection() as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        staged = self._drop_closed_rows(cur, staged, results)
+                        if not staged:
+                            return results
+                        stage_cols = ", ".join(f"{columns[f]} NUMERIC" for f in fields)
+                        cur.execute(f"""
+                            CREATE TEMP TABLE bulk_metrics_stage (
+                                row_no INT, short_code TEXT, month_year DATE, {stage_cols}
+                            ) ON COMMIT DROP
+                        """)
+                        execute_values(
+                            cur,
+                            f"INSERT INTO bulk_metrics_stage (row_no, short_code, month_year, "
+                            f"{', '.join(columns[f] for f in fields)}) VALUES %s",
+                            staged,
+                            page_size=1000
+                        )
+
+                        self._set_audit_context(cur, audit_info)
+                        updated = {}  # row_no -> [groups]
+                        for name, group in BULK_METRIC_GROUPS.items():
+                            cols = [columns[f] for f in group_fields[name]]
+                            set_clause = ", ".join(f"{c} = COALESCE(s.{c}, t.{c})" for c in cols)
+                            has_group = " OR ".join(f"s.{c} IS NOT NULL" for c in cols)
+                            # Source rows; months that exist only in final_computed_table
+                            # (no source row to materialize from) are written directly
+                            for table_name, only_final in ((group['table'], ""), ('final_computed_table', f"""
+                                AND NOT EXISTS (
+                                    SELECT 1 FROM {group['table']} x
+                                    WHERE x.short_code = t.short_code AND x.month_year = t.month_year
+                                )""")):
+                                cur.execute(f"""
+                                    UPDATE {table_name} t SET {set_clause}
+                                    FROM bulk_metrics_stage s
+                                    WHERE t.short_code = s.short_code
+                                    AND t.month_year = s.month_year
+                                    AND ({has_group}){only_final}
+                                    RETURNING s.row_no
+                                """)
+                                for (row_no,) in cur.fetchall():
+                                    updated.setdefault(row_no, []).append(name)
+
+                        cur.execute(FINAL_REFRESH_SQL, {'short_codes': sorted({r[1] for r in staged})})
+
+                        # --- Effective-dated targets/limits, in month order per customer ---
+                        cur.execute("""
+                            CREATE TEMP TABLE bulk_terms_stage ON COMMIT DROP AS
+                            SELECT s.*, row_number() OVER (PARTITION BY short_code ORDER BY month_year) AS seq
+                            FROM bulk_metrics_stage s
+                        """)
+                        cur.execute("SELECT COALESCE(max(seq), 0) FROM bulk_terms_stage")
+                        levels = cur.fetchone()[0]
+                        for seq in range(1, levels + 1):
+                            for group in TERM_GROUPS.values():
+                                self._apply_bulk_terms(cur, group, seq)
+        except Exception as e:
+            for result in results:
+                if 'message' not in result:
+                    result['message'] = str(e)
+            return results
+
+        for result in results:
+            if 'message' in result:
+                continue
+            groups = updated.get(result['row'])
+            if groups:
+                result['success'] = True
+                result['updated'] = groups
+            else:
+                result['message'] = 'No data found for this customer/month'
+
+        for sc in {r['short_code'] for r in results if r['success']}:
+            self._on_customer_changed(sc)
+        return results
+
+    @staticmethod
+    def _apply_bulk_terms(cur, group, seq):
+        """
+        Records the terms supplied by the bulk_terms_stage rows with this seq:
+        an upsert at the row's month (unsupplied columns keep the value in
+        effect there) plus the supplied columns on the customer's later records.
+        Rows whose customer-month does not exist are ignored.
         """
-        self._exec_update(q2, params, audit_info)
+        table, cols = group['terms_table'], group['terms']
+        has_group = " OR ".join(f"s.{c} IS NOT NULL" for c in cols)
+        cur.execute(f"""
+            INSERT INTO {table} (short_code, valid_from, {', '.join(cols)})
+            SELECT s.short_code, s.month_year, {', '.join(f"COALESCE(s.{c}, f.{c})" for c in cols)}
+            FROM bulk_terms_stage s
+            JOIN final_metrics f
+                ON f.short_code = s.short_code AND f.month_year = s.month_year
+            WHERE s.seq = %s AND ({has_group})
+            ON CONFLICT (short_code, valid_from) DO UPDATE SET
+                {', '.join(f"{c} = EXCLUDED.{c}" for c in cols)}
+        """, (seq,))
+        cur.execute(f"""
+            UPDATE {table} e SET {', '.join(f"{c} = COALESCE(s.{c}, e.{c})" for c in cols)}
+            FROM bulk_terms_stage s
+            WHERE s.seq = %s AND ({has_group})
+            AND e.short_code = s.short_code
+            AND e.valid_from > s.month_year
+            AND EXISTS (
+                SELECT 1 FROM final_computed_table f
+                WHERE f.short_code = s.short_code AND f.month_year = s.month_year
+            )
+        """, (seq,))
 
     def update_config(self, sc, name, csm_p, csm_l, uid, envs, months, note, audit_info):
         q = """
@@ -307,12 +1003,12 @@ class DbOperations:
             WHERE short_code = %s
         """
         self._exec_update(q, (name, csm_p, csm_l, uid, envs, months, note, sc), audit_info)
+        self._on_customer_changed(sc, config=True)
 
 
     # --- Admin / Management ---
     def insert_new_customer(self, short_code, go_live, csm_p, csm_l, months, envs, audit_info):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn:
                 with conn.cursor() as cur:
                     self._set_audit_context(cur, audit_info)
@@ -334,153 +1030,354 @@ class DbOperations:
                     cur.execute("""
                         INSERT INTO final_computed_table (short_code, month_year) VALUES (%s, %s)
                     """, (short_code, today))
-        finally:
-            conn.close()
+        self._on_customer_changed(short_code, config=True)
+
+    # --- Materialization of final_computed_table ---
+    def _run_refresh(self, cur, short_codes=None):
+        cur.execute(FINAL_REFRESH_SQL, {'short_codes': short_codes})
+        keys, updated, inserted, changed = cur.fetchone()
+        return {'keys': keys, 'updated': updated, 'inserted': inserted, 'customers': changed}
+
+    def _after_refresh(self, result):
+        for sc in result['customers']:
+            self._on_customer_changed(sc)
+        return result
+
+    def refresh_final(self, short_codes=None, audit_info=MATERIALIZER_AUDIT_INFO):
+        """
+        Recomputes the final_computed_table rows of the dirty keys left by
+        writes outside a metric save (e.g. loaders), for short_codes or all
+        customers. Returns {'keys', 'updated', 'inserted', 'customers'}.
+        """
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    self._set_audit_context(cur, audit_info)
+                    result = self._run_refresh(cur, short_codes)
+        return self._after_refresh(result)
+
+    def rebuild_final(self, audit_info=MATERIALIZER_AUDIT_INFO):
+        """Full rebuild: marks every source key dirty and refreshes them in one transaction."""
+        keys = " UNION ".join(f"SELECT short_code, month_year FROM {table}" for table in FINAL_SOURCES)
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    self._set_audit_context(cur, audit_info)
+                    cur.execute(f"""
+                        INSERT INTO final_dirty_keys (short_code, month_year)
+                        {keys}
+                        ON CONFLICT DO NOTHING
+                    """)
+                    result = self._run_refresh(cur)
+        return self._after_refresh(result)
+
+    def check_final(self, limit=100):
+        """
+        Drift between the source tables and final_computed_table:
+        (count, [(source, short_code, month_year, missing, [columns])] up to limit).
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT *, count(*) OVER () FROM ({FINAL_DRIFT_SQL}) d
+                    ORDER BY short_code, month_year, source
+                    LIMIT %s
+                """, (limit,))
+                rows = cur.fetchall()
+        return (rows[0][-1] if rows else 0), [r[:-1] for r in rows]
+
+    def check_terms(self, limit=100):
+        """
+        Stored target/limit changes hidden by the term records (TERM_DRIFT_SQL):
+        (count, [(terms table, short_code, month_year, [columns])] up to limit).
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT *, count(*) OVER () FROM ({TERM_DRIFT_SQL}) d
+                    ORDER BY short_code, month_year, terms
+                    LIMIT %s
+                """, (limit,))
+                rows = cur.fetchall()
+        return (rows[0][-1] if rows else 0), [r[:-1] for r in rows]
+
+    def fix_final_drift(self, audit_info=MATERIALIZER_AUDIT_INFO):
+        """Marks the keys that check_final reports dirty and refreshes them."""
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    self._set_audit_context(cur, audit_info)
+                    cur.execute(f"""
+                        INSERT INTO final_dirty_keys (short_code, month_year)
+                        SELECT DISTINCT short_code, month_year FROM ({FINAL_DRIFT_SQL}) d
+                        ON CONFLICT DO NOTHING
+                    """)
+                    result = self._run_refresh(cur)
+        return self._after_refresh(result)
 
     def load_audits(self):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("SELECT * FROM audit_logs ORDER BY changed_at DESC LIMIT 10")
                 return cur.fetchall()
-        finally:
-            conn.close()
 
-    def get_audit_csv_data(self):
-        conn = self.get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT * FROM audit_logs ORDER BY changed_at DESC")
-                cols = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
-                return cols, rows
-        finally:
-            conn.close()
+    def stream_audit_csv(self):
+        """Streams the full audit log as CSV chunks (newest first)."""
+        return self.stream_csv("SELECT * FROM audit_logs ORDER BY changed_at DESC")
 
     # --- Reporting ---
+    def _format_report_row(self, r):
+        """One final_metrics + mapping row in the Reporting page's column order."""
+        dt_str = r['month_year'].strftime('%B %Y')  # e.g. March 2025
+        envs = r.get('no_of_environments', 2)
+
+        row = {}
+
+        # 1. Identity
+        row["Customer Name"] = r['short_code']
+        row["Month & Year"] = dt_str
+        row["CSM Primary"] = r.get('csm_primary', '')
+        row["CSM Lead"] = r.get('csm_lead', '')
+
+        # 2. Availability
+        row["Availability (%)"] = self.fmt_num(
+            (r['updated_availability'] or 0) * 100
+        )
+        row["Target (%)"] = self.fmt_num(
+            (r['updated_target'] or 0) * 100
+        )
+
+        # 3. Users
+        row["Prod Limit"] = r['updated_prod_limit']
+        row["Prod Used"] = r['updated_prod_used']
+        row["Test Limit"] = r['updated_test_limit']
+        row["Test Used"] = r['updated_test_used']
+
+        if envs == 3:
+            row["Dev Limit"] = r['updated_dev_limit']
+            row["Dev Used"] = r['updated_dev_used']
+
+        # 4. Storage
+        row["Prod Target GB"] = self.fmt_num(r['updated_prod_target_storage_gb'])
+        row["Prod Actual GB"] = self.fmt_num(r['updated_prod_storage_gb'])
+        row["Test Target GB"] = self.fmt_num(r['updated_test_target_storage_gb'])
+        row["Test Actual GB"] = self.fmt_num(r['updated_test_storage_gb'])
+
+        if envs == 3:
+            row["Dev Target GB"] = self.fmt_num(r['updated_dev_target_storage_gb'])
+            row["Dev Actual GB"] = self.fmt_num(r['updated_dev_storage_gb'])
+
+        # 5. Tickets
+        row["Opened Tickets"] = r['updated_tickets_opened']
+        row["Closed Tickets"] = r['updated_tickets_closed']
+        row["Current Backlog Tickets"] = r['updated_tickets_current_backlog']
+        row["Tickets Backlog"] = r['updated_tickets_overall_backlog']
+
+        return row
+
+    def _report_store_values(self, source_rows):
+        """(lookup, short_code, month_year, row_data) tuples for report_rows."""
+        values = []
+        for r in source_rows:
+            # default=str: Decimal columns become strings, as jsonify would render them
+            row_data = json.dumps(self._format_report_row(r), default=str)
+            lookups = {f"sc:{r['short_code']}"}
+            lookups.update(f"csm:{c}" for c in (r.get('csm_primary'), r.get('csm_lead')) if c)
+            values.extend((lookup, r['short_code'], r['month_year'], row_data) for lookup in lookups)
+        return values
+
+    def _write_report_rows(self, cur, where="", params=()):
+        cur.execute(REPORT_SOURCE_SQL + where, params)
+        values = self._report_store_values(cur.fetchall())
+        if values:
+            execute_values(cur, """
+                INSERT INTO report_rows (lookup, short_code, month_year, row_data)
+                VALUES %s
+            """, values, page_size=1000)
+        return len(values)
+
+    def fill_report_store(self, cur):
+        """
+        Empties report_rows and writes every customer's rows with cur (a
+        RealDictCursor, in the caller's transaction). Migration 8 creates and
+        fills the store this way; reads assume it exists.
+        """
+        cur.execute("TRUNCATE report_rows")
+        return self._write_report_rows(cur)
+
+    def rebuild_report_store(self):
+        """Full refresh of report_rows, e.g. after data was loaded outside the app."""
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    return self.fill_report_store(cur)
+
+    def refresh_report_store(self, short_code, from_month=None):
+        """
+        Re-materializes the report rows of one customer: all months, or
+        from_month onwards (a changed target/limit also applies to the later
+        months).
+        """
+        where, params = " WHERE f.short_code = %s", [short_code]
+        delete = "DELETE FROM report_rows WHERE short_code = %s"
+        if from_month:
+            where += " AND f.month_year >= %s"
+            delete += " AND month_year >= %s"
+            params.append(from_month)
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    # Serialize refreshes of the same customer, so they cannot both
+                    # delete and then collide on report_rows_lookup_idx
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext('report_rows:' || %s))", (short_code,))
+                    cur.execute(delete, params)
+                    return self._write_report_rows(cur, where, params)
+
+    @staticmethod
+    def _report_filter(short_code, csm, month_year, no_of_months, customer_filter=None):
+        """
+        WHERE clause and params selecting one report scope from report_rows:
+        EXACTLY N months including the selected month (calendar-based),
+        optionally only customers whose short code contains customer_filter.
+        Returns (None, None) when neither a customer nor a CSM is given.
+        """
+        if short_code:
+            lookup = f"sc:{short_code}"
+        elif csm:
+            lookup = f"csm:{csm}"
+        else:
+            return None, None
+
+        # Selected month
+        target_date = datetime.datetime.strptime(month_year, '%Y-%m-%d').date()
+
+        # We want N months total INCLUDING selected month
+        # So go back (N - 1) months
+        months_back = max(int(no_of_months) - 1, 0)
+
+        where = [
+            "lookup = %s",
+            "month_year <= %s",
+            "month_year >= (%s::date - INTERVAL '%s months')",
+        ]
+        params = [lookup, target_date, target_date, months_back]
+        if customer_filter:
+            escaped = customer_filter.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("short_code ILIKE %s")
+            params.append(f"%{escaped}%")
+        return where, params
+
+    def _read_report_store(self, where, params, order="short_code ASC, month_year DESC", limit=None):
+        """[(short_code, month_year, row dict)] from report_rows."""
+        query = f"""
+            SELECT short_code, month_year, row_data
+            FROM report_rows
+            WHERE {' AND '.join(where)}
+            ORDER BY {order}
+        """
+        if limit is not None:
+            query += " LIMIT %s"
+            params = list(params) + [limit]
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
+
+    def _count_report_rows(self, where, params):
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM report_rows WHERE {' AND '.join(where)}", params)
+                return cur.fetchone()[0]
 
-    # --- Reporting ---
     def load_report(self, short_code=None, csm=None, month_year=None, no_of_months=6):
         """
         Generates report data with specific column ordering.
         Shows EXACTLY N months including the selected month (calendar-based).
-        Returns list of dicts.
+        Returns list of dicts, read from the pre-formatted report_rows store.
         """
-        conn = self.get_connection()
-        data_rows = []
- 
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
- 
-                # Selected month
-                target_date = datetime.datetime.strptime(month_year, '%Y-%m-%d').date()
- 
-                # We want N months total INCLUDING selected month
-                # So go back (N - 1) months
-                months_back = max(int(no_of_months) - 1, 0)
- 
-                query = ""
-                params = ()
- 
-                if short_code:
-                    query = """
-                        SELECT f.*, m.no_of_environments, m.customer_name,
-                            m.csm_primary, m.csm_lead
-                        FROM final_computed_table f
-                        JOIN customer_mapping_table m
-                        ON f.short_code = m.short_code
-                        WHERE f.short_code = %s
-                        AND f.month_year <= %s
-                        AND f.month_year >= (%s::date - INTERVAL '%s months')
-                        ORDER BY f.month_year DESC
-                    """
-                    params = (
-                        short_code,
-                        target_date,
-                        target_date,
-                        months_back
-                    )
- 
-                elif csm:
-                    query = """
-                        SELECT f.*, m.no_of_environments, m.customer_name,
-                            m.csm_primary, m.csm_lead
-                        FROM final_computed_table f
-                        JOIN customer_mapping_table m
-                        ON f.short_code = m.short_code
-                        WHERE (m.csm_primary = %s OR m.csm_lead = %s)
+        where, params = self._report_filter(short_code, csm, month_year, no_of_months)
+        if where is None:
+            return []
+
+        return [r[2] for r in self._read_report_store(where, params)]
+
+    def load_report_page(self, short_code=None, csm=None, month_year=None, no_of_months=6,
+                         after=None, page_size=100, customer_sort='asc', month_sort='desc',
+                         customer_filter=None):
+        """
+        One page of load_report, in keyset order on (short_code, month_year).
+        after is the next_cursor of the previous page, so every page is an index
+        range read of at most page_size rows however deep the client scrolls.
+        Returns {'data', 'next_cursor', 'total'}; total comes from a count side
+        query and is only computed for the first page (after=None).
+        """
+        if customer_sort not in ('asc', 'desc') or month_sort not in ('asc', 'desc'):
+            raise ValueError("Sort direction must be 'asc' or 'desc'")
+        page_size = min(max(int(page_size), 1), REPORT_MAX_PAGE_SIZE)
+
+        where, params = self._report_filter(short_code, csm, month_year, no_of_months, customer_filter)
+        if where is None:
+            return {'data': [], 'next_cursor': None, 'total': 0}
+
+        total = None
+        if after is None:
+            total = self._count_report_rows(where, params)
+
+        page_where, page_params = list(where), list(params)
+        if after:
+            try:
+                after_sc, after_month = after.rsplit('|', 1)
+                after_month = datetime.date.fromisoformat(after_month)
+            except ValueError:
+                raise ValueError("Invalid page cursor")
+            sc_op = '>' if customer_sort == 'asc' else '<'
+            month_op = '>' if month_sort == 'asc' else '<'
+            page_where.append(f"(short_code {sc_op} %s OR (short_code = %s AND month_year {month_op} %s))")
+            page_params += [after_sc, after_sc, after_month]
+
+        rows = self._read_report_store(
+            page_where, page_params,
+            order=f"short_code {customer_sort.upper()}, month_year {month_sort.upper()}",
+            limit=page_size + 1,
+        )
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last_sc, last_month, _ = rows[-1]
+            next_cursor = f"{last_sc}|{last_month.isoformat()}"
+        return {'data': [r[2] for r in rows], 'next_cursor': next_cursor, 'total': total}
+
+    def stream_report_source(self, short_code=None, csm=None, month_year=None, no_of_months=6, itersize=2000):
+        """
+        Generator over the unformatted report rows of one scope (final_metrics
+        columns plus the mapping columns, as dicts), ordered by customer and newest
+        month first. Rows come from a server-side (named) cursor, so memory stays
+        flat however large the CSM's portfolio is.
+        """
+        if short_code:
+            scope, scope_params = "f.short_code = %s", [short_code]
+        elif csm:
+            scope, scope_params = "(m.csm_primary = %s OR m.csm_lead = %s)", [csm, csm]
+        else:
+            return
+        target_date = datetime.datetime.strptime(month_year, '%Y-%m-%d').date()
+        months_back = max(int(no_of_months) - 1, 0)
+
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(name=f"report_export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = itersize
+                    cur.execute(REPORT_SOURCE_SQL + f"""
+                        WHERE {scope}
                         AND f.month_year <= %s
                         AND f.month_year >= (%s::date - INTERVAL '%s months')
                         ORDER BY f.short_code ASC, f.month_year DESC
-                    """
-                    params = (
-                        csm,
-                        csm,
-                        target_date,
-                        target_date,
-                        months_back
-                    )
- 
-                cur.execute(query, params)
-                raw_rows = cur.fetchall()
- 
-                # Process rows with EXACT requested column order
-                for r in raw_rows:
-                    dt_str = r['month_year'].strftime('%B %Y')  # e.g. March 2025
-                    envs = r.get('no_of_environments', 2)
- 
-                    row = {}
- 
-                    # 1. Identity
-                    row["Customer Name"] = r['short_code']
-                    row["Month & Year"] = dt_str
-                    row["CSM Primary"] = r.get('csm_primary', '')
-                    row["CSM Lead"] = r.get('csm_lead', '')
- 
-                    # 2. Availability
-                    row["Availability (%)"] = self.fmt_num(
-                        (r['updated_availability'] or 0) * 100
-                    )
-                    row["Target (%)"] = self.fmt_num(
-                        (r['updated_target'] or 0) * 100
-                    )
- 
-                    # 3. Users
-                    row["Prod Limit"] = r['updated_prod_limit']
-                    row["Prod Used"] = r['updated_prod_used']
-                    row["Test Limit"] = r['updated_test_limit']
-                    row["Test Used"] = r['updated_test_used']
- 
-                    if envs == 3:
-                        row["Dev Limit"] = r['updated_dev_limit']
-                        row["Dev Used"] = r['updated_dev_used']
- 
-                    # 4. Storage
-                    row["Prod Target GB"] = self.fmt_num(r['updated_prod_target_storage_gb'])
-                    row["Prod Actual GB"] = self.fmt_num(r['updated_prod_storage_gb'])
-                    row["Test Target GB"] = self.fmt_num(r['updated_test_target_storage_gb'])
-                    row["Test Actual GB"] = self.fmt_num(r['updated_test_storage_gb'])
- 
-                    if envs == 3:
-                        row["Dev Target GB"] = self.fmt_num(r['updated_dev_target_storage_gb'])
-                        row["Dev Actual GB"] = self.fmt_num(r['updated_dev_storage_gb'])
- 
-                    # 5. Tickets
-                    row["Opened Tickets"] = r['updated_tickets_opened']
-                    row["Closed Tickets"] = r['updated_tickets_closed']
-                    row["Current Backlog Tickets"] = r['updated_tickets_current_backlog']
-                    row["Tickets Backlog"] = r['updated_tickets_overall_backlog']
- 
-                    data_rows.append(row)
- 
-                return data_rows
- 
-        finally:
-            conn.close() 
+                    """, scope_params + [target_date, target_date, months_back])
+                    yield from cur
 
+    @dropdown_cache.cached('csm_list')
     def get_csm_list(self):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor() as cur:
                 # Union primary and lead, distinct, order
                 cur.execute("""
@@ -491,12 +1388,10 @@ class DbOperations:
                     ) x WHERE csm IS NOT NULL AND csm != '' ORDER BY 1
                 """)
                 return [r[0] for r in cur.fetchall()]
-        finally:
-            conn.close()
 
+    @dropdown_cache.cached('reporting_months')
     def get_reporting_months(self, short_code=None, csm=None):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor() as cur:
                 if short_code:
                     cur.execute("SELECT DISTINCT month_year FROM final_computed_table WHERE short_code=%s ORDER BY 1 DESC", (short_code,))
@@ -520,52 +1415,31 @@ class DbOperations:
                     val = d.strftime("%Y-%m-%d")
                     results.append({"value": val, "display": display})
                 return results
-        finally:
-            conn.close()
 
 
                 
+    def dt_task_list(self):
+        """Distinct sub-task names for the Daily Tracker task dropdown."""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT DISTINCT new_subtasks
+                    FROM task_details
+                    WHERE COALESCE(new_subtasks,'') <> ''
+                    ORDER BY new_subtasks
+                """)
+                return [r[0] for r in cur.fetchall()]
+
     def dt_fetch_entries(self, date,username):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, userid, taskname, customername, task_type,
-                        time_in_min, comments,
-                        TO_CHAR(log_date,'YYYY-MM-DD') AS log_date
-                    FROM task_entries
-                    WHERE log_date = %s AND userid = %s
-                    ORDER BY id
-                """, (date,username))
+                cur.execute(DT_ENTRIES_SQL, (username, date, date))
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     def dt_aggregates(self, date, username):
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT 
-                        COALESCE(te.task_type,'Unknown') AS task_type,
-                        SUM(te.time_in_min) AS total_minutes,
-                        STRING_AGG(
-                            COALESCE(cm.customer_name, te.customername) || ' - ' ||
-                            te.taskname || ' - ' ||
-                            te.comments || ' - ' ||
-                            COALESCE(te.task_type,'') || ':' ||
-                            te.time_in_min::text,
-                            '; '
-                            ORDER BY te.id
-                        ) AS concat
-                    FROM task_entries te
-                    LEFT JOIN customer_mapping_table cm
-                        ON cm.short_code = te.customername
-                    WHERE te.log_date::date = %s
-                    AND te.userid = %s
-                    GROUP BY te.task_type
-                    ORDER BY task_type
-                """, (date, username))
+                cur.execute(DT_AGGREGATES_SQL, (username, date, date))
 
                 rows = cur.fetchall()
 
@@ -574,8 +1448,6 @@ class DbOperations:
                     'total_hours': round((r[1] or 0) / 60, 2),
                     'concatenated_string': r[2] or ''
                 } for r in rows]
-        finally:
-            conn.close()
 
 
     def dt_add_entry(self, data, audit):
@@ -589,48 +1461,44 @@ class DbOperations:
             if not all([date, customer, task, comments]) or time_min < 1:
                 return {'success': False, 'message': 'All fields are mandatory.'}
 
-            conn = self.get_connection()
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute("SET LOCAL audit.source = 'webapp'")
-                    cur.execute(
-                        "SET LOCAL audit.username = %s",
-                        (audit.get('username') or 'SYSTEM',)
-                    )
-                    cur.execute(
-                        "SET LOCAL audit.system_name = %s",
-                        (audit.get('system_name') or 'DailyTracker',)
-                    )
-                    cur.execute(
-                        "SET LOCAL audit.comment = %s",
-                        (audit.get('comments') or '',)
-                    )
-
-
-                    cur.execute("""
-                        SELECT cp_task_type
-                        FROM task_details
-                        WHERE TRIM(LOWER(new_subtasks)) = TRIM(LOWER(%s))
-                    """, (task,))
-
-                    row = cur.fetchone()
-                    task_type = row[0] if row and row[0] else None
+            with self.connection() as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SET LOCAL audit.source = 'webapp'")
+                        cur.execute(
+                            "SET LOCAL audit.username = %s",
+                            (audit.get('username') or 'SYSTEM',)
+                        )
+                        cur.execute(
+                            "SET LOCAL audit.system_name = %s",
+                            (audit.get('system_name') or 'DailyTracker',)
+                        )
+                        cur.execute(
+                            "SET LOCAL audit.comment = %s",
+                            (audit.get('comments') or '',)
+                        )
+
+
+                        cur.execute(DT_TASK_TYPE_SQL, (task,))
+
+                        row = cur.fetchone()
+                        task_type = row[0] if row and row[0] else None
 
-                    cur.execute("""
-                        INSERT INTO task_entries
-                        (id, userid, taskname, customername, time_in_min,
-                        comments, log_date, task_type)
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                    """, (
-                        str(uuid.uuid4()),
-                        audit['username'],
-                        task,
-                        customer,
-                        time_min,
-                        comments,
-                        date,
-                        task_type
-                    ))
+                        cur.execute("""
+                            INSERT INTO task_entries
+                            (id, userid, taskname, customername, time_in_min,
+                            comments, log_date, task_type)
+                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                        """, (
+                            str(uuid.uuid4()),
+                            audit['username'],
+                            task,
+                            customer,
+                            time_min,
+                            comments,
+                            date,
+                            task_type
+                        ))
 
             return {'success': True}
         except Exception as e:
@@ -639,57 +1507,123 @@ class DbOperations:
     def dt_delete(self, ids):
         if not ids:
             return {'success': False, 'message': 'No IDs provided'}
-        conn = self.get_connection()
-        try:
+        with self.connection() as conn:
             with conn:
                 with conn.cursor() as cur:
                     cur.execute("DELETE FROM task_entries WHERE id = ANY(%s)", (ids,))
                     return {'success': True, 'deleted': cur.rowcount}
-        finally:
-            conn.close()
 
-    def dt_copy(self, payload):
+    def dt_copy(self, payload, username=None):
+        """
+        Copies task entries in one INSERT ... SELECT (ids generated by the server).
+
+        payload either selects entries by id and copies them to one day:
+            {'ids': [...], 'target_date': 'YYYY-MM-DD'}
+        or copies all of username's entries in a date range onto a range of the
+        same length starting at target_from (e.g. last week onto this week):
+            {'source_from': ..., 'source_to': ..., 'target_from': ...}
+
+        on_duplicate decides what happens to a copy identical to an entry that
+        already exists on its target day: 'allow' (default), 'skip' it, or
+        'fail' the whole copy. Returns created / duplicates counts.
+        """
+        on_duplicate = payload.get('on_duplicate') or 'allow'
+        if on_duplicate not in DT_COPY_DUPLICATE_MODES:
+            return {'success': False, 'message': f"on_duplicate must be one of {', '.join(DT_COPY_DUPLICATE_MODES)}"}
+
         ids = payload.get('ids', [])
-        target_date = payload.get('target_date')
-        if not ids or not target_date:
-            return {'success': False, 'message': 'Invalid payload'}
- 
-        conn = self.get_connection()
-        try:
+        if ids:
+            try:
+                target_date = _payload_date(payload.get('target_date'))
+            except ValueError:
+                return {'success': False, 'message': 'Invalid payload'}
+            source_filter = "id = ANY(%(ids)s)"
+            target_expr = "%(target_date)s::date"
+            params = {'ids': ids, 'target_date': target_date}
+        else:
+            try:
+                source_from = _payload_date(payload.get('source_from'))
+                source_to = _payload_date(payload.get('source_to'))
+                target_from = _payload_date(payload.get('target_from'))
+            except ValueError:
+                return {'success': False, 'message': 'Invalid payload'}
+            if not username:
+                return {'success': False, 'message': 'User not identified'}
+            if source_from > source_to:
+                return {'success': False, 'message': 'From date cannot be after To date.'}
+            if (source_to - source_from).days + 1 > DT_COPY_MAX_DAYS:
+                return {'success': False, 'message': f'A copy can span at most {DT_COPY_MAX_DAYS} days.'}
+            # Half-open range on log_date; each entry keeps its offset from the range start
+            source_filter = """userid = %(username)s
+                AND log_date >= %(source_from)s
+                AND log_date < %(source_end)s"""
+            target_expr = "%(target_from)s::date + (log_date::date - %(source_from)s::date)"
+            params = {
+                'username': username,
+                'source_from': source_from,
+                'source_end': source_to + datetime.timedelta(days=1),
+                'target_from': target_from,
+            }
+
+        insert_filter = {
+            'allow': "TRUE",
+            'skip': "NOT dup",
+            'fail': "NOT EXISTS (SELECT 1 FROM marked WHERE dup)",
+        }[on_duplicate]
+
+        with self.connection() as conn:
             with conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT userid, taskname, customername,
-                            time_in_min, comments, task_type
-                        FROM task_entries
-                        WHERE id = ANY(%s)
-                    """, (ids,))
-                    rows = cur.fetchall()
-                    for r in rows:
-                        cur.execute("""
+                    cur.execute(f"""
+                        WITH src AS (
+                            SELECT userid, taskname, customername, time_in_min,
+                                comments, task_type, {target_expr} AS target_date
+                            FROM task_entries
+                            WHERE {source_filter}
+                        ),
+                        marked AS (
+                            SELECT s.*, EXISTS (
+                                SELECT 1 FROM task_entries t
+                                WHERE t.userid = s.userid
+                                AND t.log_date >= s.target_date
+                                AND t.log_date < s.target_date + 1
+                                AND t.customername IS NOT DISTINCT FROM s.customername
+                                AND t.taskname IS NOT DISTINCT FROM s.taskname
+                                AND t.comments IS NOT DISTINCT FROM s.comments
+                                AND t.task_type IS NOT DISTINCT FROM s.task_type
+                                AND t.time_in_min IS NOT DISTINCT FROM s.time_in_min
+                            ) AS dup
+                            FROM src s
+                        ),
+                        ins AS (
                             INSERT INTO task_entries
                             (id, userid, taskname, customername,
                             time_in_min, comments, log_date, task_type)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                        """, (
-                            str(uuid.uuid4()),
-                            r[0],  # userid
-                            r[1],  # taskname
-                            r[2],  # customername
-                            r[3],  # time_in_min
-                            r[4],  # comments
-                            target_date,  # log_date
-                            r[5]   # task_type
-                        ))
-            return {'success': True, 'created': len(rows)}
-        finally:
-            conn.close() 
+                            SELECT gen_random_uuid(), userid, taskname, customername,
+                                time_in_min, comments, target_date, task_type
+                            FROM marked
+                            WHERE {insert_filter}
+                            RETURNING 1
+                        )
+                        SELECT
+                            (SELECT count(*) FROM ins),
+                            (SELECT count(*) FROM marked WHERE dup),
+                            (SELECT count(*) FROM src)
+                    """, params)
+                    created, duplicates, selected = cur.fetchone()
+
+        if on_duplicate == 'fail' and duplicates:
+            return {
+                'success': False,
+                'message': f'{duplicates} of {selected} entries already exist on the target date(s). Nothing was copied.',
+                'created': 0,
+                'duplicates': duplicates,
+            }
+        return {'success': True, 'created': created, 'duplicates': duplicates}
  
     def dt_download_csv(self, args, username):
-        import csv
-        from io import StringIO, BytesIO
         from datetime import datetime, timedelta
-        from flask import send_file, jsonify
+        from flask import Response, jsonify
 
         selected_date = args.get('date')
         from_date = args.get('from')
@@ -735,16 +1669,8 @@ class DbOperations:
                     return jsonify({'success': False, 'message': 'From date cannot be after To date.'}), 400
 
                 filename_datepart = f"{fd}_to_{td}"
-                query = """
-                    SELECT id, userid, taskname, customername, task_type,
-                        time_in_min, comments,
-                        TO_CHAR(log_date,'YYYY-MM-DD HH24:MI:SS') AS log_date
-                    FROM task_entries
-                    WHERE log_date::date BETWEEN %s AND %s
-                    AND userid = %s
-                    ORDER BY id
-                """
-                params = (fd, td, username)
+                query = DT_EXPORT_SQL
+                params = (username, fd, td + timedelta(days=1))
 
             # -------- SINGLE DATE / ALL --------
             else:
@@ -769,38 +1695,13 @@ class DbOperations:
                         return jsonify({'success': False, 'message': 'Invalid date.'}), 400
 
                     filename_datepart = sd
-                    query = """
-                        SELECT id, userid, taskname, customername, task_type,
-                            time_in_min, comments,
-                            TO_CHAR(log_date,'YYYY-MM-DD HH24:MI:SS') AS log_date
-                        FROM task_entries
-                        WHERE log_date::date = %s
-                        AND userid = %s
-                        ORDER BY id
-                    """
-                    params = (sd, username)
+                    query = DT_EXPORT_SQL
+                    params = (username, sd, sd + timedelta(days=1))
 
-            conn = self.get_connection()
-            cur = conn.cursor()
-            cur.execute(query, params)
-            rows = cur.fetchall()
-            colnames = [d[0] for d in cur.description]
-            cur.close()
-            conn.close()
-
-            out = StringIO()
-            writer = csv.writer(out)
-            writer.writerow(colnames)
-            writer.writerows(rows)
-
-            buf = BytesIO(out.getvalue().encode('utf-8'))
-            buf.seek(0)
-
-            return send_file(
-                buf,
+            return Response(
+                self.stream_csv(query, params),
                 mimetype='text/csv; charset=utf-8',
-                as_attachment=True,
-                download_name=f'daily_tracker_{filename_datepart}.csv'
+                headers={'Content-Disposition': f'attachment; filename=daily_tracker_{filename_datepart}.csv'}
             )
 
         except Exception as e:
@@ -814,52 +1715,18 @@ class DbOperations:
     def log_access_db(self, user_info):
         """
         Logs user access to the PostgreSQL database AND appends to CSV.
+        Only queues the entry; AccessLogWriter does the I/O in the background.
         """
         username = user_info.get('username') or 'Guest/Direct Link'
         system_name = user_info.get('system_name') or 'Unknown'
         ip_address = user_info.get('ip_address') or 'Unknown'
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        conn = self.get_connection()
-        try:
-            # 1. Write to DB
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO user_access_logs (username, system_name, ip_address)
-                        VALUES (%s, %s, %s)
-                    """, (username, system_name, ip_address))
-            
-            # 2. Try to append to CSV (Best Effort)
-            try:
-                file_exists = os.path.isfile(self.csv_file)
-                with open(self.csv_file, 'a', newline='') as f:
-                    writer = csv.writer(f)
-                    if not file_exists:
-                        writer.writerow(['Timestamp', 'Username', 'System Name', 'IP Address'])
-                    writer.writerow([timestamp, username, system_name, ip_address])
-            except PermissionError:
-                print(f"[Warning] CSV Locked. Logged to DB only for: {username}")
-            except Exception as e:
-                print(f"[Error] CSV Write Failed: {e}")
 
-        except Exception as e:
-            print(f"[DB Log Error] Failed to log access: {e}")
-        finally:
-            conn.close()
+        get_access_log_writer(self.db_config, self.csv_file).log(username, system_name, ip_address)
 
-    def get_access_logs(self):
-        """Fetches all access logs for CSV download."""
-        conn = self.get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT access_time, username, system_name, ip_address
-                    FROM user_access_logs
-                    ORDER BY access_time DESC
-                """)
-                cols = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
-                return cols, rows
-        finally:
-            conn.close()
+    def stream_access_logs_csv(self):
+        """Streams all access logs as CSV chunks for download."""
+        return self.stream_csv("""
+            SELECT access_time, username, system_name, ip_address
+            FROM user_access_logs
+            ORDER BY access_time DESC
+        """)
@@ -0,0 +1,89 @@
+"""
+Compact JSON payloads for the data endpoints (/load_report_data, /load_metrics).
+
+Clients opt in with format=columnar (header list + row arrays) or
+format=columns (header list + one array per column). Both formats are encoded
+with orjson when it is installed (stdlib json otherwise); Decimal values are
+sent as numbers and dates as ISO strings. json_response() also compresses the
+body with brotli (if installed) or gzip, as negotiated via Accept-Encoding.
+"""
+import datetime
+import gzip
+import json
+from decimal import Decimal
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FORMATS = ('columnar', 'columns')
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime, datetime.time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Compact JSON as bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def to_columnar(rows, layout='columnar'):
+    """
+    Converts a list of dicts into {'columns': [...], 'rows': [[...], ...]}
+    ('columnar') or {'columns': [...], 'values': [[col 1 values], ...]}
+    ('columns'). Columns are the ordered union of all row keys, so rows that
+    lack a column (e.g. Dev values for 2-environment customers) get null.
+    """
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    if layout == 'columns':
+        return {'columns': columns, 'values': [[row.get(col) for row in rows] for col in columns]}
+    return {'columns': columns, 'rows': [[row.get(col) for col in columns] for row in rows]}
+
+
+def _pick_encoding(accept_encoding):
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, accept_encoding):
+    """Compresses a non-streamed response in place when the client accepts it."""
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    body = response.get_data()
+    encoding = _pick_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(body, compresslevel=6))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def json_response(payload, accept_encoding=None, status=200):
+    """dumps() the payload into a (possibly compressed) application/json response."""
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    return compress_response(response, accept_encoding)
@@ -0,0 +1,173 @@
+"""
+Batch PPT generation: every customer of a CSM (or every customer with data)
+for one month, returned as a single zip.
+
+CLI:
+    python ppt_batch.py --month 2025-06-01 [--csm "Jane Doe"] [--output decks.zip] [--workers N]
+"""
+import argparse
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from io import BytesIO
+
+from ppt_generator import build_stacked_chart_series, deck_filename, fetch_windows, render_deck
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor(max_workers=None):
+    """
+    Process pool shared by batches and background deck jobs (ppt_jobs.py);
+    workers keep the parsed template cached. max_workers only applies to the
+    first call.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers)
+        return _executor
+
+
+def reset_render_executor(broken):
+    """
+    Drops a pool that broke because a worker died (OOM, crash in a native
+    library); the next get_render_executor() starts a fresh one. A no-op if
+    another caller already replaced it.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_render(fn, *args, max_workers=None):
+    """Submits fn to the render pool; returns (pool, future) for render_result."""
+    executor = get_render_executor(max_workers)
+    try:
+        return executor, executor.submit(fn, *args)
+    except BrokenProcessPool:
+        reset_render_executor(executor)
+        executor = get_render_executor(max_workers)
+        return executor, executor.submit(fn, *args)
+
+
+def render_result(submitted, fn, *args, timeout=None):
+    """
+    Result of a submit_render(fn, *args). If the pool broke meanwhile, it is
+    replaced and fn is retried once on the new pool, so a dead worker costs
+    at most the decks it was rendering, not every later job.
+    """
+    executor, future = submitted
+    try:
+        return future.result(timeout=timeout)
+    except BrokenProcessPool:
+        reset_render_executor(executor)
+        return get_render_executor().submit(fn, *args).result(timeout=timeout)
+
+
+def fetch_batch_data(conn, month_year, csm=None):
+    """
+    Fetches config rows and month windows for all customers of csm (or all
+    customers with a row for month_year) in one set-based query.
+    Returns {short_code: (CustomerConfig, [MonthMetrics])} shaped like fetch_data().
+    """
+    if csm:
+        customer_filter = "(m.csm_primary = %(csm)s OR m.csm_lead = %(csm)s)"
+    else:
+        customer_filter = """EXISTS (
+            SELECT 1 FROM final_computed_table c
+            WHERE c.short_code = m.short_code AND c.month_year = %(end)s
+        )"""
+    windows = fetch_windows(conn, month_year, customer_filter, {'csm': csm})
+    return {sc: window for sc, window in windows.items() if window[1]}
+
+
+def _render_deck(short_code, customer_config, month_rows, month_year, charts):
+    """Worker: builds (or reuses the cached) deck and returns (filename, pptx bytes)."""
+    return deck_filename(short_code, month_year), render_deck(short_code, customer_config, month_rows, month_year, charts)
+
+
+def render_batch(batch, month_year, max_workers=None):
+    """
+    Builds the decks for a fetch_batch_data() result in a process pool and zips them.
+    The chart series of all customers are built up front from the stacked windows.
+    Returns (zip BytesIO, results) where results lists
+    {'short_code', 'success', 'file' or 'message'} per customer.
+    Customers that fail (e.g. no row for the month) are reported, not fatal.
+    """
+    results = []
+    zip_buffer = BytesIO()
+    if not batch:
+        return zip_buffer, results
+
+    charts = build_stacked_chart_series(
+        ((sc, row) for sc, (_, month_rows) in batch.items() for row in month_rows),
+        {sc: customer_config.no_of_environments for sc, (customer_config, _) in batch.items()},
+    )
+    args = {
+        sc: (sc, customer_config, month_rows, month_year, charts.get(sc))
+        for sc, (customer_config, month_rows) in batch.items()
+    }
+    futures = {sc: submit_render(_render_deck, *a, max_workers=max_workers) for sc, a in args.items()}
+
+    # Decks are already compressed OOXML packages, so store them as-is
+    with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for sc, future in futures.items():
+            try:
+                filename, content = render_result(future, _render_deck, *args[sc])
+                zf.writestr(filename, content)
+                results.append({'short_code': sc, 'success': True, 'file': filename})
+            except Exception as e:
+                results.append({'short_code': sc, 'success': False, 'message': str(e)})
+
+        failed = [r for r in results if not r['success']]
+        if failed:
+            zf.writestr('errors.txt', "\n".join(f"{r['short_code']}: {r['message']}" for r in failed))
+
+    zip_buffer.seek(0)
+    return zip_buffer, results
+
+
+def batch_filename(month_year, csm=None):
+    month_str = datetime.strptime(month_year, '%Y-%m-%d').strftime('%Y-%b')
+    scope = (csm or 'All').replace(' ', '_')
+    return f"Decks_{scope}_{month_str}.zip"
+
+
+def main():
+    from app import DB_CONFIG
+    from ops import DbOperations
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--month', required=True, help="Month as YYYY-MM-DD (first of month)")
+    parser.add_argument('--csm', help="Only customers where this CSM is primary or lead")
+    parser.add_argument('--output', help="Zip file to write (default: Decks_<csm>_<month>.zip)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    started = datetime.now()
+    db = DbOperations(DB_CONFIG)
+    with db.connection() as conn:
+        batch = fetch_batch_data(conn, args.month, args.csm)
+    # Render outside the connection block so the DB is not held during rendering
+    zip_buffer, results = render_batch(batch, args.month, args.workers)
+
+    output = args.output or batch_filename(args.month, args.csm)
+    with open(output, 'wb') as f:
+        f.write(zip_buffer.getvalue())
+
+    ok = sum(1 for r in results if r['success'])
+    print(f"{ok}/{len(results)} decks written to {output} in {(datetime.now() - started).total_seconds():.1f}s")
+    for r in results:
+        if not r['success']:
+            print(f"  {r['short_code']}: {r['message']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,14 @@
+import copy
+import hashlib
 import math
 import json
 import os
-import pandas as pd
+import threading
+from collections import namedtuple
+from itertools import groupby
+from decimal import Decimal
+from io import BytesIO
+from operator import attrgetter
 import psycopg2
 from pptx import Presentation
 from pptx.chart.data import CategoryChartData
@@ -11,9 +18,8 @@ from pptx.enum.text import PP_ALIGN
 from pptx.util import Pt, Cm
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import warnings
 
-warnings.filterwarnings("ignore", category=UserWarning, module="pandas")
+from cache import deck_cache
 
 TEMPLATE_CANDIDATES = [
     "ppt_template.pptx",
@@ -33,6 +39,42 @@ def locate_ppt_template():
     )
 
 
+# Parsed template, reused across decks. Reloaded when the file's mtime changes.
+_template_cache = {"path": None, "mtime": None, "blob": None, "prs": None}
+_template_lock = threading.Lock()
+
+
+def load_ppt_template():
+    """
+    Returns a new Presentation for one deck, cloned in memory from the cached
+    template. The template file is read and parsed only once (and again only
+    if it is replaced on disk); each call just deep-copies the parsed package.
+    """
+    with _template_lock:
+        path = _template_cache["path"]
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            path = mtime = None
+        if path is None:
+            path = locate_ppt_template()
+            mtime = os.path.getmtime(path)
+
+        if _template_cache["prs"] is None or path != _template_cache["path"] or mtime != _template_cache["mtime"]:
+            with open(path, "rb") as f:
+                blob = f.read()
+            _template_cache.update(path=path, mtime=mtime, blob=blob, prs=Presentation(BytesIO(blob)))
+
+        # The cached Presentation is never modified; every deck gets its own copy
+        return copy.deepcopy(_template_cache["prs"])
+
+
+def deck_filename(short_code, month_year):
+    """Download name for a deck, e.g. 'ABC-2025-Jun.pptx'."""
+    dt_obj = datetime.strptime(month_year, '%Y-%m-%d')
+    return f"{short_code}-{dt_obj.strftime('%Y')}-{dt_obj.strftime('%b')}.pptx"
+
+
 def safe_int(value, default=0):
     """Convert a value to int while handling None/NaN gracefully."""
     if value is None:
@@ -60,213 +102,303 @@ def get_db_connection_for_ppt(username, password):
         print(f"Error connecting to PostgreSQL: {e}")
         return None
 
-def fetch_data(conn, short_code, month_year):
-    """Fetches data from the database for a specific customer and month."""
-    
-    end_date = datetime.strptime(month_year, '%Y-%m-%d').date()
+# Columns prepare_data_dictionary actually reads (no SELECT *)
+CONFIG_COLUMNS = (
+    "short_code", "customer_name", "csm_primary", "no_of_environments", "no_of_months",
+    "indicator_color_code_rules", "circle_color_code_rules",
+    "color_map_thresholds_availability", "color_map_thresholds_users", "color_map_thresholds_storage",
+    "notes_availability", "notes_users", "notes_storage",
+)
+MONTH_COLUMNS = (
+    "month_year",
+    "updated_availability", "updated_target",
+    "updated_prod_limit", "updated_test_limit", "updated_dev_limit",
+    "updated_prod_used", "updated_test_used", "updated_dev_used",
+    "updated_prod_storage_gb", "updated_test_storage_gb", "updated_dev_storage_gb",
+    "updated_prod_target_storage_gb", "updated_test_target_storage_gb", "updated_dev_target_storage_gb",
+    "updated_tickets_opened", "updated_tickets_closed", "updated_tickets_overall_backlog",
+)
+
+CustomerConfig = namedtuple("CustomerConfig", CONFIG_COLUMNS)
+MonthMetrics = namedtuple("MonthMetrics", MONTH_COLUMNS)
+
+# One round trip: the mapping row plus its no_of_months window ending at %(end)s,
+# with the targets/limits in effect for each month; closed months come from their
+# snapshot (metric_history view). LEFT JOIN so a customer without metric rows
+# still comes back (months = []).
+WINDOW_SQL = """
+    SELECT {config_cols}, {month_cols}
+    FROM customer_mapping_table m
+    LEFT JOIN metric_history f
+        ON f.short_code = m.short_code
+        AND f.month_year <= %(end)s
+        AND f.month_year >= (%(end)s::date - (COALESCE(m.no_of_months, 6) - 1) * INTERVAL '1 month')
+    WHERE {customer_filter}
+    ORDER BY m.short_code, f.month_year
+""".format(
+    config_cols=", ".join(f"m.{c}" for c in CONFIG_COLUMNS),
+    month_cols=", ".join(f"f.{c}" for c in MONTH_COLUMNS),
+    customer_filter="{customer_filter}",
+)
+
+# Config rows frozen with a closed deck month (see DbOperations.close_month)
+SNAPSHOT_CONFIG_SQL = """
+    SELECT {config_cols}
+    FROM month_snapshots s, json_populate_record(NULL::customer_mapping_table, s.config) m
+    WHERE s.month_year = %(end)s AND s.short_code = ANY(%(codes)s)
+""".format(config_cols=", ".join(f"m.{c}" for c in CONFIG_COLUMNS))
+
+
+def _number(value):
+    """NULL -> 0 and Decimal -> float, like the old fillna(0)/coerce_float path."""
+    if value is None:
+        return 0
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def fetch_windows(conn, month_year, customer_filter, params=None):
+    """
+    Runs WINDOW_SQL for every customer matching customer_filter (SQL on alias 'm').
+    Customers whose month_year is closed get the config of its snapshot.
+    Returns {short_code: (CustomerConfig, [MonthMetrics sorted by month_year])}.
+    """
+    params = dict(params or {})
+    params["end"] = datetime.strptime(month_year, '%Y-%m-%d').date()
+    n_config = len(CONFIG_COLUMNS)
+
+    with conn.cursor() as cur:
+        cur.execute(WINDOW_SQL.format(customer_filter=customer_filter), params)
+        rows = cur.fetchall()
+        frozen = {}
+        if rows:
+            cur.execute(SNAPSHOT_CONFIG_SQL, {"end": params["end"], "codes": list({row[0] for row in rows})})
+            frozen = {row[0]: row for row in cur.fetchall()}
+
+    windows = {}
+    for row in rows:
+        sc = row[0]
+        if sc not in windows:
+            config = CustomerConfig(*frozen.get(sc, row[:n_config]))
+            config = config._replace(
+                customer_name=config.customer_name or "",
+                csm_primary=config.csm_primary or "",
+                no_of_environments=_number(config.no_of_environments),
+            )
+            windows[sc] = (config, [])
+        if row[n_config] is not None:  # month_year is NULL when the customer has no rows in range
+            month = row[n_config:]
+            windows[sc][1].append(MonthMetrics(month[0], *(_number(v) for v in month[1:])))
+    return windows
 
-    # Get the number of months for historical data from the customer_mapping_table
-    customer_mapping_sql = "SELECT no_of_months FROM customer_mapping_table WHERE short_code = %s"
-    try:
-        customer_mapping_df = pd.read_sql(customer_mapping_sql, conn, params=(short_code,))
-        if customer_mapping_df.empty:
-            no_of_months = 6
-        else:
-            val = customer_mapping_df['no_of_months'].iloc[0]
-            no_of_months = int(val) if val is not None else 6
-    except (IndexError, pd.errors.DatabaseError, ValueError) as e:
-        print(f"Could not determine number of months, defaulting to 6. Error: {e}")
-        no_of_months = 6
-
-    # Calculate the start date for fetching historical data
-    start_date = end_date - relativedelta(months=no_of_months - 1)
-    
-    # Fetch data from both tables for the specified period
-    customer_mapping_sql = "SELECT * FROM customer_mapping_table WHERE short_code = %s"
-    final_computed_sql = "SELECT * FROM final_computed_table WHERE short_code = %s AND month_year BETWEEN %s AND %s"
 
-    customer_mapping_df = pd.read_sql(customer_mapping_sql, conn, params=(short_code,))
-    final_computed_df = pd.read_sql(final_computed_sql, conn, params=(short_code, start_date, end_date))
+def fetch_data(conn, short_code, month_year):
+    """
+    Fetches data from the database for a specific customer and month.
+    Returns (CustomerConfig or None, [MonthMetrics]) in a single query.
+    """
+    windows = fetch_windows(conn, month_year, "m.short_code = %(short_code)s", {"short_code": short_code})
+    if short_code not in windows:
+        return None, []
+    return windows[short_code]
+
+
+# (label, column prefix) per environment; Dev only applies to 3-environment customers
+ENVIRONMENTS = (("Prod", "prod"), ("Test", "test"), ("Dev", "dev"))
+
+
+def _environments(env_count):
+    return ENVIRONMENTS if env_count == 3 else ENVIRONMENTS[:2]
+
+
+def _usage(used, total, ndigits=None):
+    """(used, total, free, %used, %free) with the same rounding rules for every environment."""
+    used, total = safe_int(used), safe_int(total)
+    free = total - used
+    used_percent = round((used * 100) / total, ndigits) if total else 0
+    free_percent = round((free * 100) / total, ndigits) if total else 0
+    return used, total, free, used_percent, free_percent
+
+
+def build_chart_series(month_rows, env_count):
+    """
+    Builds every chart dataset of a deck in one pass over the month window.
+
+    The window is sorted once and transposed into columns (one tuple per
+    MonthMetrics field); each series is then a single column expression.
+    The returned dicts are keyed by chart shape name and shared by slides
+    2-5 and 7, so nothing is recomputed per slide.
+    """
+    window = sorted(month_rows, key=attrgetter("month_year"))
+    return _chart_series(_transpose(window), slice(None), env_count)
+
+
+def build_stacked_chart_series(stacked_rows, env_counts):
+    """
+    build_chart_series for many customers at once (batch decks): stacked_rows
+    are (short_code, MonthMetrics) pairs in any order, env_counts maps each
+    short code to its no_of_environments. The stack is sorted and transposed
+    once; each customer's series are slices of the shared columns.
+    Returns {short_code: chart datasets}.
+    """
+    stacked = sorted(stacked_rows, key=lambda r: (r[0], r[1].month_year))
+    cols = _transpose([row for _, row in stacked])
+    charts, start = {}, 0
+    for sc, group in groupby(sc for sc, _ in stacked):
+        end = start + sum(1 for _ in group)
+        charts[sc] = _chart_series(cols, slice(start, end), env_counts[sc])
+        start = end
+    return charts
+
+
+def _transpose(window):
+    """{MonthMetrics field: tuple of values} of a sorted window, plus the 'Months' labels."""
+    cols = dict(zip(MONTH_COLUMNS, zip(*window))) if window else dict.fromkeys(MONTH_COLUMNS, ())
+    cols["Months"] = tuple(d.strftime('%b-%y') for d in cols["month_year"])
+    return cols
+
+
+def _chart_series(cols, rows, env_count):
+    """The chart datasets of the rows slice of transposed columns."""
+    months = list(cols["Months"][rows])
+
+    user_counts = {"Months": months}
+    for label, env in _environments(env_count):
+        user_counts[label] = list(cols[f"updated_{env}_used"][rows])
+    user_counts["Licenses Available"] = list(cols["updated_prod_limit"][rows])
 
-    if customer_mapping_df.empty or final_computed_df.empty:
-        # Return empty DFs rather than crashing, let app handle 404
-        return pd.DataFrame(), pd.DataFrame()
-        
-    customer_mapping_df = customer_mapping_df.fillna(0)
-    final_computed_df = final_computed_df.fillna(0)
-        
-    return customer_mapping_df, final_computed_df
+    return {
+        "Production_Availability_Chart": {
+            "Months": months,
+            "Availability": [v * 100 for v in cols["updated_availability"][rows]],
+            "SLA": [v * 100 for v in cols["updated_target"][rows]],
+        },
+        "Production_User_Counts_Chart": user_counts,
+        "Production_Storage_Usage_Chart": {
+            "Months": months,
+            "Prod (GB)": list(cols["updated_prod_storage_gb"][rows]),
+            "Contracted Maximum": list(cols["updated_prod_target_storage_gb"][rows]),
+        },
+        "Case_Trend_Chart": {
+            "Months": months,
+            "Opened": list(cols["updated_tickets_opened"][rows]),
+            "Closed": list(cols["updated_tickets_closed"][rows]),
+            "Open at EOM": list(cols["updated_tickets_overall_backlog"][rows]),
+        },
+    }
 
 
-def prepare_data_dictionary(customer_mapping_df, final_computed_df, month_year):
-    """Prepares the data in a dictionary format similar to the original JSON."""
+def prepare_data_dictionary(customer_config, month_rows, month_year, charts=None):
+    """
+    Prepares the data in a dictionary format similar to the original JSON.
+    charts: the customer's build_stacked_chart_series entry, if already built.
+    """
     
     # Filter data for the specified month
     current_month_date = datetime.strptime(month_year, '%Y-%m-%d').date()
-    current_customer_df = customer_mapping_df
-    current_computed_df = final_computed_df[final_computed_df['month_year'] == current_month_date]
+    rows_by_month = {r.month_year: r for r in month_rows}
+    current_computed_data = rows_by_month.get(current_month_date)
 
-    if current_customer_df.empty or current_computed_df.empty:
+    if customer_config is None or current_computed_data is None:
         raise ValueError(f"Data for the current month ({month_year}) is missing.")
-    current_customer_data, current_computed_data = current_customer_df.iloc[0], current_computed_df.iloc[0]
+    current_customer_data = customer_config
+    env_count = current_customer_data.no_of_environments
 
     # --- Global Data ---
-    indicator_colors = current_customer_data['indicator_color_code_rules']
-    circle_colors = current_customer_data['circle_color_code_rules']
+    indicator_colors = current_customer_data.indicator_color_code_rules
+    circle_colors = current_customer_data.circle_color_code_rules
+    if charts is None:
+        charts = build_chart_series(month_rows, env_count)
 
     # --- Slide 1 Data ---
     slide1_data = {
-        "Customer_Name": current_customer_data['customer_name'],
-        "Month": datetime.strptime(month_year, '%Y-%m-%d').strftime('%B %Y'),
-        "CSM_Name": current_customer_data['csm_primary']
+        "Customer_Name": current_customer_data.customer_name,
+        "Month": current_month_date.strftime('%B %Y'),
+        "CSM_Name": current_customer_data.csm_primary
     }
 
     # --- Slide 2 Data ---
-    availability_chart_data = {
-        "Months": [d.strftime('%b-%y') for d in sorted(final_computed_df['month_year'].unique())],
-        "Availability": [val * 100 for val in final_computed_df.sort_values(by='month_year')['updated_availability']],
-        "SLA": [val * 100 for val in final_computed_df.sort_values(by='month_year')['updated_target']]
-    }
-    
     slide2_data = {
-        "Colour_Rules": current_customer_data['color_map_thresholds_availability'],
+        "Colour_Rules": current_customer_data.color_map_thresholds_availability,
         "Indicator": indicator_colors,
         "Circle_Color": circle_colors,
-        "Actual_Value": f"{current_computed_data['updated_availability'] * 100:.2f}%",
-        "Target_Value": f"{current_computed_data['updated_target'] * 100:.2f}%",
-        "Production_Availability_Chart": availability_chart_data,
-        "Notes_User_Input": current_customer_data['notes_availability']
+        "Actual_Value": f"{current_computed_data.updated_availability * 100:.2f}%",
+        "Target_Value": f"{current_computed_data.updated_target * 100:.2f}%",
+        "Production_Availability_Chart": charts["Production_Availability_Chart"],
+        "Notes_User_Input": current_customer_data.notes_availability
     }
     
     # --- Slide 3 Data ---
-    prod_licenses = safe_int(current_computed_data['updated_prod_limit'])
-    prod_used = safe_int(current_computed_data['updated_prod_used'])
-    prod_remaining = prod_licenses - prod_used
-    prod_used_percent = round((prod_used * 100) / prod_licenses) if prod_licenses else 0
-
-    test_licenses = safe_int(current_computed_data['updated_test_limit'])
-    test_used = safe_int(current_computed_data['updated_test_used'])
-    test_remaining = test_licenses - test_used
-    test_used_percent = round((test_used * 100) / test_licenses) if test_licenses else 0
-
-    user_license_rows = [
-        ["Prod", prod_licenses, prod_used, prod_remaining, prod_used_percent],
-        ["Test", test_licenses, test_used, test_remaining, test_used_percent],
-    ]
+    user_license_rows = []
+    for label, env in _environments(env_count):
+        used, licenses, remaining, used_percent, _ = _usage(
+            getattr(current_computed_data, f"updated_{env}_used"),
+            getattr(current_computed_data, f"updated_{env}_limit"),
+        )
+        user_license_rows.append([label, licenses, used, remaining, used_percent])
 
-    if current_customer_data['no_of_environments'] == 3:
-        dev_licenses = safe_int(current_computed_data['updated_dev_limit'])
-        dev_used = safe_int(current_computed_data['updated_dev_used'])
-        dev_remaining = dev_licenses - dev_used
-        dev_used_percent = round((dev_used * 100) / dev_licenses) if dev_licenses else 0
-        user_license_rows.append(["Dev", dev_licenses, dev_used, dev_remaining, dev_used_percent])
-
-    user_counts_chart_data = {
-        "Months": [d.strftime('%b-%y') for d in sorted(final_computed_df['month_year'].unique())],
-        "Prod": list(final_computed_df.sort_values(by='month_year')['updated_prod_used']),
-        "Test": list(final_computed_df.sort_values(by='month_year')['updated_test_used']),
-    }
-    
-    if current_customer_data['no_of_environments'] == 3:
-        user_counts_chart_data["Dev"] = list(final_computed_df.sort_values(by='month_year')['updated_dev_used'])
-    
-    user_counts_chart_data["Licenses Available"] = list(final_computed_df.sort_values(by='month_year')['updated_prod_limit'])
-    
     slide3_data = {
         "User_License_Utilization_Table": {
             "headers": ["", "Licenses", "Count", "Remaining", "%Used"],
             "rows": user_license_rows
         },
-        "Colour_Rules": current_customer_data['color_map_thresholds_users'],
+        "Colour_Rules": current_customer_data.color_map_thresholds_users,
         "Indicator": indicator_colors,
         "Circle_Color": circle_colors,
-        "Production_User_Counts_Chart": user_counts_chart_data,
-        "Notes_User_Input": current_customer_data['notes_users'],
-        "env_count": current_customer_data['no_of_environments']
+        "Production_User_Counts_Chart": charts["Production_User_Counts_Chart"],
+        "Notes_User_Input": current_customer_data.notes_users,
+        "env_count": env_count
     }
 
     # --- Slide 4 Data ---
-    prod_storage_used = safe_int(current_computed_data['updated_prod_storage_gb'])
-    prod_storage_contract = safe_int(current_computed_data['updated_prod_target_storage_gb'])
-    prod_storage_free = prod_storage_contract - prod_storage_used
-    prod_storage_used_percent = round((prod_storage_used * 100) / prod_storage_contract, 1) if prod_storage_contract else 0
-    prod_storage_free_percent = round((prod_storage_free * 100) / prod_storage_contract, 1) if prod_storage_contract else 0
-
-    test_storage_used = safe_int(current_computed_data['updated_test_storage_gb'])
-    test_storage_contract = safe_int(current_computed_data['updated_test_target_storage_gb'])
-    test_storage_free = test_storage_contract - test_storage_used
-    test_storage_used_percent = round((test_storage_used * 100) / test_storage_contract, 1) if test_storage_contract else 0
-    test_storage_free_percent = round((test_storage_free * 100) / test_storage_contract, 1) if test_storage_contract else 0
-    
-    storage_utilization_rows = [
-        ["Prod(GB)", prod_storage_used, prod_storage_contract, prod_storage_free, prod_storage_used_percent, prod_storage_free_percent],
-        ["Test(GB)", test_storage_used, test_storage_contract, test_storage_free, test_storage_used_percent, test_storage_free_percent],
-    ]
-
-    if current_customer_data['no_of_environments'] == 3:
-        dev_storage_used = safe_int(current_computed_data['updated_dev_storage_gb'])
-        dev_storage_contract = safe_int(current_computed_data['updated_dev_target_storage_gb'])
-        dev_storage_free = dev_storage_contract - dev_storage_used
-        dev_storage_used_percent = round((dev_storage_used * 100) / dev_storage_contract, 1) if dev_storage_contract else 0
-        dev_storage_free_percent = round((dev_storage_free * 100) / dev_storage_contract, 1) if dev_storage_contract else 0
-        storage_utilization_rows.append(["Dev(GB)", dev_storage_used, dev_storage_contract, dev_storage_free, dev_storage_used_percent, dev_storage_free_percent])
-
-    storage_usage_chart_data = {
-        "Months": [d.strftime('%b-%y') for d in sorted(final_computed_df['month_year'].unique())],
-        "Prod (GB)": list(final_computed_df.sort_values(by='month_year')['updated_prod_storage_gb']),
-        "Contracted Maximum": list(final_computed_df.sort_values(by='month_year')['updated_prod_target_storage_gb']),
-    }
+    storage_utilization_rows = []
+    for label, env in _environments(env_count):
+        usage = _usage(
+            getattr(current_computed_data, f"updated_{env}_storage_gb"),
+            getattr(current_computed_data, f"updated_{env}_target_storage_gb"),
+            ndigits=1,
+        )
+        storage_utilization_rows.append([f"{label}(GB)", *usage])
 
     slide4_data = {
         "Storage_Utilization_Table": {
             "headers": ["", "Used", "Contract", "Free", "%Used", "%Free"],
             "rows": storage_utilization_rows
         },
-        "Colour_Rules": current_customer_data['color_map_thresholds_storage'],
+        "Colour_Rules": current_customer_data.color_map_thresholds_storage,
         "Indicator": indicator_colors,
         "Circle_Color": circle_colors,
-        "Production_Storage_Usage_Chart": storage_usage_chart_data,
-        "Notes_User_Input": current_customer_data['notes_storage']
+        "Production_Storage_Usage_Chart": charts["Production_Storage_Usage_Chart"],
+        "Notes_User_Input": current_customer_data.notes_storage
     }
     
     # --- Slide 5 Data ---
-    from dateutil.relativedelta import relativedelta
-
-    current_month = current_computed_data['month_year']
-    previous_month = current_month - relativedelta(months=1)
-
     # Get the backlog of the previous month (if it exists)
-    prev_row = final_computed_df[final_computed_df['month_year'] == previous_month]
+    prev_row = rows_by_month.get(current_month_date - relativedelta(months=1))
 
-    backlog_active_prev = prev_row['updated_tickets_overall_backlog'].iloc[0] if not prev_row.empty else 0
+    backlog_active_prev = prev_row.updated_tickets_overall_backlog if prev_row else 0
     case_status_rows = [
         ["Backlog (Active previous months)", backlog_active_prev],
-        ["Opened this month", current_computed_data['updated_tickets_opened']],
-        ["Closed this month", current_computed_data['updated_tickets_closed']],
-        ["In progress at end of month", current_computed_data['updated_tickets_overall_backlog']]
+        ["Opened this month", current_computed_data.updated_tickets_opened],
+        ["Closed this month", current_computed_data.updated_tickets_closed],
+        ["In progress at end of month", current_computed_data.updated_tickets_overall_backlog]
     ]
     
-    case_trend_chart_data = {
-        "Months": [d.strftime('%b-%y') for d in sorted(final_computed_df['month_year'].unique())],
-        "Opened": list(final_computed_df.sort_values(by='month_year')['updated_tickets_opened']),
-        "Closed": list(final_computed_df.sort_values(by='month_year')['updated_tickets_closed']),
-        "Open at EOM": list(final_computed_df.sort_values(by='month_year')['updated_tickets_overall_backlog'])
-    }
-    
     slide5_data = {
         "Case_Status_Table": {
             "headers": ["Status", "Cases"],
             "rows": case_status_rows,
         },
-        "Case_Trend_Chart": case_trend_chart_data,
-        "Open_Cases_Value": current_computed_data['updated_tickets_overall_backlog']
+        "Case_Trend_Chart": charts["Case_Trend_Chart"],
+        "Open_Cases_Value": current_computed_data.updated_tickets_overall_backlog
     }
     
     # --- Slide 7 Data ---
     slide7_data = {
-        "Production_User_Counts_Chart": user_counts_chart_data,
-        "Production_Availability_Chart": availability_chart_data,
-        "Production_Storage_Usage_Chart": storage_usage_chart_data
+        "Production_User_Counts_Chart": charts["Production_User_Counts_Chart"],
+        "Production_Availability_Chart": charts["Production_Availability_Chart"],
+        "Production_Storage_Usage_Chart": charts["Production_Storage_Usage_Chart"]
     }
 
     return {
@@ -286,561 +418,385 @@ def delete_table_row(table, row_idx: int):
     tbl.remove(tr)
 
 
-def generate_presentation(data, output_filename):
-    """Generates the PowerPoint presentation with the provided data."""
-    template_path = locate_ppt_template()
-    prs = Presentation(template_path)
-    
-    # ---Slide 1---
-    slide1_data = data["slide1"]
-    slide = prs.slides[0]
-    for shape in slide.shapes:
-        if shape.name == "Customer_Name" and shape.has_text_frame:
-            p = shape.text_frame.paragraphs[0]
-            p.text = slide1_data["Customer_Name"]
-            if not p.runs: p.add_run()
-            run = p.runs[0]
-            font = run.font
-            font.size = Pt(40)
-            font.color.rgb = RGBColor(255, 255, 255)
-        elif shape.name == "Month" and shape.has_text_frame:
-            p = shape.text_frame.paragraphs[0]
-            p.text = slide1_data["Month"]
-            if not p.runs: p.add_run()
-            run = p.runs[0]
-            font = run.font
-            font.size = Pt(18)
-            font.color.rgb = RGBColor(255, 255, 255)
-        elif shape.name == "CSM_Name" and shape.has_text_frame:
-            p = shape.text_frame.paragraphs[0]
-            p.text = slide1_data["CSM_Name"]
-            if not p.runs: p.add_run()
-            run = p.runs[0]
-            font = run.font
-            font.size = Pt(18)
-            font.color.rgb = RGBColor(255, 255, 255)
-
-    # ---Slide 2---
-    slide2_data = data["slide2"]
-    slide = prs.slides[1]
-    color_rules = slide2_data["Colour_Rules"]
-    circle_colors = slide2_data["Circle_Color"]
-    indicator_colors = slide2_data["Indicator"]
-    actual_val = float(slide2_data["Actual_Value"].replace('%', ''))
-    
-    if actual_val >= color_rules["Color1"]:
-        color_key = "Color1"
-    elif actual_val >= color_rules["Color2"]:
-        color_key = "Color2"
-    elif actual_val >= color_rules["Color3"]:
-        color_key = "Color3"
+# --- Template bindings ---
+# Every slide is described by a dict {shape name: Binding}. A Binding says which
+# kind of shape it needs (has_text_frame / has_table / has_chart, or None), which
+# key of the slide context holds its value and which renderer fills it in.
+# The slide context is the slide's data dict plus values derived once per slide
+# (colour key, fill colours, shapes to hide) and deck-wide state (env_count,
+# the shared chart data cache).
+
+WHITE = RGBColor(255, 255, 255)
+BLACK = RGBColor(0, 0, 0)
+
+Binding = namedtuple("Binding", "requires key render")
+
+
+class SharedChartData(CategoryChartData):
+    """CategoryChartData whose embedded workbook is written once, however many charts use it."""
+    _xlsx_blob = None
+
+    @property
+    def xlsx_blob(self):
+        if self._xlsx_blob is None:
+            self._xlsx_blob = super().xlsx_blob
+        return self._xlsx_blob
+
+
+def _chart_data(ctx, series, scale=None):
+    """
+    Chart data for a series dict, built once per deck. The dicts from
+    build_chart_series are shared between slides, so e.g. the availability
+    chart on slides 2 and 7 reuses one workbook blob.
+    """
+    cache = ctx["chart_data"]
+    chart_data = cache.get(id(series))
+    if chart_data is None:
+        chart_data = SharedChartData()
+        chart_data.categories = series["Months"]
+        for series_name, values in series.items():
+            if series_name != "Months":
+                chart_data.add_series(series_name, [v / scale for v in values] if scale else values)
+        cache[id(series)] = chart_data
+    return chart_data
+
+
+# --- Renderers: render(shape, value, ctx) ---
+
+def styled_text(size, color):
+    """First paragraph text with an explicit font size and colour."""
+    def render(shape, value, ctx):
+        p = shape.text_frame.paragraphs[0]
+        p.text = str(value)
+        if not p.runs: p.add_run()
+        font = p.runs[0].font
+        font.size = Pt(size)
+        font.color.rgb = color
+    return render
+
+
+def render_text(shape, value, ctx):
+    shape.text_frame.text = value
+
+
+def render_solid_fill(shape, rgb, ctx):
+    fill = shape.fill
+    fill.solid()
+    fill.fore_color.rgb = RGBColor(*rgb)
+
+
+def render_gradient(shape, rgb, ctx):
+    fill = shape.fill
+    if fill.type == 3:
+        stops = fill.gradient_stops
+        if len(stops) >= 2:
+            stops[0].color.rgb = RGBColor(*rgb)
+            stops[1].color.rgb = WHITE
+
+
+def render_notes(shape, notes_data, ctx):
+    """Writes the note matching the slide's colour key, one paragraph per line."""
+    if isinstance(notes_data, dict):
+        note_map = {
+            "Color1": notes_data.get("color1") or notes_data.get("Color1") or "",
+            "Color2": notes_data.get("color2") or notes_data.get("Color2") or "",
+            "Color3": notes_data.get("color3") or notes_data.get("Color3") or "",
+            "Invalid": notes_data.get("invalid") or notes_data.get("Invalid") or ""
+        }
     else:
-        color_key = "Invalid"
-    circle_rgb = circle_colors[color_key]
-    indicator_rgb = indicator_colors[color_key]
+        note_map = {"Color1":"","Color2":"","Color3":"","Invalid":""}
+
+    note_value = (note_map.get(ctx["color_key"]) or "").strip()
+    if note_value:
+        note_value = note_value.replace("\\n", "\n")
+        lines = [line.strip() for line in note_value.split("\n") if line.strip()]
+        shape.text_frame.text = ""
+        shape.text_frame.word_wrap = True
+        for i, line in enumerate(lines):
+            p = shape.text_frame.paragraphs[0] if i == 0 else shape.text_frame.add_paragraph()
+            p.text = line
+            if not p.runs: p.add_run()
+            font = p.runs[0].font
+            font.size = Pt(16)
+            font.color.rgb = BLACK
+
+
+def render_prod_test_height(shape, env_count, ctx):
+    shape.height = Cm(3.42 if env_count >= 3 else 2.22)
+
+
+def table_renderer(format_cell, header_alignment=None, alignment=None, trim=False):
+    """
+    Fills a {"headers", "rows"} table: bold 12pt headers, 12pt body cells
+    formatted by format_cell(col_idx, row_data, cell_data). With trim, template
+    rows beyond the data are deleted.
+    """
+    def render(shape, table_data, ctx):
+        table = shape.table
+        rows = table_data["rows"]
+        for col_idx, header in enumerate(table_data["headers"]):
+            cell = table.cell(0, col_idx)
+            cell.text = str(header)
+            p = cell.text_frame.paragraphs[0]
+            p.font.size = Pt(12)
+            p.font.bold = True
+            if header_alignment is not None:
+                p.alignment = header_alignment
+
+        for row_idx, row_data in enumerate(rows, start=1):
+            for col_idx, cell_data in enumerate(row_data):
+                cell = table.cell(row_idx, col_idx)
+                cell.text = format_cell(col_idx, row_data, cell_data)
+                p = cell.text_frame.paragraphs[0]
+                p.font.size = Pt(12)
+                if alignment is not None:
+                    p.alignment = alignment
 
-    for shape in slide.shapes:
-        if shape.name == "Target_Value" and shape.has_text_frame:
-            shape.text_frame.text = slide2_data["Target_Value"]
-        elif shape.name == "Actual_Value" and shape.has_text_frame:
-            shape.text_frame.text = slide2_data["Actual_Value"]
-        elif shape.name == "Circle_Color":
-            fill = shape.fill
-            fill.solid()
-            fill.fore_color.rgb = RGBColor(*circle_rgb)
-        elif shape.name == "Indicator":
-            fill = shape.fill
-            if fill.type == 3:
-                stops = fill.gradient_stops
-                if len(stops) >= 2:
-                    stops[0].color.rgb = RGBColor(*indicator_rgb)
-                    stops[1].color.rgb = RGBColor(255, 255, 255)
-        elif shape.name == "Production_Availability_Chart" and shape.has_chart:
-            chart = shape.chart
-            availability = [val / 100 for val in slide2_data["Production_Availability_Chart"]["Availability"]]
-            sla = [val / 100 for val in slide2_data["Production_Availability_Chart"]["SLA"]]
-            chart_data = CategoryChartData()
-            chart_data.categories = slide2_data["Production_Availability_Chart"]["Months"]
-            chart_data.add_series("Availability", availability)
-            chart_data.add_series("SLA", sla)
-            chart.replace_data(chart_data)
-            
-            value_axis = chart.value_axis
-            value_axis.minimum_scale = 0.93
-            value_axis.maximum_scale = 1.0
-            value_axis.tick_labels.number_format = '0.00%'
-
-            for series in chart.series:
-                if series.name == "Availability":
-                    series.has_data_labels = True
-                    series.data_labels.number_format = '0.00%'
-                    series.data_labels.show_value = True
-                else:
-                    series.has_data_labels = False
-        elif shape.name == "Notes_User_Input" and shape.has_text_frame:
-            notes_data = slide2_data.get("Notes_User_Input")
-            if isinstance(notes_data, dict):
-                note_map = {
-                    "Color1": notes_data.get("color1") or notes_data.get("Color1") or "",
-                    "Color2": notes_data.get("color2") or notes_data.get("Color2") or "",
-                    "Color3": notes_data.get("color3") or notes_data.get("Color3") or "",
-                    "Invalid": notes_data.get("invalid") or notes_data.get("Invalid") or ""
-                }
-            else:
-                note_map = {"Color1":"","Color2":"","Color3":"","Invalid":""}
-
-            note_value = (note_map.get(color_key) or "").strip()
-            if note_value:
-                note_value = note_value.replace("\\n", "\n")
-                lines = [line.strip() for line in note_value.split("\n") if line.strip()]
-                shape.text_frame.text = ""
-                shape.text_frame.word_wrap = True
-                for i, line in enumerate(lines):
-                    p = shape.text_frame.paragraphs[0] if i == 0 else shape.text_frame.add_paragraph()
-                    p.text = line
-                    if not p.runs: p.add_run()
-                    run = p.runs[0]
-                    font = run.font
-                    font.size = Pt(16)
-                    font.color.rgb = RGBColor(0, 0, 0)
-
-
-    # ---Slide 3---
-    slide3_data = data["slide3"]
-    slide = prs.slides[2]
-    env_count = slide3_data.get("env_count")
-    headers = slide3_data["User_License_Utilization_Table"]["headers"]
-    rows = slide3_data["User_License_Utilization_Table"]["rows"]
-    used_val = float(rows[0][4])
-    used_test = float(rows[1][4])
-    
-    rules = slide3_data["Colour_Rules"]
-    
-    # Color logic DEPENDS ONLY ON PROD (used_val) as requested
-    if used_val >= rules["Color3"]:
-        color_key = "Color3"
-    elif used_val >= rules["Color2"]:
-        color_key = "Color2"
-    elif used_val >= rules["Color1"]:
-        color_key = "Color1"
-    else:
-        color_key = "Invalid"
-        
-    circle_rgb = slide3_data["Circle_Color"][color_key]
-    indicator_rgb = slide3_data["Indicator"][color_key]
-
-    is_prod_red = used_val >= rules["Color3"]
-    is_test_red = used_test >= rules["Color3"]
-    is_dev_red = False
-    
-    if env_count == 3:
-        try:
-            used_dev = float(rows[2][4])
-            is_dev_red = used_dev >= rules["Color3"]
-        except IndexError:
-            is_dev_red = False
+        if trim:
+            for _ in range(len(table.rows) - 1 - len(rows)):
+                delete_table_row(table, len(table.rows) - 1)
+    return render
 
-    shapes_to_remove = []
 
-    for shape in slide.shapes:
-        if shape.name == "User_License_Utilization_Table" and shape.has_table:
-            table = shape.table
+def _license_cell(col_idx, row_data, cell_data):
+    return f"{cell_data}%" if col_idx == len(row_data) - 1 else str(cell_data)
 
-            for col_idx, header in enumerate(headers):
-                cell = table.cell(0, col_idx)
-                cell.text = str(header)
-                p = cell.text_frame.paragraphs[0]
-                p.font.size = Pt(12)
-                p.font.bold = True
-                p.alignment = PP_ALIGN.CENTER
-            
-            for row_idx, row_data in enumerate(rows, start = 1):
-                for col_idx, cell_data in enumerate(row_data):
-                    cell = table.cell(row_idx, col_idx)
-                    if col_idx == len(row_data) - 1:
-                        cell.text = f"{cell_data}%"
-                    else:
-                        cell.text = str(cell_data)
-                    p = cell.text_frame.paragraphs[0]
-                    p.font.size = Pt(12)
-                    p.alignment = PP_ALIGN.RIGHT
-            
-            total_rows_in_table = len(table.rows)
-            needed_data_rows = len(rows)
-            rows_to_delete = total_rows_in_table - 1 - needed_data_rows
-            if rows_to_delete > 0:
-                for _ in range(rows_to_delete):
-                    delete_table_row(table, len(table.rows) - 1)
-        
-        elif shape.name == "Production_User_Counts_Chart" and shape.has_chart:
-            chart = shape.chart
-            chart_data = CategoryChartData()
-            chart_data.categories = slide3_data["Production_User_Counts_Chart"]["Months"]
-            if env_count == 2:
-                plot = chart.plots[0]
-                series_list = list(plot.series)
-                for idx, s in enumerate(series_list):
-                    if s.name == "Dev":
-                        try:
-                            ser_element = plot._element.findall('.//{http://schemas.openxmlformats.org/drawingml/2006/chart}ser')[idx]
-                            plot._element.remove(ser_element)
-                        except (IndexError, ValueError):
-                            pass
-                        break
-            
-            chart_data.categories = slide3_data["Production_User_Counts_Chart"]["Months"]
-            
-            for series_name, values in slide3_data["Production_User_Counts_Chart"].items():
-                if series_name != "Months":
-                    chart_data.add_series(series_name, values)
-            chart.replace_data(chart_data)
-        
-        elif shape.name == "Circle_Color":
-            fill = shape.fill
-            fill.solid()
-            fill.fore_color.rgb = RGBColor(*circle_rgb)
-
-        elif shape.name == "Indicator":
-            fill = shape.fill
-            if fill.type == 3:
-                stops = fill.gradient_stops
-                if len(stops) >= 2:
-                    stops[0].color.rgb = RGBColor(*indicator_rgb)
-                    stops[1].color.rgb = RGBColor(255, 255, 255)
-
-        elif shape.name == "Notes_User_Input" and shape.has_text_frame:
-            notes_data = slide3_data.get("Notes_User_Input")
-            if isinstance(notes_data, dict):
-                note_map = {
-                    "Color1": notes_data.get("color1") or notes_data.get("Color1") or "",
-                    "Color2": notes_data.get("color2") or notes_data.get("Color2") or "",
-                    "Color3": notes_data.get("color3") or notes_data.get("Color3") or "",
-                    "Invalid": notes_data.get("invalid") or notes_data.get("Invalid") or ""
-                }
-            else:
-                note_map = {"Color1":"","Color2":"","Color3":"","Invalid":""}
-
-            note_value = (note_map.get(color_key) or "").strip()
-            if note_value:
-                note_value = note_value.replace("\\n", "\n")
-                lines = [line.strip() for line in note_value.split("\n") if line.strip()]
-                shape.text_frame.text = ""
-                shape.text_frame.word_wrap = True
-                for i, line in enumerate(lines):
-                    p = shape.text_frame.paragraphs[0] if i == 0 else shape.text_frame.add_paragraph()
-                    p.text = line
-                    if not p.runs: p.add_run()
-                    run = p.runs[0]
-                    font = run.font
-                    font.size = Pt(16)
-                    font.color.rgb = RGBColor(0, 0, 0)
-
-        elif shape.name == "Prod_Test" and shape.has_text_frame:
-            shape.height = Cm(3.42 if env_count >= 3 else 2.22)
-
-        elif shape.name == "Dev_Value":
-            if env_count < 3:
-                shapes_to_remove.append(shape)
-        
-        elif shape.name == "Dev_Value_Cross":
-            if env_count < 3:
-                shapes_to_remove.append(shape)
-        
-        elif shape.name == "Dev_Text" and env_count == 2:
-            shapes_to_remove.append(shape)
 
-        # --- Logic for Prod Tick/Cross ---
-        if shape.name == "Prod_Value" and is_prod_red:
-            shapes_to_remove.append(shape)
-        if shape.name == "Prod_Value_Cross" and not is_prod_red:
-            shapes_to_remove.append(shape)
+def _storage_cell(col_idx, row_data, cell_data):
+    is_percent_col = col_idx in [len(row_data) - 1, len(row_data) - 2]
+    if isinstance(cell_data, (int, float)) and is_percent_col:
+        return f"{cell_data:.1f}%"
+    if isinstance(cell_data, (int, float)):
+        return f"{cell_data:,}"
+    return str(cell_data)
 
-        # --- Logic for Test Tick/Cross ---
-        if shape.name == "Test_Value" and is_test_red:
-            shapes_to_remove.append(shape)
-        if shape.name == "Test_Value_Cross" and not is_test_red:
-            shapes_to_remove.append(shape)
 
-        # --- Logic for Dev Tick/Cross ---
-        if env_count == 3:
-            if shape.name == "Dev_Value" and is_dev_red:
-                shapes_to_remove.append(shape)
-            if shape.name == "Dev_Value_Cross" and not is_dev_red:
-                shapes_to_remove.append(shape)
+def _plain_cell(col_idx, row_data, cell_data):
+    return str(cell_data)
 
-    for sh in shapes_to_remove:
-        try:
-            slide.shapes._spTree.remove(sh._element)
-        except Exception:
-            pass
-    shapes_to_remove.clear()
-
-    # ---Slide 4---
-    slide4_data = data["slide4"]
-    slide = prs.slides[3]
-    headers = slide4_data["Storage_Utilization_Table"]["headers"]
-    rows = slide4_data["Storage_Utilization_Table"]["rows"]
-    used_val = float(rows[0][4])
-    used_test = float(rows[1][4])
-    rules = slide4_data["Colour_Rules"]
-    
-    # Color logic DEPENDS ONLY ON PROD (used_val) as requested
-    if used_val >= rules["Color3"]:
-        color_key = "Color3"
-    elif used_val >= rules["Color2"]:
-        color_key = "Color2"
-    elif used_val >= rules["Color1"]:
-        color_key = "Color1"
-    else:
-        color_key = "Invalid"
-        
-    circle_rgb = slide4_data["Circle_Color"][color_key]
-    indicator_rgb = slide4_data["Indicator"][color_key]
-
-    is_prod_red = used_val >= rules["Color3"]
-    is_test_red = used_test >= rules["Color3"]
-    is_dev_red = False
-    if env_count == 3:
-        try:
-            used_dev = float(rows[2][4])
-            is_dev_red = used_dev >= rules["Color3"]
-        except IndexError:
-            is_dev_red = False
 
-    shapes_to_remove = []
+def render_chart(shape, series, ctx):
+    shape.chart.replace_data(_chart_data(ctx, series))
 
 
-    for shape in slide.shapes:
-        if shape.name == "Storage_Utilization_Table" and shape.has_table:
-            table = shape.table
+def render_availability_chart(shape, series, ctx):
+    chart = shape.chart
+    chart.replace_data(_chart_data(ctx, series, scale=100))
 
-            for col_idx, header in enumerate(headers):
-                cell = table.cell(0, col_idx)
-                cell.text = str(header)
-                p = cell.text_frame.paragraphs[0]
-                p.font.size = Pt(12)
-                p.font.bold = True
-                p.alignment = PP_ALIGN.CENTER
-            
-            for row_idx, row_data in enumerate(rows):
-                for col_idx, cell_data in enumerate(row_data):
-                    cell = table.cell(row_idx + 1, col_idx)
-                    is_percent_col = col_idx in [len(row_data) - 1, len(row_data) - 2]
-                    if isinstance(cell_data, (int, float)) and is_percent_col:
-                         cell.text = f"{cell_data:.1f}%"
-                    elif isinstance(cell_data, (int, float)):
-                        cell.text = f"{cell_data:,}"
-                    else:
-                        cell.text = str(cell_data)
-                    p = cell.text_frame.paragraphs[0]
-                    p.font.size = Pt(12)
-                    p.alignment = PP_ALIGN.RIGHT
-            
-            total_rows_in_table = len(table.rows)
-            needed_data_rows = len(rows)
-            rows_to_delete = total_rows_in_table - 1 - needed_data_rows
-            if rows_to_delete > 0:
-                for _ in range(rows_to_delete):
-                    delete_table_row(table, len(table.rows) - 1)
-        
-        elif shape.name == "Production_Storage_Usage_Chart" and shape.has_chart:
-            chart = shape.chart
-            chart.value_axis.tick_label_position = XL_TICK_LABEL_POSITION.LOW
-            chart_data = CategoryChartData()
-            chart_data.categories = slide4_data["Production_Storage_Usage_Chart"]["Months"]
-            for series_name, values in slide4_data["Production_Storage_Usage_Chart"].items():
-                if series_name != "Months":
-                    chart_data.add_series(series_name, values)
-            chart.replace_data(chart_data)
-        
-            for s in chart.plots[0].series:
-                if s.name == "Prod (GB)":
-                    s.data_labels.number_format = '#,##0'
-                    break
-        
-        elif shape.name == "Circle_Color":
-            fill = shape.fill
-            fill.solid()
-            fill.fore_color.rgb = RGBColor(*circle_rgb)
-        
-        elif shape.name == "Indicator":
-            fill = shape.fill
-            if fill.type == 3:
-                stops = fill.gradient_stops
-                if len(stops) >= 2:
-                    stops[0].color.rgb = RGBColor(*indicator_rgb)
-                    stops[1].color.rgb = RGBColor(255, 255, 255)
-        
-        elif shape.name == "Notes_User_Input" and shape.has_text_frame:
-            notes_data = slide4_data.get("Notes_User_Input")
-            if isinstance(notes_data, dict):
-                note_map = {
-                    "Color1": notes_data.get("color1") or notes_data.get("Color1") or "",
-                    "Color2": notes_data.get("color2") or notes_data.get("Color2") or "",
-                    "Color3": notes_data.get("color3") or notes_data.get("Color3") or "",
-                    "Invalid": notes_data.get("invalid") or notes_data.get("Invalid") or ""
-                }
-            else:
-                note_map = {"Color1":"","Color2":"","Color3":"","Invalid":""}
-
-            note_value = (note_map.get(color_key) or "").strip()
-            if note_value:
-                note_value = note_value.replace("\\n", "\n")
-                lines = [line.strip() for line in note_value.split("\n") if line.strip()]
-                shape.text_frame.text = ""
-                shape.text_frame.word_wrap = True
-                for i, line in enumerate(lines):
-                    p = shape.text_frame.paragraphs[0] if i == 0 else shape.text_frame.add_paragraph()
-                    p.text = line
-                    if not p.runs: p.add_run()
-                    run = p.runs[0]
-                    font = run.font
-                    font.size = Pt(16)
-                    font.color.rgb = RGBColor(0, 0, 0)
-
-        elif shape.name == "Prod_Test" and shape.has_text_frame:
-            shape.height = Cm(3.42 if env_count >= 3 else 2.22)
-       
-        elif shape.name == "Dev_Value":
-            if env_count < 3:
-                shapes_to_remove.append(shape)
-       
-        elif shape.name == "Dev_Value_Cross":
-            if env_count < 3:
-                shapes_to_remove.append(shape)
-
-        elif shape.name == "Dev_Text" and env_count == 2:
-            shapes_to_remove.append(shape)
+    value_axis = chart.value_axis
+    value_axis.minimum_scale = 0.93
+    value_axis.maximum_scale = 1.0
+    value_axis.tick_labels.number_format = '0.00%'
+
+    for s in chart.series:
+        if s.name == "Availability":
+            s.has_data_labels = True
+            s.data_labels.number_format = '0.00%'
+            s.data_labels.show_value = True
+        else:
+            s.has_data_labels = False
+
+
+def render_user_counts_chart(shape, series, ctx):
+    chart = shape.chart
+    if ctx["env_count"] == 2:
+        # The template has a Dev series; drop it so it does not linger empty
+        plot = chart.plots[0]
+        for s in plot.series:
+            if s.name == "Dev":
+                plot._element.remove(s._element)
+                break
+    chart.replace_data(_chart_data(ctx, series))
+
+
+def render_storage_chart(shape, series, ctx):
+    chart = shape.chart
+    chart.value_axis.tick_label_position = XL_TICK_LABEL_POSITION.LOW
+    chart.replace_data(_chart_data(ctx, series))
+    for s in chart.plots[0].series:
+        if s.name == "Prod (GB)":
+            s.data_labels.number_format = '#,##0'
+            break
+
+
+# --- Derived slide context ---
+
+def _status_colors(slide_data, color_key):
+    return {
+        "color_key": color_key,
+        "circle_rgb": slide_data["Circle_Color"][color_key],
+        "indicator_rgb": slide_data["Indicator"][color_key],
+    }
+
+
+def availability_status(slide_data, env_count):
+    """Higher is better: the first of Color1..Color3 whose threshold is met."""
+    actual_val = float(slide_data["Actual_Value"].replace('%', ''))
+    rules = slide_data["Colour_Rules"]
+    color_key = next((k for k in ("Color1", "Color2", "Color3") if actual_val >= rules[k]), "Invalid")
+    return _status_colors(slide_data, color_key)
 
-        # --- Logic for Prod Tick/Cross ---
-        if shape.name == "Prod_Value" and is_prod_red:
-             shapes_to_remove.append(shape)
-        if shape.name == "Prod_Value_Cross" and not is_prod_red:
-             shapes_to_remove.append(shape)
 
-        # --- Logic for Test Tick/Cross ---
-        if shape.name == "Test_Value" and is_test_red:
-             shapes_to_remove.append(shape)
-        if shape.name == "Test_Value_Cross" and not is_test_red:
-             shapes_to_remove.append(shape)
+def utilization_status(table_key):
+    """
+    Higher is worse: the colour depends only on Prod %used (column 4), checked
+    from Color3 down. Each environment shows a tick, or a cross when it reaches
+    Color3; the Dev row is hidden for 2-environment customers.
+    """
+    def derive(slide_data, env_count):
+        rows = slide_data[table_key]["rows"]
+        rules = slide_data["Colour_Rules"]
+        used_val = float(rows[0][4])
+        color_key = next((k for k in ("Color3", "Color2", "Color1") if used_val >= rules[k]), "Invalid")
 
-        # --- Logic for Dev Tick/Cross ---
+        is_red = {"Prod": used_val >= rules["Color3"], "Test": float(rows[1][4]) >= rules["Color3"]}
         if env_count == 3:
-            if shape.name == "Dev_Value" and is_dev_red:
-                shapes_to_remove.append(shape)
-            if shape.name == "Dev_Value_Cross" and not is_dev_red:
-                shapes_to_remove.append(shape)
+            is_red["Dev"] = len(rows) > 2 and float(rows[2][4]) >= rules["Color3"]
+
+        hidden = {f"{label}_Value" if red else f"{label}_Value_Cross" for label, red in is_red.items()}
+        if env_count < 3:
+            hidden |= {"Dev_Value", "Dev_Value_Cross"}
+        if env_count == 2:
+            hidden.add("Dev_Text")
+        return dict(_status_colors(slide_data, color_key), hidden_shapes=hidden)
+    return derive
+
+
+STATUS_BINDINGS = {
+    "Circle_Color": Binding(None, "circle_rgb", render_solid_fill),
+    "Indicator": Binding(None, "indicator_rgb", render_gradient),
+    "Notes_User_Input": Binding("has_text_frame", "Notes_User_Input", render_notes),
+}
+UTILIZATION_BINDINGS = dict(
+    STATUS_BINDINGS,
+    Prod_Test=Binding("has_text_frame", "env_count", render_prod_test_height),
+)
+
+AVAILABILITY_CHART = Binding("has_chart", "Production_Availability_Chart", render_availability_chart)
+USER_COUNTS_CHART = Binding("has_chart", "Production_User_Counts_Chart", render_user_counts_chart)
+STORAGE_CHART = Binding("has_chart", "Production_Storage_Usage_Chart", render_storage_chart)
+
+# (slide index, data key, derive(slide_data, env_count) or None, {shape name: Binding})
+SLIDE_BINDINGS = (
+    (0, "slide1", None, {
+        "Customer_Name": Binding("has_text_frame", "Customer_Name", styled_text(40, WHITE)),
+        "Month": Binding("has_text_frame", "Month", styled_text(18, WHITE)),
+        "CSM_Name": Binding("has_text_frame", "CSM_Name", styled_text(18, WHITE)),
+    }),
+    (1, "slide2", availability_status, dict(
+        STATUS_BINDINGS,
+        Target_Value=Binding("has_text_frame", "Target_Value", render_text),
+        Actual_Value=Binding("has_text_frame", "Actual_Value", render_text),
+        Production_Availability_Chart=AVAILABILITY_CHART,
+    )),
+    (2, "slide3", utilization_status("User_License_Utilization_Table"), dict(
+        UTILIZATION_BINDINGS,
+        User_License_Utilization_Table=Binding(
+            "has_table", "User_License_Utilization_Table",
+            table_renderer(_license_cell, PP_ALIGN.CENTER, PP_ALIGN.RIGHT, trim=True)),
+        Production_User_Counts_Chart=USER_COUNTS_CHART,
+    )),
+    (3, "slide4", utilization_status("Storage_Utilization_Table"), dict(
+        UTILIZATION_BINDINGS,
+        Storage_Utilization_Table=Binding(
+            "has_table", "Storage_Utilization_Table",
+            table_renderer(_storage_cell, PP_ALIGN.CENTER, PP_ALIGN.RIGHT, trim=True)),
+        Production_Storage_Usage_Chart=STORAGE_CHART,
+    )),
+    (4, "slide5", None, {
+        "Case_Status_Table": Binding("has_table", "Case_Status_Table", table_renderer(_plain_cell)),
+        "Case_Trend_Chart": Binding("has_chart", "Case_Trend_Chart", render_chart),
+        "Open_Cases_Value": Binding("has_text_frame", "Open_Cases_Value", styled_text(40, WHITE)),
+    }),
+    (6, "slide7", None, {
+        "Production_Availability_Chart": AVAILABILITY_CHART,
+        "Production_User_Counts_Chart": USER_COUNTS_CHART,
+        "Production_Storage_Usage_Chart": STORAGE_CHART,
+    }),
+)
+
+
+def apply_bindings(slide, bindings, ctx):
+    """
+    One pass over the slide's shapes: each shape is looked up by name in
+    bindings and rendered; shapes named in ctx["hidden_shapes"] are removed
+    after the pass so removal does not disturb the iteration.
+    """
+    hidden = ctx.get("hidden_shapes", ())
+    shapes_to_remove = []
+    for shape in slide.shapes:
+        binding = bindings.get(shape.name)
+        if binding is not None and (binding.requires is None or getattr(shape, binding.requires)):
+            binding.render(shape, ctx.get(binding.key), ctx)
+        if shape.name in hidden:
+            shapes_to_remove.append(shape)
 
     for sh in shapes_to_remove:
         try:
             slide.shapes._spTree.remove(sh._element)
         except Exception:
             pass
-    shapes_to_remove.clear()
 
-    # ---Slide 5---
-    slide5_data = data["slide5"]
-    slide = prs.slides[4]
-    headers = slide5_data["Case_Status_Table"]["headers"]
-    rows = slide5_data["Case_Status_Table"]["rows"]
-    
-    for shape in slide.shapes:
-        if shape.name == "Case_Status_Table" and shape.has_table:
-            table = shape.table
-            for col_idx, header in enumerate(headers):
-                cell = table.cell(0, col_idx)
-                cell.text = str(header)
-                p = cell.text_frame.paragraphs[0]
-                p.font.size = Pt(12)
-                p.font.bold = True
-
-            for row_idx, row_data in enumerate(rows):
-                for col_idx, cell_data in enumerate(row_data):
-                    cell = table.cell(row_idx + 1, col_idx)
-                    cell.text = str(cell_data)
-                    p = cell.text_frame.paragraphs[0]
-                    p.font.size = Pt(12)
-
-        elif shape.name == "Case_Trend_Chart" and shape.has_chart:
-            chart = shape.chart
-            chart_data = CategoryChartData()
-            chart_data.categories = slide5_data["Case_Trend_Chart"]["Months"]
-            for series_name, values in slide5_data["Case_Trend_Chart"].items():
-                if series_name != "Months":
-                    chart_data.add_series(series_name, values)
-            chart.replace_data(chart_data)
-
-        elif shape.name == "Open_Cases_Value" and shape.has_text_frame:
-            p = shape.text_frame.paragraphs[0]
-            p.text = str(slide5_data["Open_Cases_Value"])
-            if not p.runs: p.add_run()
-            run = p.runs[0]
-            font = run.font
-            font.size = Pt(40)
-            font.color.rgb = RGBColor(255, 255, 255)
-
-    # ---Slide 7---
-    slide7_data = data["slide7"]
-    slide = prs.slides[6]
-    for shape in slide.shapes:
-        if shape.name == "Production_Availability_Chart" and shape.has_chart:
-            chart = shape.chart
-            availability = [val / 100 for val in slide7_data["Production_Availability_Chart"]["Availability"]]
-            sla = [val / 100 for val in slide7_data["Production_Availability_Chart"]["SLA"]]
-            chart_data = CategoryChartData()
-            chart_data.categories = slide7_data["Production_Availability_Chart"]["Months"]
-            chart_data.add_series("Availability", availability)
-            chart_data.add_series("SLA", sla)
-            chart.replace_data(chart_data)
-
-            value_axis = chart.value_axis
-            value_axis.minimum_scale = 0.93
-            value_axis.maximum_scale = 1.0
-            value_axis.tick_labels.number_format = '0.00%'
-
-            for series in chart.series:
-                if series.name == "Availability":
-                    series.has_data_labels = True
-                    series.data_labels.number_format = '0.00%'
-                    series.data_labels.show_value = True
-                else:
-                    series.has_data_labels = False
-
-        elif shape.name == "Production_User_Counts_Chart" and shape.has_chart:
-            chart = shape.chart
-            chart_data = CategoryChartData()
-            if env_count == 2:
-                plot = chart.plots[0]
-                series_list = list(plot.series)
-                for idx, s in enumerate(series_list):
-                    if s.name == "Dev":
-                        try:
-                            ser_element = plot._element.findall('.//{http://schemas.openxmlformats.org/drawingml/2006/chart}ser')[idx]
-                            plot._element.remove(ser_element)
-                        except (IndexError, ValueError):
-                            pass
-                        break
-
-            chart_data.categories = slide7_data["Production_User_Counts_Chart"]["Months"]
-            for series_name, values in slide7_data["Production_User_Counts_Chart"].items():
-                if series_name != "Months":
-                    chart_data.add_series(series_name, values)
-            chart.replace_data(chart_data)
-
-        elif shape.name == "Production_Storage_Usage_Chart" and shape.has_chart:
-            chart = shape.chart
-            chart.value_axis.tick_label_position = XL_TICK_LABEL_POSITION.LOW
-            chart_data = CategoryChartData()
-            chart_data.categories = slide7_data["Production_Storage_Usage_Chart"]["Months"]
-            for series_name, values in slide7_data["Production_Storage_Usage_Chart"].items():
-                if series_name != "Months":
-                    chart_data.add_series(series_name, values)
-            chart.replace_data(chart_data)
-            
-            for s in chart.plots[0].series:
-                if s.name == "Prod (GB)":
-                    s.data_labels.number_format = '#,##0'
-                    break
-
-    prs.save(output_filename)
-    print(f"Presentation saved as {output_filename}")
\ No newline at end of file
+
+def generate_presentation(data, output=None):
+    """
+    Generates the PowerPoint presentation with the provided data.
+    output may be a file path or a writable file-like object. When omitted the
+    deck is rendered into a new BytesIO, which is returned rewound.
+    """
+    prs = load_ppt_template()
+    env_count = data["slide3"].get("env_count")
+    chart_data = {}
+
+    for slide_idx, data_key, derive, bindings in SLIDE_BINDINGS:
+        slide_data = data[data_key]
+        ctx = dict(slide_data, env_count=env_count, chart_data=chart_data)
+        if derive is not None:
+            ctx.update(derive(slide_data, env_count))
+        apply_bindings(prs.slides[slide_idx], bindings, ctx)
+
+    if output is None:
+        output = BytesIO()
+        prs.save(output)
+        output.seek(0)
+        return output
+
+    prs.save(output)
+    if isinstance(output, (str, os.PathLike)):
+        print(f"Presentation saved as {output}")
+    return output
+
+# Bump when rendering changes, so decks cached by an older version are not served
+DECK_FORMAT_VERSION = 1
+
+
+def deck_cache_key(customer_config, month_rows, month_year):
+    """
+    Content hash of everything a deck depends on: the inputs of
+    prepare_data_dictionary, the template's mtime and DECK_FORMAT_VERSION.
+    """
+    payload = json.dumps(
+        [DECK_FORMAT_VERSION, os.path.getmtime(locate_ppt_template()), month_year,
+         customer_config, sorted(month_rows, key=attrgetter("month_year"))],
+        default=str, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_deck(short_code, customer_config, month_rows, month_year, charts=None):
+    """
+    Returns the .pptx bytes for one customer-month. Decks are cached on disk
+    by deck_cache_key, so a repeat request with unchanged data is a file read.
+    DbOperations drops a customer's cached decks when its data changes.
+    charts are derived from month_rows, so they are not part of the key.
+    """
+    key = deck_cache_key(customer_config, month_rows, month_year)
+    blob = deck_cache.get(short_code, key)
+    if blob is None:
+        data_dict = prepare_data_dictionary(customer_config, month_rows, month_year, charts)
+        blob = generate_presentation(data_dict).getvalue()
+        try:
+            deck_cache.set(short_code, key, blob)
+        except OSError as e:
+            print(f"[Warning] Could not cache deck for {short_code}: {e}")
+    return blob
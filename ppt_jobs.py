@@ -0,0 +1,139 @@
+"""
+Background PPT generation.
+
+A DeckJobQueue runs deck jobs on a small thread pool, so a web request only
+submits a job and polls for it. Each job fetches its data through the shared
+DB pool and renders in the ppt_batch process pool, which keeps the rendering
+work off the web process's GIL. The number of queued + running jobs is capped
+(submit raises QueueFull beyond it) and finished jobs, including their deck
+bytes, are dropped keep_finished seconds after they complete.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from db_pool import get_pool
+from ppt_batch import render_result, submit_render
+from ppt_generator import deck_filename, fetch_data, render_deck
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by DeckJobQueue.submit when max_pending jobs are already waiting or running."""
+
+
+class DeckJob:
+    def __init__(self, short_code, month):
+        self.id = uuid.uuid4().hex
+        self.short_code = short_code
+        self.month = month
+        self.status = QUEUED
+        self.error = None
+        self.filename = None
+        self.content = None
+        self.submitted_at = datetime.now()
+        self.finished_at = None
+        self.timings = {}
+        self._submitted = time.monotonic()
+        self._finished = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        """Blocks until the job finished; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'short_code': self.short_code,
+            'month': self.month,
+            'status': self.status,
+            'message': str(self.error) if self.error else None,
+            'filename': self.filename,
+            'submitted_at': self.submitted_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'finished_at': self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None,
+            'timings': self.timings,
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class DeckJobQueue:
+    def __init__(self, db_config, workers=2, max_pending=20, keep_finished=900, render_timeout=300):
+        self.db_config = db_config
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.render_timeout = render_timeout
+        self._jobs = {}     # job_id -> DeckJob
+        self._active = {}   # (short_code, month) -> queued/running DeckJob
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ppt-job')
+
+    def submit(self, short_code, month):
+        """
+        Queues a deck job and returns it. A job for the same customer-month that
+        is still queued or running is returned instead of starting a second one.
+        """
+        with self._lock:
+            self._cleanup()
+            job = self._active.get((short_code, month))
+            if job is not None:
+                return job
+            if len(self._active) >= self.max_pending:
+                raise QueueFull(f"{len(self._active)} decks are already being generated. Please retry shortly.")
+            job = DeckJob(short_code, month)
+            self._jobs[job.id] = job
+            self._active[(short_code, month)] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._cleanup()
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        started = time.monotonic()
+        job.status = RUNNING
+        job.timings['queued_ms'] = _ms(started - job._submitted)
+        try:
+            with get_pool(self.db_config).connection() as conn:
+                customer_config, month_rows = fetch_data(conn, job.short_code, job.month)
+            fetched = time.monotonic()
+            job.timings['fetch_ms'] = _ms(fetched - started)
+            if customer_config is None or not month_rows:
+                raise LookupError('No data found for this selection')
+
+            args = (job.short_code, customer_config, month_rows, job.month)
+            job.content = render_result(submit_render(render_deck, *args), render_deck, *args, timeout=self.render_timeout)
+            job.filename = deck_filename(job.short_code, job.month)
+            job.timings['render_ms'] = _ms(time.monotonic() - fetched)
+            job.status = DONE
+        except Exception as e:
+            print(f"PPT Job Error ({job.short_code} {job.month}): {e}")
+            job.error = e
+            job.status = FAILED
+        finally:
+            job._finished = time.monotonic()
+            job.finished_at = datetime.now()
+            job.timings['total_ms'] = _ms(job._finished - job._submitted)
+            with self._lock:
+                if self._active.get((job.short_code, job.month)) is job:
+                    del self._active[(job.short_code, job.month)]
+            job._done.set()
+
+    def _cleanup(self):
+        """Drops finished jobs (and their deck bytes) older than keep_finished. Caller holds the lock."""
+        cutoff = time.monotonic() - self.keep_finished
+        expired = [job_id for job_id, job in self._jobs.items() if job._finished is not None and job._finished < cutoff]
+        for job_id in expired:
+            self._jobs.pop(job_id).content = None
@@ -0,0 +1,98 @@
+"""
+Excel export of the Reporting page.
+
+Rows are written into an openpyxl write-only workbook as they arrive from
+DbOperations.stream_report_source, so only the current row is held in memory
+(openpyxl spools each sheet to a temp file). Values are typed numbers and
+dates rather than the display strings of load_report, and every customer gets
+its own sheet.
+"""
+import re
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+# (header, source column, multiplier, only for 3-environment customers)
+REPORT_XLSX_COLUMNS = [
+    ("Customer Name", "short_code", None, False),
+    ("Month & Year", "month_year", None, False),
+    ("CSM Primary", "csm_primary", None, False),
+    ("CSM Lead", "csm_lead", None, False),
+    ("Availability (%)", "updated_availability", 100, False),
+    ("Target (%)", "updated_target", 100, False),
+    ("Prod Limit", "updated_prod_limit", None, False),
+    ("Prod Used", "updated_prod_used", None, False),
+    ("Test Limit", "updated_test_limit", None, False),
+    ("Test Used", "updated_test_used", None, False),
+    ("Dev Limit", "updated_dev_limit", None, True),
+    ("Dev Used", "updated_dev_used", None, True),
+    ("Prod Target GB", "updated_prod_target_storage_gb", None, False),
+    ("Prod Actual GB", "updated_prod_storage_gb", None, False),
+    ("Test Target GB", "updated_test_target_storage_gb", None, False),
+    ("Test Actual GB", "updated_test_storage_gb", None, False),
+    ("Dev Target GB", "updated_dev_target_storage_gb", None, True),
+    ("Dev Actual GB", "updated_dev_storage_gb", None, True),
+    ("Opened Tickets", "updated_tickets_opened", None, False),
+    ("Closed Tickets", "updated_tickets_closed", None, False),
+    ("Current Backlog Tickets", "updated_tickets_current_backlog", None, False),
+    ("Tickets Backlog", "updated_tickets_overall_backlog", None, False),
+]
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_HEADER_FONT = Font(bold=True)
+_INVALID_TITLE_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def _sheet_title(short_code, used):
+    """Excel sheet names: max 31 chars, no []:*?/\\ and unique within the workbook."""
+    base = _INVALID_TITLE_CHARS.sub('_', str(short_code))[:31] or 'Report'
+    title, n = base, 1
+    while title.lower() in used:
+        n += 1
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+    used.add(title.lower())
+    return title
+
+
+def write_report_xlsx(rows, fileobj):
+    """
+    Writes report rows (dicts from stream_report_source, grouped by short_code)
+    to fileobj as .xlsx, one sheet per customer. Returns the number of rows written.
+    """
+    wb = Workbook(write_only=True)
+    used_titles = set()
+    current_sc = ws = columns = None
+    count = 0
+
+    for r in rows:
+        if r['short_code'] != current_sc:
+            current_sc = r['short_code']
+            envs = r.get('no_of_environments', 2)
+            columns = [c for c in REPORT_XLSX_COLUMNS if envs == 3 or not c[3]]
+            ws = wb.create_sheet(title=_sheet_title(current_sc, used_titles))
+            header = []
+            for title, *_ in columns:
+                cell = WriteOnlyCell(ws, value=title)
+                cell.font = _HEADER_FONT
+                header.append(cell)
+            ws.append(header)
+
+        values = []
+        for _, column, multiplier, _ in columns:
+            value = r.get(column)
+            if column == 'month_year':
+                value = WriteOnlyCell(ws, value=value)
+                value.number_format = 'mmmm yyyy'
+            elif multiplier is not None:
+                value = (value or 0) * multiplier
+            values.append(value)
+        ws.append(values)
+        count += 1
+
+    if ws is None:
+        wb.create_sheet(title='Report').append(["No Data"])
+    wb.save(fileobj)
+    return count